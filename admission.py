@@ -0,0 +1,124 @@
+import threading
+import time
+
+from cache_utils import TTLCache
+from reply_dispatcher import TokenBucket
+
+
+# admit() 的結果
+ACCEPT = "accept"
+DEGRADE = "degrade"
+
+
+# === 准入控制：處理中的事件數、每位使用者的並行數與請求頻率 ===
+class AdmissionController:
+    """決定收到的事件要正常處理或降級（只回覆固定訊息或延後處理）；文字訊息一律正常處理。
+
+    - 每位使用者一個令牌桶（每秒 user_rate 個，最多累積 user_burst 個），
+      超過頻率的耗時工作（圖片分析）降級，單一使用者洗版不會佔滿工作執行緒；user_rate=0 表示不限制
+    - 處理中（含排隊）的事件達到 max_in_flight，或同一位使用者處理中的事件達到
+      max_user_in_flight 時，耗時的工作降級
+    - max_in_flight=0 / max_user_in_flight=0 表示不限制
+
+    呼叫端在事件放入佇列時呼叫 enter()，處理完（或被丟棄）時呼叫 leave()；
+    交給延後佇列時呼叫 defer()，處理完時呼叫 undefer()。
+    """
+
+    def __init__(self, max_in_flight=200, max_user_in_flight=5, user_rate=1.0, user_burst=20,
+                 max_users=100000, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_user_in_flight = max_user_in_flight
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.clock = clock
+        # 閒置超過這段時間的令牌桶必定已補滿，刪除後重新建立的結果相同
+        idle_ttl = max(60.0, user_burst / user_rate) if user_rate > 0 else 60.0
+        self._buckets = TTLCache(max_entries=max_users, ttl=idle_ttl, clock=clock)
+        self._lock = threading.Lock()
+        self._user_in_flight = {}
+        self._user_deferred = {}
+        self.in_flight = 0
+        self.deferred = 0
+        self.accepted = 0
+        self.degraded = 0
+
+    def _rate_limited(self, user_id):
+        # 沒有使用者 ID 的事件（例如部分群組事件）不限制頻率
+        if self.user_rate <= 0 or not user_id:
+            return False
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, self.clock)
+        # 每次使用都重新放入，延長閒置期限
+        self._buckets.set(user_id, bucket)
+        return not bucket.try_acquire()
+
+    def overloaded(self, user_id=None):
+        """目前是否應該降級耗時的工作（整體或這位使用者處理中的事件過多）"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if user_id is not None and self.max_user_in_flight \
+                and self._user_in_flight.get(user_id, 0) >= self.max_user_in_flight:
+            return "user_concurrency"
+        return None
+
+    def admit(self, user_id, heavy=False):
+        """回傳 (ACCEPT / DEGRADE, 原因)；文字訊息也會用掉令牌，但一律回傳 ACCEPT"""
+        with self._lock:
+            rate_limited = self._rate_limited(user_id)
+            reason = None
+            if heavy:
+                reason = "user_rate" if rate_limited else self.overloaded(user_id)
+            if reason:
+                self.degraded += 1
+                return DEGRADE, reason
+            self.accepted += 1
+            return ACCEPT, None
+
+    def enter(self, user_id, count=1):
+        with self._lock:
+            self.in_flight += count
+            self._user_in_flight[user_id] = self._user_in_flight.get(user_id, 0) + count
+
+    def leave(self, user_id, count=1):
+        with self._lock:
+            self.in_flight -= count
+            remaining = self._user_in_flight.get(user_id, 0) - count
+            if remaining > 0:
+                self._user_in_flight[user_id] = remaining
+            else:
+                self._user_in_flight.pop(user_id, None)
+
+    def user_in_flight(self, user_id):
+        with self._lock:
+            return self._user_in_flight.get(user_id, 0)
+
+    def defer(self, user_id, count=1):
+        with self._lock:
+            self.deferred += count
+            self._user_deferred[user_id] = self._user_deferred.get(user_id, 0) + count
+
+    def undefer(self, user_id, count=1):
+        with self._lock:
+            self.deferred -= count
+            remaining = self._user_deferred.get(user_id, 0) - count
+            if remaining > 0:
+                self._user_deferred[user_id] = remaining
+            else:
+                self._user_deferred.pop(user_id, None)
+
+    def has_deferred(self, user_id):
+        """這位使用者是否有尚未處理完的延後事件（之後的事件也要延後，才能依序處理）"""
+        with self._lock:
+            return user_id in self._user_deferred
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "deferred": self.deferred,
+                "busy_users": len(self._user_in_flight),
+                "tracked_users": len(self._buckets),
+                "accepted": self.accepted,
+                "degraded": self.degraded,
+            }
@@ -0,0 +1,424 @@
+import argparse
+import logging
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+
+from analyzers import load_analyzer
+
+AUTHKEY_ENV = "ANALYSIS_WORKER_AUTHKEY"
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+
+class AnalysisError(Exception):
+    """分析工作失敗（分析器發生例外、工作行程當掉或佇列已滿）"""
+
+
+class AnalysisTimeout(AnalysisError):
+    """分析工作超過時間上限，執行中的工作行程已被重新啟動"""
+
+
+# === 在目前的執行緒直接分析（ANALYSIS_PROCESSES=0） ===
+class InlineAnalysis:
+    remote = False
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.analyzer.load()
+        self.completed = 0
+        self.failed = 0
+
+    def _run(self, method, payload):
+        try:
+            result = method(payload)
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        return result
+
+    @property
+    def version(self):
+        return self.analyzer.version
+
+    def analyze_text(self, text):
+        return self._run(self.analyzer.analyze_text, text)
+
+    def analyze_image(self, data):
+        return self._run(self.analyzer.analyze_image, data)
+
+    def analyze_image_batch(self, images):
+        return self._run(self.analyzer.analyze_image_batch, images)
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "mode": "inline",
+            "analyzer": self.analyzer.name,
+            "version": self.version,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+# === 行程池：每個工作行程載入一次模型，圖片透過共享記憶體傳遞 ===
+class AnalysisPool:
+    """CPU 密集的分析交給獨立的工作行程，不受 GIL 限制，吞吐量隨 CPU 核心數增加。
+
+    每個工作行程由一個管理執行緒負責：從共用佇列取出工作、送到行程並等待結果。
+    超過 timeout 秒沒有回應或行程當掉時，直接結束該行程並重新啟動，該工作以例外結束。
+    圖片內容複製到每個工作行程專用的共享記憶體區塊，只傳送區塊名稱與長度，不經過 pickle。
+    """
+    remote = True
+
+    def __init__(self, analyzer_spec, processes=2, timeout=10.0, max_queue_size=1000, start_timeout=60.0,
+                 name="analysis-worker"):
+        self.analyzer_spec = analyzer_spec
+        self.processes = max(1, int(processes))
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.name = name
+        self._jobs = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._workers = [_Worker(self, index) for index in range(self.processes)]
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        # 工作行程載入分析器後回報的版本（尚未就緒時為空字串）
+        self.version = ""
+
+        # 統計資料
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.rejected = 0
+
+    # 第一次送出工作時才啟動，import 時不產生副作用；需要預熱時可先呼叫 start()
+    def start(self):
+        with self._lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+            for worker in self._workers:
+                worker.thread.start()
+
+    def submit(self, kind, payload):
+        """送出工作並回傳 Future；佇列已滿時 Future 直接以 AnalysisError 結束"""
+        self.start()
+        future = Future()
+        if self._closed:
+            future.set_exception(AnalysisError("分析行程池已關閉"))
+            return future
+        try:
+            self._jobs.put_nowait((future, kind, payload))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            future.set_exception(AnalysisError("分析佇列已滿"))
+        return future
+
+    def analyze_text(self, text):
+        return self.submit("text", text).result()
+
+    def analyze_image(self, data):
+        # 呼叫端在結果回來前會保留 data，管理執行緒可以直接從它複製到共享記憶體
+        return self.submit("image", data).result()
+
+    def analyze_image_batch(self, images):
+        """整批圖片放進同一塊共享記憶體，由一個工作行程一次推論"""
+        return self.submit("image_batch", images).result()
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def close(self, timeout=5.0):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            started = self._started
+        if started:
+            for _ in self._workers:
+                self._jobs.put(None)
+            for worker in self._workers:
+                worker.thread.join(timeout)
+        for worker in self._workers:
+            worker.stop()
+        # 還在佇列中的工作直接結束，避免呼叫端永遠等待
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].set_exception(AnalysisError("分析行程池已關閉"))
+
+    def stats(self):
+        return {
+            "mode": "process",
+            "analyzer": self.analyzer_spec,
+            "version": self.version,
+            "processes": self.processes,
+            "alive": sum(1 for worker in self._workers if worker.alive),
+            "busy": sum(1 for worker in self._workers if worker.busy),
+            "queued": self._jobs.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "rejected": self.rejected,
+        }
+
+
+class _Worker:
+    """管理單一工作行程的執行緒"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.busy = False
+        self._shm = None
+        self.thread = threading.Thread(target=self._loop, name=f"{pool.name}-{index}", daemon=True)
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _loop(self):
+        try:
+            self._start()
+        except Exception as e:
+            logging.error(f"分析工作行程啟動失敗：{str(e)}")
+        while True:
+            job = self.pool._jobs.get()
+            if job is None:
+                return
+            future, kind, payload = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.busy = True
+            try:
+                if not self.alive:
+                    self._restart("not running")
+                result = self._call(kind, payload)
+            except Exception as e:
+                self.pool._count("failed")
+                future.set_exception(e)
+            else:
+                self.pool._count("completed")
+                future.set_result(result)
+            finally:
+                self.busy = False
+
+    def _call(self, kind, payload):
+        if kind == "image":
+            name, spans = self._stage_images([payload])
+            message = ("image", name, spans[0][1])
+        elif kind == "image_batch":
+            message = ("image_batch",) + self._stage_images(payload)
+        else:
+            message = (kind, payload)
+        try:
+            self.conn.send(message)
+            ready = self.conn.poll(self.pool.timeout)
+        except (OSError, EOFError):
+            self._restart("crashed")
+            raise AnalysisError("分析工作行程異常結束")
+        if not ready:
+            self.pool._count("timeouts")
+            self._restart("timeout")
+            raise AnalysisTimeout(f"分析超過 {self.pool.timeout} 秒")
+        try:
+            status, value = self.conn.recv()
+        except (OSError, EOFError):
+            self._restart("crashed")
+            raise AnalysisError("分析工作行程異常結束")
+        if status != "ok":
+            raise AnalysisError(value)
+        return value
+
+    def _stage_images(self, images):
+        """把圖片依序複製到這個工作行程專用的共享記憶體，不夠大時換一塊更大的；
+        回傳 (區塊名稱, [(起點, 長度), ...])"""
+        views = [data if isinstance(data, memoryview) else memoryview(data) for data in images]
+        total = sum(view.nbytes for view in views)
+        if self._shm is None or self._shm.size < total:
+            self._release_shm()
+            self._shm = shared_memory.SharedMemory(create=True, size=max(total, 1024 * 1024))
+        spans = []
+        offset = 0
+        for view in views:
+            size = view.nbytes
+            self._shm.buf[offset:offset + size] = view.cast("B")
+            spans.append((offset, size))
+            offset += size
+        return self._shm.name, spans
+
+    def _release_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._shm = None
+
+    def _start(self):
+        """啟動工作行程，等待它載入模型完成；失敗時結束行程並拋出例外"""
+        try:
+            self._spawn()
+        except BaseException:
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+            self.stop()
+            raise
+
+    def _spawn(self):
+        authkey = os.urandom(32)
+        server = socket.create_server(("127.0.0.1", 0))
+        try:
+            env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+            host, port = server.getsockname()[:2]
+            self.process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, "--worker", self.pool.analyzer_spec, host, str(port)],
+                env=env,
+            )
+            deadline = time.monotonic() + self.pool.start_timeout
+            server.settimeout(0.2)
+            while True:
+                try:
+                    sock, _ = server.accept()
+                    break
+                except socket.timeout:
+                    if self.process.poll() is not None:
+                        raise AnalysisError(f"分析工作行程啟動後立即結束（結束碼 {self.process.returncode}）")
+                    if time.monotonic() >= deadline:
+                        raise AnalysisError("等待分析工作行程連線逾時")
+        finally:
+            server.close()
+        sock.setblocking(True)
+        self.conn = Connection(sock.detach())
+        deliver_challenge(self.conn, authkey)
+        answer_challenge(self.conn, authkey)
+        if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+            raise AnalysisError("等待分析模型載入逾時")
+        status, value = self.conn.recv()
+        if status != "ready":
+            raise AnalysisError(f"分析模型載入失敗：{value}")
+        pid, self.pool.version = value
+        logging.info("分析工作行程 %s 已就緒（pid %s，版本 %s）", self.index, pid, self.pool.version)
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(("stop", None))
+            except OSError:
+                pass
+        if self.process is not None:
+            try:
+                self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.process = None
+        self._release_shm()
+
+    def _restart(self, reason):
+        logging.warning("分析工作行程 %s 重新啟動（%s）", self.index, reason)
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+        self.stop()
+        self.pool._count("restarts")
+        self._start()
+
+
+# === 工作行程主程式 ===
+def _attach_shm(name):
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # 區塊由主行程建立與釋放；工作行程只借用，不能讓自己的 resource tracker 在結束時刪除它
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def worker_main(analyzer_spec, host, port):
+    authkey = bytes.fromhex(os.environ.pop(AUTHKEY_ENV))
+    conn = Connection(socket.create_connection((host, port)).detach())
+    answer_challenge(conn, authkey)
+    deliver_challenge(conn, authkey)
+
+    try:
+        analyzer = load_analyzer(analyzer_spec)
+        analyzer.load()
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", (os.getpid(), str(analyzer.version))))
+
+    shm = None
+    while True:
+        try:
+            kind, *args = conn.recv()
+        except EOFError:
+            break
+        if kind == "stop":
+            break
+        try:
+            if kind == "text":
+                result = analyzer.analyze_text(args[0])
+            elif kind in ("image", "image_batch"):
+                name, spans = args
+                if shm is None or shm.name != name:
+                    if shm is not None:
+                        shm.close()
+                    shm = _attach_shm(name)
+                if kind == "image":
+                    views = [shm.buf[:spans]]
+                else:
+                    views = [shm.buf[offset:offset + size] for offset, size in spans]
+                try:
+                    if kind == "image":
+                        result = analyzer.analyze_image(views[0])
+                    else:
+                        # 單張失敗的例外可能無法 pickle，轉成 AnalysisError 傳回
+                        result = [AnalysisError(f"{type(item).__name__}: {item}") if isinstance(item, Exception)
+                                  else item for item in analyzer.analyze_image_batch(views)]
+                finally:
+                    for view in views:
+                        view.release()
+            else:
+                raise ValueError(f"未知的工作類型：{kind}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    if shm is not None:
+        shm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分析工作行程（由 AnalysisPool 啟動）")
+    parser.add_argument("--worker", nargs=3, metavar=("ANALYZER", "HOST", "PORT"), required=True)
+    args = parser.parse_args()
+    spec, host, port = args.worker
+    # 以模組名稱重新 import，傳回的 AnalysisError 才能在主行程 unpickle
+    import analysis_pool
+    analysis_pool.worker_main(spec, host, int(port))
@@ -0,0 +1,198 @@
+import threading
+import time
+import uuid
+from collections import deque
+
+from cache_utils import TTLCache
+
+
+# === 分析 API 的對話 session：只傳送新訊息，由 API 端保留上下文 ===
+# 請求：{"current_message": ..., "session": {"id": ..., "seq": n, "messages": [...], "reset": false}}
+#   seq 為送出的第一則訊息的序號（等於用戶端認為 API 端已經收到的訊息數）
+# 回應：{"status": "success", "data": ..., "session": {"id": ..., "seq": API 端目前的訊息數}}
+# 序號對不上（API 端重新啟動、session 過期或中間遺漏）時回應 409：
+#   {"status": "resync", "session": {"id": ..., "seq": API 端目前的訊息數}}
+# 用戶端收到後以 reset=true 送出完整的上下文視窗重新同步。
+
+
+class SessionResync(Exception):
+    def __init__(self, session_id, expected_seq):
+        super().__init__(f"session {session_id} 需要重新同步（API 端序號 {expected_seq}）")
+        self.session_id = session_id
+        self.expected_seq = expected_seq
+
+
+def _window(messages, nbytes, max_messages, max_bytes):
+    """從最舊的開始捨棄，直到則數與大小都在上限內（至少保留最新的一則）"""
+    while len(messages) > 1 and (len(messages) > max_messages or nbytes > max_bytes):
+        nbytes -= len(messages.popleft().encode("utf-8"))
+    return nbytes
+
+
+class _Session:
+    __slots__ = ("seq", "messages", "nbytes", "lock")
+
+    def __init__(self):
+        self.seq = 0
+        self.messages = deque()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+
+# === API 端：每個 session 保留最近的訊息 ===
+class AnalysisSessionStore:
+    """每個 session 保留最近 max_messages 則、合計不超過 max_bytes 的訊息作為分析上下文；
+    閒置超過 ttl 秒或超過 max_sessions 個時淘汰，之後的請求會要求用戶端重新同步。"""
+
+    def __init__(self, max_sessions=100000, ttl=1800.0, max_messages=20, max_bytes=16 * 1024,
+                 clock=time.monotonic):
+        self.max_messages = max(1, int(max_messages))
+        self.max_bytes = max_bytes
+        self._sessions = TTLCache(max_entries=max_sessions, ttl=ttl, clock=clock)
+        self._lock = threading.Lock()
+        self.applied = 0
+        self.duplicates = 0
+        self.resyncs = 0
+        self.resets = 0
+
+    def apply(self, session_id, seq, messages, reset=False):
+        """加入新訊息，回傳 (目前的序號, 上下文訊息列表)；序號對不上時拋出 SessionResync"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if reset or (session is None and seq == 0):
+                session = _Session()
+                session.seq = seq
+            if session is None:
+                self.resyncs += 1
+                raise SessionResync(session_id, 0)
+            # 每次使用都重新放入，延長閒置期限
+            self._sessions.set(session_id, session)
+
+        with session.lock:
+            if seq > session.seq:
+                # 中間有訊息沒有收到
+                with self._lock:
+                    self.resyncs += 1
+                raise SessionResync(session_id, session.seq)
+            # 上一次的回應遺失而重送時，已經收到的訊息不重複加入
+            skip = session.seq - seq
+            for message in messages[skip:]:
+                session.messages.append(message)
+                session.nbytes += len(message.encode("utf-8"))
+            session.seq = max(session.seq, seq + len(messages))
+            session.nbytes = _window(session.messages, session.nbytes, self.max_messages, self.max_bytes)
+            context = list(session.messages)
+            current_seq = session.seq
+        with self._lock:
+            self.applied += 1
+            self.duplicates += min(skip, len(messages))
+            self.resets += 1 if reset else 0
+        return current_seq, context
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "applied": self.applied,
+                "duplicates": self.duplicates,
+                "resyncs": self.resyncs,
+                "resets": self.resets,
+            }
+
+
+class _ClientSession:
+    __slots__ = ("id", "seq", "pending", "needs_reset")
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.seq = 0
+        self.pending = []
+        # 新的 session 也以完整上下文開始，之前的對話紀錄才會進入 API 端的上下文
+        self.needs_reset = True
+
+
+# === 用戶端：記錄每位使用者的 session 與 API 端尚未確認的訊息 ===
+class AnalysisSessionClient:
+    """record() 記下每則新訊息（包含命中快取、沒有呼叫 API 的訊息），build() 產生請求，
+    收到回應後呼叫 ack()，收到 409 時呼叫 resync()。
+
+    待確認的訊息超過 max_pending 則（API 長時間無法使用）時改為重新同步，不無限累積。
+    """
+
+    def __init__(self, max_users=100000, ttl=1800.0, max_pending=20, clock=time.monotonic):
+        self.max_pending = max(1, int(max_pending))
+        self._sessions = TTLCache(max_entries=max_users, ttl=ttl, clock=clock)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.resets = 0
+        self.resyncs = 0
+
+    def _session(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = _ClientSession()
+        # 每次使用都重新放入，延長閒置期限
+        self._sessions.set(user_id, session)
+        return session
+
+    def record(self, user_id, message):
+        with self._lock:
+            session = self._session(user_id)
+            session.pending.append(message)
+            if len(session.pending) > self.max_pending:
+                session.pending = []
+                session.needs_reset = True
+
+    def build(self, user_id, payload, context):
+        """回傳要送出的請求內容：payload 去掉 chat_history 後加上 session；
+        context 為重新同步時送出的完整上下文（最後一則為目前的訊息）"""
+        with self._lock:
+            session = self._session(user_id)
+            self.requests += 1
+            if session.needs_reset:
+                return self._reset_payload(session, payload, context)
+            body = {key: value for key, value in payload.items() if key != "chat_history"}
+            body["session"] = {"id": session.id, "seq": session.seq, "messages": list(session.pending)}
+            return body
+
+    def resync(self, user_id, payload, context):
+        """API 端要求重新同步：回傳以完整上下文重設 session 的請求內容"""
+        with self._lock:
+            self.resyncs += 1
+            session = self._session(user_id)
+            session.pending = []
+            session.needs_reset = True
+            return self._reset_payload(session, payload, context)
+
+    def _reset_payload(self, session, payload, context):
+        # 完整上下文已包含待確認的訊息；ack 之前收到的新訊息另外累積
+        session.pending = []
+        self.resets += 1
+        body = {key: value for key, value in payload.items() if key != "chat_history"}
+        body["session"] = {"id": session.id, "seq": 0, "messages": list(context), "reset": True}
+        return body
+
+    def ack(self, user_id, body, response_session):
+        """API 端確認收到：捨棄已確認的訊息"""
+        sent = body["session"]
+        seq = response_session["seq"]
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or session.id != sent["id"]:
+                return
+            if sent.get("reset"):
+                session.needs_reset = False
+                session.seq = seq
+            elif not session.needs_reset and seq > session.seq:
+                # 同一位使用者的請求可能同時送出，回應的順序不一定，序號只往前推進
+                del session.pending[:seq - session.seq]
+                session.seq = seq
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._sessions),
+                "requests": self.requests,
+                "resets": self.resets,
+                "resyncs": self.resyncs,
+            }
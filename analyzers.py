@@ -0,0 +1,207 @@
+import importlib
+import io
+import os
+from datetime import datetime
+
+
+def _imaging():
+    """numpy 與 Pillow 為選用套件，只有批次圖片模型需要；第一次使用時才 import。
+    回傳 (numpy, PIL.Image)，未安裝時為 (None, None)"""
+    try:
+        import numpy
+        from PIL import Image
+    except ImportError:
+        return None, None
+    return numpy, Image
+
+
+def __getattr__(name):
+    # analyzers.np / analyzers.Image：import numpy 約需 0.1 秒，不在載入模組時進行
+    if name in ("np", "Image"):
+        return _imaging()[0 if name == "np" else 1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+from keyword_engine import KeywordEngine
+
+DEFAULT_ANALYZER = "analyzers:DefaultAnalyzer"
+DEFAULT_KEYWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scam_keywords.tsv")
+
+
+# === 分析器介面 ===
+class Analyzer:
+    """每個工作行程只建立一次分析器，load() 載入模型後重複處理多個工作。
+
+    analyze_image 收到的圖片內容是 memoryview（可能直接指向共享記憶體），
+    只在呼叫期間有效，不要保留參照。回傳值必須可以 pickle。
+
+    analyze_text 回傳 dict：label（"scam" / "safe"）、confidence（0～1）與 reply 為必要欄位；
+    matches（[{"category", "weight", ...}]，供對話風險累計）為選用欄位，沒有時視為沒有命中任何關鍵字。
+    """
+    name = "base"
+    version = "1"
+
+    def load(self):
+        pass
+
+    def analyze_text(self, text):
+        raise NotImplementedError
+
+    def analyze_image(self, data):
+        raise NotImplementedError
+
+    def analyze_image_batch(self, images):
+        """一次分析多張圖片，回傳等長的結果串列；某一張失敗時該位置放 Exception。
+        預設逐張呼叫 analyze_image，批次模型應覆寫成一次推論。"""
+        results = []
+        for data in images:
+            try:
+                results.append(self.analyze_image(data))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+# === 批次圖片模型的基底：解碼並縮放成同一個 NumPy 陣列後一次推論 ===
+class BatchImageAnalyzer(Analyzer):
+    """子類別實作 predict(batch)：batch 為 (N, 高, 寬, 3) 的 uint8 陣列，回傳 N 個結果。
+    無法解碼的圖片不放進批次，該位置的結果為例外。"""
+    name = "batch"
+    input_size = (224, 224)  # (寬, 高)
+
+    def load(self):
+        np, Image = _imaging()
+        if np is None or Image is None:
+            raise RuntimeError("批次圖片分析需要安裝 numpy 與 Pillow")
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def analyze_image(self, data):
+        result = self.analyze_image_batch([data])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def analyze_image_batch(self, images):
+        np, _ = _imaging()
+        width, height = self.input_size
+        batch = np.empty((len(images), height, width, 3), dtype=np.uint8)
+        results = [None] * len(images)
+        decoded = []
+        for index, data in enumerate(images):
+            try:
+                decode_image_into(data, batch[len(decoded)])
+            except Exception as e:
+                results[index] = ValueError(f"無法解碼圖片：{str(e)}")
+                continue
+            decoded.append(index)
+        if decoded:
+            predictions = list(self.predict(batch[:len(decoded)]))
+            if len(predictions) != len(decoded):
+                raise RuntimeError(f"predict 結果數量不符：送出 {len(decoded)} 張，收到 {len(predictions)} 個")
+            for index, prediction in zip(decoded, predictions):
+                results[index] = prediction
+        return results
+
+
+def decode_image_into(data, out):
+    """把圖片解碼成 RGB 並縮放到 out 的大小（out 為 (高, 寬, 3) 的 uint8 陣列），直接寫入 out"""
+    np, Image = _imaging()
+    height, width = out.shape[:2]
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG 可直接以較低解析度解碼，省下大部分解碼時間
+        img.draft("RGB", (width, height))
+        img = img.convert("RGB")
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.BILINEAR)
+        out[...] = np.asarray(img)
+
+
+# === 預設分析器：關鍵字比對文字，依圖片大小與時間模擬圖片分析 ===
+class DefaultAnalyzer(Analyzer):
+    name = "default"
+
+    def __init__(self, keyword_engine=None):
+        self.keyword_engine = keyword_engine
+
+    @property
+    def version(self):
+        return self.keyword_engine.version if self.keyword_engine is not None else ""
+
+    def load(self):
+        if self.keyword_engine is None:
+            self.keyword_engine = KeywordEngine(
+                os.getenv("SCAM_KEYWORDS_FILE", DEFAULT_KEYWORDS_FILE),
+                reload_interval=float(os.getenv("KEYWORD_RELOAD_INTERVAL", "2.0")),
+            )
+            self.keyword_engine.reload()  # 啟動時就載入關鍵字，第一個工作不必等待
+
+    def analyze_text(self, text):
+        matches = self.keyword_engine.scan(text)
+        matched = [
+            {"phrase": m.phrase, "category": m.category, "weight": m.weight}
+            for m in matches
+        ]
+
+        if matches:
+            return {
+                "label": "scam",
+                "confidence": 0.9,
+                "reply": "這是我投資成功的故事，你想聽嗎？",
+                "matches": matched
+            }
+        else:
+            return {
+                "label": "safe",
+                "confidence": 0.1,
+                "reply": "哈哈你說得真有趣，我懂你！",
+                "matches": matched
+            }
+
+    def analyze_image(self, data):
+        file_size = len(data) if not isinstance(data, memoryview) else data.nbytes
+
+        # 根據圖片大小和時間生成不同的模擬結果
+        current_hour = datetime.now().hour
+        current_minute = datetime.now().minute
+
+        # 使用時間和檔案大小來生成不同的結果
+        if file_size < 100000:  # 小於 100KB
+            scam_type = "low_quality_scam"
+            confidence = 0.6
+            risk_level = "medium"
+            elements = ["blurry_image", "low_resolution"]
+        elif current_hour % 2 == 0:  # 偶數小時
+            scam_type = "investment_scam"
+            confidence = 0.85
+            risk_level = "high"
+            elements = ["fake_investment", "urgency", "high_returns"]
+        else:  # 奇數小時
+            scam_type = "phishing_scam"
+            confidence = 0.75
+            risk_level = "high"
+            elements = ["fake_website", "personal_info", "urgency"]
+
+        # 根據分鐘數調整可信度
+        confidence = min(0.95, confidence + (current_minute / 100))
+
+        return {
+            "is_scam": True,
+            "confidence": confidence,
+            "details": {
+                "scam_type": scam_type,
+                "risk_level": risk_level,
+                "detected_elements": elements,
+                "image_size": file_size,
+                "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        }
+
+
+def load_analyzer(spec):
+    """spec 格式為「模組:類別」，例如 analyzers:DefaultAnalyzer；回傳分析器實例（尚未 load）"""
+    module_name, _, class_name = spec.partition(":")
+    if not module_name or not class_name:
+        raise ValueError(f"分析器格式錯誤（應為 模組:類別）：{spec}")
+    analyzer_class = getattr(importlib.import_module(module_name), class_name)
+    return analyzer_class()
@@ -1,149 +1,316 @@
-from flask import Flask, request, abort, Response, jsonify
+from flask import Flask, Blueprint, request, abort, Response, jsonify, g, current_app
 from flask_cors import CORS
 import json
-import requests
+import atexit
 import logging
+import functools
+import glob
+import hashlib
+import threading
+import time
 import traceback
 import os
 from dotenv import load_dotenv
 import tempfile
-import uuid
 from datetime import datetime
 import shutil
-import hmac
-import hashlib
-import base64
-
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from contextlib import contextmanager
 
+from event_dispatcher import EventDispatcher
+from admission import AdmissionController, DEGRADE
+from analysis_session import AnalysisSessionStore, AnalysisSessionClient, SessionResync
+from request_profiler import RequestProfiler
+from keyword_engine import KeywordEngine
+from components import Component, default_registry
+from profile_cache import ProfileCache, LazyProfile, AnalysisData
+from chat_history import ChatHistoryStore
+from risk_state import RiskStateStore, STAGE_NAMES
+from analyzers import DEFAULT_ANALYZER, DefaultAnalyzer, load_analyzer
+from analysis_pool import InlineAnalysis
+from image_pipeline import ImageBuffer, ImageDownloadError, copy_image_stream, download_to_buffer, image_bytes
+from image_cache import ImageResultCache
+from text_cache import TextResultCache, normalize_text
+from micro_batch import MicroBatcher
+from reply_dispatcher import ReplyDispatcher
+from log_config import configure_logging, log_payload, should_log_payload, LazyJson
+import metrics
+from metrics import instrument, timed_stage
+import webhook_codec
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
+# 路由註冊在 blueprint，由 create_app() 建立 Flask 應用程式；
+# import 這個模組不會檢查憑證、設定日誌或建立元件，工具與測試可以直接使用分析函式
+bp = Blueprint("scam_bot", __name__)
 
-app = Flask(__name__)
-CORS(app)  # 啟用 CORS 支援
-
-# 載入環境變數
+# 載入環境變數（不覆蓋已存在的環境變數；下方設定都是模組常數，需在這之後讀取）
 load_dotenv()
 
 # 從環境變數讀取設定
 CHANNEL_ACCESS_TOKEN = os.getenv("CHANNEL_ACCESS_TOKEN")
 CHANNEL_SECRET = os.getenv("CHANNEL_SECRET")
 ASSERTION_SIGNING_KEY = os.getenv("ASSERTION_SIGNING_KEY")
+# LINE API 位址（壓力測試時可指向 benchmarks/fake_line_api.py）
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me").rstrip("/")
+LINE_DATA_API_BASE = os.getenv("LINE_DATA_API_BASE", "https://api-data.line.me").rstrip("/")
+
+# === 行程初始化（每個行程一次；fork 出的工作行程會重新執行） ===
+_process_lock = threading.Lock()
+_process_pid = None
+
+def init_process():
+    """檢查憑證、設定日誌與多行程指標；同一個行程重複呼叫不會重做"""
+    global _process_pid
+    if _process_pid == os.getpid():
+        return
+    with _process_lock:
+        if _process_pid == os.getpid():
+            return
+        # 檢查必要的環境變數
+        if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
+            raise ValueError("請在 .env 檔案中設定 CHANNEL_ACCESS_TOKEN 和 CHANNEL_SECRET")
+
+        # === 日誌設定 ===
+        # LOG_FORMAT=json 輸出結構化日誌；預設透過背景執行緒寫出，token 與簽名會被遮蔽
+        # （fork 後背景執行緒不存在，工作行程重新設定一次）
+        configure_logging(
+            level=os.getenv("LOG_LEVEL", "INFO"),
+            fmt=os.getenv("LOG_FORMAT", "text"),
+            async_handler=os.getenv("LOG_ASYNC", "true").lower() != "false",
+            payload_sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0")),
+            secrets=[CHANNEL_ACCESS_TOKEN, CHANNEL_SECRET, ASSERTION_SIGNING_KEY],
+        )
 
-# 檢查必要的環境變數
-if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
-    raise ValueError("請在 .env 檔案中設定 CHANNEL_ACCESS_TOKEN 和 CHANNEL_SECRET")
+        # === 效能指標（/metrics）===
+        # 以多個工作行程執行（例如 gunicorn -w 4）時，設定 METRICS_MULTIPROC_DIR 讓各行程的數值合併輸出
+        metrics.configure_multiprocess(
+            os.getenv("METRICS_MULTIPROC_DIR"),
+            flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "5")),
+        )
+        _process_pid = os.getpid()
+
+# === 對外 HTTP 請求設定（連線池、逾時與重試） ===
+# timeout 為（連線逾時, 讀取逾時）秒數
+HTTP_ENDPOINTS = {
+    # 回覆的重試由回覆佇列（reply_dispatcher.py）負責，這裡不重試
+    "line_reply": {"timeout": (3.05, 10), "retries": 0, "idempotent": False},
+    "line_push": {"timeout": (3.05, 10), "retries": 0, "idempotent": False},
+    "line_profile": {"timeout": (3.05, 5), "retries": 2},
+    "line_content": {"timeout": (3.05, 30), "retries": 2},
+    "analysis_api": {"timeout": (1.0, 5), "retries": 1, "idempotent": True},
+}
+
+# === 延遲建立的元件 ===
+# 第一次使用時才建立；fork_safe=True 的元件可以在 fork 前由 preload() 先建立，
+# 其餘（行程池、SQLite 連線、背景執行緒）在每個工作行程各自建立
+def _create_http_client():
+    # requests 約需 0.1 秒載入，第一次對外請求時才 import
+    from http_client import HttpClient
+    return HttpClient(
+        HTTP_ENDPOINTS,
+        pool_maxsize=int(os.getenv("HTTP_POOL_SIZE", "20")),
+        failure_threshold=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("HTTP_BREAKER_RESET", "30")),
+    )
+
+# 連線池在 fork 前還沒有連線，可以共用設定後各自連線
+http_client = Component("http_client", _create_http_client, fork_safe=True)
 
 # === 驗證 webhook 請求 ===
+# 簽名直接對原始 bytes 計算，不先解碼成 str 再編碼回去
+SIGNING_KEY_BYTES = ASSERTION_SIGNING_KEY.encode('utf-8') if ASSERTION_SIGNING_KEY else None
+
 def verify_signature(body, signature):
-    if not ASSERTION_SIGNING_KEY:
+    if not SIGNING_KEY_BYTES:
         return True  # 如果沒有設定 key，暫時跳過驗證
         
     try:
-        # 計算 HMAC-SHA256
-        hash = hmac.new(
-            ASSERTION_SIGNING_KEY.encode('utf-8'),
-            body.encode('utf-8'),
-            hashlib.sha256
-        ).digest()
-        
-        # 轉換為 base64
-        calculated_signature = base64.b64encode(hash).decode('utf-8')
-        
-        # 比較簽名
-        return hmac.compare_digest(calculated_signature, signature)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return webhook_codec.verify(SIGNING_KEY_BYTES, body, signature)
     except Exception as e:
         logging.error(f"驗證簽名時發生錯誤：{str(e)}")
         return False
 
-# === 模擬詐騙分析結果 ===
+# === 詐騙關鍵字引擎（檔案修改後自動重新載入） ===
+SCAM_KEYWORDS_FILE = os.getenv(
+    "SCAM_KEYWORDS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "scam_keywords.tsv"),
+)
+KEYWORD_RELOAD_INTERVAL = float(os.getenv("KEYWORD_RELOAD_INTERVAL", "2.0"))
+
+def _create_keyword_engine():
+    return KeywordEngine(SCAM_KEYWORDS_FILE, reload_interval=KEYWORD_RELOAD_INTERVAL)
+
+# 第一次比對時才讀取關鍵字檔案並建立自動機；沒有背景執行緒，可以在 fork 前建立
+keyword_engine = Component("keywords", _create_keyword_engine, fork_safe=True)
+
+# === 分析器（ANALYZER 可換成其他「模組:類別」） ===
+# ANALYSIS_PROCESSES=0（預設）在目前的執行緒分析；大於 0 時交給行程池，
+# 每個工作行程只載入一次模型，圖片透過共享記憶體傳遞
+ANALYZER = os.getenv("ANALYZER", DEFAULT_ANALYZER)
+ANALYSIS_PROCESSES = os.getenv("ANALYSIS_PROCESSES", "0")
+ANALYSIS_PROCESSES = (os.cpu_count() or 1) if ANALYSIS_PROCESSES == "auto" else int(ANALYSIS_PROCESSES)
+
+def _create_analysis():
+    if ANALYSIS_PROCESSES > 0:
+        from analysis_pool import AnalysisPool
+        pool = AnalysisPool(
+            ANALYZER,
+            processes=ANALYSIS_PROCESSES,
+            timeout=float(os.getenv("ANALYSIS_TIMEOUT", "10")),
+            max_queue_size=int(os.getenv("ANALYSIS_QUEUE_SIZE", "1000")),
+        )
+        pool.start()  # 啟動並等待模型載入，第一個分析請求不必再等
+        atexit.register(pool.close)
+        return pool
+    return InlineAnalysis(DefaultAnalyzer(keyword_engine) if ANALYZER == DEFAULT_ANALYZER else load_analyzer(ANALYZER))
+
+# 行程池不能跨 fork 共用；同一行程內分析的模型可以在 fork 前載入，工作行程共用記憶體分頁
+analysis = Component("analysis", _create_analysis, fork_safe=ANALYSIS_PROCESSES == 0)
+
+# === 圖片分析微批次：IMAGE_BATCH_WINDOW 秒內（或滿 IMAGE_BATCH_SIZE 張）的圖片一次送給分析器 ===
+# 0（預設）表示逐張分析；批次大小與等待時間的分佈可從 /metrics 查看
+IMAGE_BATCH_WINDOW = float(os.getenv("IMAGE_BATCH_WINDOW", "0"))
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", "16"))
+
+def _create_image_batcher():
+    return MicroBatcher(
+        # 第一批圖片送出時才建立分析器
+        lambda images: analysis.analyze_image_batch(images),
+        window=IMAGE_BATCH_WINDOW,
+        max_batch=IMAGE_BATCH_SIZE,
+        name="image-analysis",
+        # 每個工作行程同時處理一批，行程池的工作行程才不會閒置
+        max_concurrency=max(1, ANALYSIS_PROCESSES),
+    )
+
+# 排程執行緒在第一張圖片送出時才啟動
+image_batcher = Component("image_batch", _create_image_batcher, fork_safe=True)
+
+# === 文字分析結果快取：正規化後相同的訊息共用結果，同時間相同的請求只分析一次 ===
+text_result_cache = TextResultCache(
+    max_entries=int(os.getenv("TEXT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TEXT_CACHE_TTL", "600")),
+)
+
+# 分析器或關鍵字更新後版本改變，舊的快取結果不再命中
+def text_analysis_version():
+    return f"{ANALYZER}:{analysis.version}:{keyword_engine.version}"
+
+# === 詐騙分析結果 ===
+# 正規化後的文字只用來當快取鍵值，分析器收到原始訊息（關鍵字比對在 KeywordEngine 內部正規化）
+@instrument("analyze_text", "text")
 def analyze_text(text):
-    scam_keywords = [
-    "怎麼投資", "怎麼給你", "錢怎麼轉", 
-    "要匯到哪", "我相信你", "我沒有別人可以相信了"]
+    return text_result_cache.get_or_compute(
+        text_analysis_version(), normalize_text(text), lambda: analysis.analyze_text(text))
 
-    if any(word in text for word in scam_keywords):
-        return {
-            "label": "scam",
-            "confidence": 0.9,
-            "reply": "這是我投資成功的故事，你想聽嗎？"
+# === 模擬 LLM 分析：產生單一請求的回應內容 ===
+def build_analysis_response(data):
+    message_type = data.get("message_type", "text")
+    user_id = data.get("user_id", "")
+    current_message = data.get("current_message", "")
+    image_path = data.get("image_path", "")
+    chat_history = data.get("chat_history", [])
+
+    # 根據訊息類型生成不同的回應
+    if message_type == "image":
+        # 模擬圖片分析
+        analysis_result = {
+            "is_scam": True,
+            "confidence": 0.85,
+            "details": {
+                "scam_type": "investment_scam",
+                "risk_level": "high",
+                "detected_elements": ["fake_investment", "urgency", "high_returns"],
+                "image_path": image_path,
+                "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
         }
     else:
-        return {
-            "label": "safe",
-            "confidence": 0.1,
-            "reply": "哈哈你說得真有趣，我懂你！"
+        # 模擬文字分析
+        analysis_result = {
+            "is_scam": True,
+            "confidence": 0.75,
+            "details": {
+                "scam_type": "phishing_scam",
+                "risk_level": "high",
+                "detected_elements": ["suspicious_link", "personal_info_request"],
+                "message": current_message,
+                "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
         }
 
+    # 生成回覆訊息
+    if analysis_result["is_scam"]:
+        reply = f"警告！這可能是詐騙訊息（可信度：{analysis_result['confidence']*100:.1f}%）"
+    else:
+        reply = "這看起來是安全的訊息。"
+
+    return {
+        "status": "success",
+        "data": {
+            "analysis": analysis_result,
+            "reply": reply,
+            "user_id": user_id,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    }
+
+# === 分析 API 的對話 session：API 端保留最近的上下文，用戶端只傳送新訊息 ===
+ANALYSIS_SESSION_TTL = float(os.getenv("ANALYSIS_SESSION_TTL", "1800"))
+
+def _create_analysis_session_store():
+    return AnalysisSessionStore(
+        max_sessions=int(os.getenv("ANALYSIS_SESSION_MAX", "100000")),
+        ttl=ANALYSIS_SESSION_TTL,
+        max_messages=HISTORY_CONTEXT_MESSAGES,
+        max_bytes=HISTORY_CONTEXT_BYTES or float("inf"),
+    )
+
+analysis_session_store = Component("analysis_sessions", _create_analysis_session_store, fork_safe=True)
+
+def _valid_session(session):
+    return (isinstance(session, dict) and isinstance(session.get("id"), str)
+            and isinstance(session.get("seq"), int) and session["seq"] >= 0
+            and isinstance(session.get("messages"), list)
+            and all(isinstance(m, str) for m in session["messages"]))
+
+# === 處理單一分析請求（Flask 與 ASGI 共用），回傳 (回應內容, 狀態碼) ===
+def analyze_request(data):
+    session = data.get("session")
+    if session is None:
+        return build_analysis_response(data), 200
+    if not _valid_session(session):
+        return {"error": "無效的 session 資料"}, 400
+    try:
+        seq, context = analysis_session_store.apply(
+            session["id"], session["seq"], session["messages"], reset=bool(session.get("reset")))
+    except SessionResync as e:
+        logging.info("分析 session 需要重新同步：%s", e)
+        return {"status": "resync", "session": {"id": e.session_id, "seq": e.expected_seq}}, 409
+    data = dict(data, chat_history=context)
+    data.pop("session")
+    response = build_analysis_response(data)
+    response["session"] = {"id": session["id"], "seq": seq}
+    return response, 200
+
 # === 模擬 LLM API 端點 ===
-@app.route("/api/analyze", methods=["POST"])
+@bp.route("/api/analyze", methods=["POST"])
 def mock_llm_api():
     try:
         data = request.get_json()
-        logging.info(f"收到 API 請求：{json.dumps(data, ensure_ascii=False)}")
+        log_payload("收到 API 請求", data)
         
         # 檢查請求資料
         if not data:
             return jsonify({
                 "error": "無效的請求資料"
             }), 400
-            
-        message_type = data.get("message_type", "text")
-        user_id = data.get("user_id", "")
-        current_message = data.get("current_message", "")
-        image_path = data.get("image_path", "")
-        chat_history = data.get("chat_history", [])
-        
-        # 根據訊息類型生成不同的回應
-        if message_type == "image":
-            # 模擬圖片分析
-            analysis_result = {
-                "is_scam": True,
-                "confidence": 0.85,
-                "details": {
-                    "scam_type": "investment_scam",
-                    "risk_level": "high",
-                    "detected_elements": ["fake_investment", "urgency", "high_returns"],
-                    "image_path": image_path,
-                    "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            }
-        else:
-            # 模擬文字分析
-            analysis_result = {
-                "is_scam": True,
-                "confidence": 0.75,
-                "details": {
-                    "scam_type": "phishing_scam",
-                    "risk_level": "high",
-                    "detected_elements": ["suspicious_link", "personal_info_request"],
-                    "message": current_message,
-                    "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            }
-        
-        # 生成回覆訊息
-        if analysis_result["is_scam"]:
-            reply = f"警告！這可能是詐騙訊息（可信度：{analysis_result['confidence']*100:.1f}%）"
-        else:
-            reply = "這看起來是安全的訊息。"
-            
-        response = {
-            "status": "success",
-            "data": {
-                "analysis": analysis_result,
-                "reply": reply,
-                "user_id": user_id,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-        }
-        
-        logging.info(f"API 回應：{json.dumps(response, ensure_ascii=False)}")
-        return jsonify(response)
+
+        response, status = analyze_request(data)
+
+        log_payload("API 回應", response)
+        return jsonify(response), status
         
     except Exception as e:
         logging.error(f"API 處理錯誤：{str(e)}")
@@ -153,21 +320,205 @@ def mock_llm_api():
             "message": str(e)
         }), 500
 
+# === 批次分析：單筆結果 ===
+def analyze_batch_item(index, data):
+    item_id = data.get("id") if isinstance(data, dict) else None
+    try:
+        if not isinstance(data, dict) or not data:
+            raise ValueError("無效的請求資料")
+        result = build_analysis_response(data)
+        return {"index": index, "id": item_id, "status": "success", "data": result["data"]}
+    except Exception as e:
+        logging.error(f"批次項目 {index} 處理錯誤：{str(e)}")
+        return {"index": index, "id": item_id, "status": "error", "message": str(e)}
+
+# === 批次分析 API：接受 JSON 陣列或 NDJSON，以 NDJSON 串流回傳每筆完成的結果 ===
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+def _create_batch_executor():
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("BATCH_WORKERS", "8")),
+        thread_name_prefix="batch-analyze",
+    )
+
+# 執行緒在第一個批次請求送出工作時才建立
+batch_executor = Component("batch_executor", _create_batch_executor, fork_safe=True)
+
+@bp.route("/api/analyze/batch", methods=["POST"])
+def mock_llm_batch_api():
+    futures = []
+    is_ndjson = "ndjson" in (request.content_type or "")
+
+    def submit(index, item):
+        if index >= BATCH_MAX_ITEMS:
+            message = f"超過單次批次上限 {BATCH_MAX_ITEMS} 筆"
+            futures.append(completed_future({"index": index, "id": None, "status": "error", "message": message}))
+        else:
+            futures.append(batch_executor.submit(analyze_batch_item, index, item))
+
+    try:
+        if is_ndjson:
+            # 邊讀邊送出，前面的項目不用等整個請求讀完
+            index = 0
+            for line in request.stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    futures.append(completed_future({"index": index, "id": None, "status": "error", "message": f"JSON 格式錯誤：{str(e)}"}))
+                else:
+                    submit(index, item)
+                index += 1
+        else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return jsonify({"status": "error", "message": "請求內容必須是 JSON 陣列或 NDJSON"}), 400
+            for index, item in enumerate(items):
+                submit(index, item)
+    except Exception as e:
+        logging.error(f"批次 API 處理錯誤：{str(e)}")
+        logging.error(traceback.format_exc())
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    def generate():
+        for future in as_completed(futures):
+            yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
 # === 傳送資料到 API 伺服器並接收回覆語句 + 詐騙風險分析 ===
+ANALYSIS_API_URL = os.getenv("ANALYSIS_API_URL", "http://localhost:10001/api/analyze")
+# 大於 0 時，send_to_api 會把這段時間（秒）內的請求合併成一次批次請求
+ANALYSIS_BATCH_WINDOW = float(os.getenv("ANALYSIS_BATCH_WINDOW", "0"))
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "50"))
+
+def post_analysis_batch(items):
+    body = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+    res = http_client.post(
+        ANALYSIS_API_URL + "/batch",
+        endpoint="analysis_api",
+        headers={"Content-Type": "application/x-ndjson"},
+        data=body.encode("utf-8"),
+        stream=True,
+    )
+    results = [RuntimeError("批次回應缺少此項目")] * len(items)
+    try:
+        if res.status_code != 200:
+            raise RuntimeError(f"批次 API 回應錯誤：{res.status_code}")
+        for line in res.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            index = item.get("index")
+            if not isinstance(index, int) or not 0 <= index < len(items):
+                continue
+            if item.get("status") == "success":
+                results[index] = item
+            else:
+                results[index] = RuntimeError(item.get("message", "批次項目處理失敗"))
+    finally:
+        res.close()
+    return results
+
+analysis_batcher = MicroBatcher(
+    post_analysis_batch,
+    window=ANALYSIS_BATCH_WINDOW,
+    max_batch=ANALYSIS_BATCH_SIZE,
+    name="analysis-batch",
+)
+
+def _api_outcome(result):
+    return "error" if result.get("label") == "unknown" else "success"
+
+# === 分析 API 結果快取：以使用者、上下文視窗與正規化的訊息內容為鍵值，同時間相同的請求只呼叫一次 API ===
+# API 端的模型更新時調整 ANALYSIS_API_VERSION，舊的快取結果不再命中
+ANALYSIS_API_VERSION = os.getenv("ANALYSIS_API_VERSION", "")
+api_result_cache = TextResultCache(
+    max_entries=int(os.getenv("ANALYSIS_API_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ANALYSIS_API_CACHE_TTL", "600")),
+)
+
+# === 以 session 呼叫分析 API：只傳送 API 端還沒有的訊息，不再每次附上整段對話紀錄 ===
+# 批次模式（ANALYSIS_BATCH_WINDOW > 0）仍傳送完整的上下文視窗
+ANALYSIS_SESSIONS = os.getenv("ANALYSIS_SESSIONS", "false").lower() == "true"
+
+def _create_analysis_session_client():
+    return AnalysisSessionClient(
+        max_users=int(os.getenv("ANALYSIS_SESSION_MAX", "100000")),
+        ttl=ANALYSIS_SESSION_TTL,
+        max_pending=HISTORY_CONTEXT_MESSAGES,
+    )
+
+analysis_session_client = Component("analysis_session_client", _create_analysis_session_client, fork_safe=True)
+
+def post_analysis(payload, mode):
+    body = json.dumps(payload)
+    metrics.ANALYSIS_REQUEST_BYTES.observe(len(body.encode("utf-8")), mode=mode)
+    headers = {
+        "Content-Type": "application/json"
+    }
+    return http_client.post(ANALYSIS_API_URL, endpoint="analysis_api", headers=headers, data=body)
+
+def post_analysis_session(payload):
+    """回傳 (送出的請求內容, 回應)；API 端回應 409 時以完整的上下文視窗重新同步一次"""
+    user_id = payload["user_id"]
+    context = payload.get("chat_history", [])
+    body = analysis_session_client.build(user_id, payload, context)
+    res = post_analysis(body, "session")
+    if res.status_code == 409:
+        metrics.ANALYSIS_SESSION_RESYNCS.inc()
+        logging.info("分析 API 要求重新同步 session（%s）", user_id)
+        body = analysis_session_client.resync(user_id, payload, context)
+        res = post_analysis(body, "session")
+    return body, res
+
+# API 的結果取決於聊天紀錄，只有同一位使用者在相同上下文下的相同訊息（例如重送）才共用結果
+def api_cache_key(data):
+    context = json.dumps([data.get("user_id", ""), list(data.get("chat_history", []))],
+                         ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(context.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{digest}\0{normalize_text(data.get('current_message', ''))}"
+
 def send_to_api(data):
+    version = f"{ANALYSIS_API_URL}:{ANALYSIS_API_VERSION}"
+    if ANALYSIS_SESSIONS and data.get("user_id"):
+        # 命中快取的訊息不會呼叫 API，先記下來，下一次請求一起送出
+        analysis_session_client.record(data["user_id"], data.get("current_message", ""))
+    # 錯誤回應不快取；命中時也不需要讀取使用者資料
+    return api_result_cache.get_or_compute(
+        version, api_cache_key(data), lambda: request_analysis(data),
+        cacheable=lambda result: result.get("label") != "unknown")
+
+@instrument("send_to_api", "text", outcome=_api_outcome)
+def request_analysis(data):
     try:
-        # 使用本地模擬 API
-        api_url = "http://localhost:10001/api/analyze"
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        logging.info(f"傳送資料到 API：{json.dumps(data, ensure_ascii=False)}")
-        res = requests.post(api_url, headers=headers, data=json.dumps(data), timeout=5)
-        
+        payload = dict(data)
+        log_payload("傳送資料到 API", payload)
+
+        if ANALYSIS_BATCH_WINDOW > 0:
+            timeout = HTTP_ENDPOINTS["analysis_api"]["timeout"]
+            result = analysis_batcher.submit(payload).result(timeout=sum(timeout) + ANALYSIS_BATCH_WINDOW)
+            log_payload("API 回應", result)
+            return result.get("data", {}).get("analysis", {})
+
+        use_session = ANALYSIS_SESSIONS and payload.get("user_id")
+        if use_session:
+            body, res = post_analysis_session(payload)
+        else:
+            res = post_analysis(payload, "full")
+
         if res.status_code == 200:
             result = res.json()
-            logging.info(f"API 回應：{json.dumps(result, ensure_ascii=False)}")
+            log_payload("API 回應", result)
+            if use_session and isinstance(result.get("session"), dict):
+                analysis_session_client.ack(payload["user_id"], body, result["session"])
             return result.get("data", {}).get("analysis", {})
         else:
             logging.error(f"API 回應錯誤：{res.status_code}")
@@ -190,151 +541,254 @@ def send_to_api(data):
 def generate_reply(result):
     return result.get("reply", "我還想聽更多～")
 
-# 判斷是否需要警示訊息
-def should_warn(result):
+# 單則訊息的判斷是否達到警示門檻
+def message_is_scam(result):
     return result.get("label") == "scam" and result.get("confidence", 0.0) > 0.7
 
+# 判斷是否需要警示訊息：整段對話的風險分數或單則訊息的判斷，任一個達到門檻就警示
+def should_warn(result, risk=None):
+    if risk is not None and risk.score >= RISK_WARN_THRESHOLD:
+        return True
+    return message_is_scam(result)
+
 # 如果需要警示，產生警示內容
-def generate_warning(result):
+def generate_warning(result, risk=None):
+    if risk is not None and risk.score >= RISK_WARN_THRESHOLD:
+        stage = f"，對話已進入「{STAGE_NAMES[risk.stage]}」階段" if risk.stage else ""
+        return f"[警示] 你可能正被詐騙，請提高警覺（對話風險 {risk.score * 100:.1f}%{stage}）"
     confidence = result.get("confidence", 0.0)
     return f"[警示] 你可能正被詐騙，請提高警覺（可信度 {confidence * 100:.1f}%）"
 
 # === 獲取使用者基本資料 ===
-def get_user_profile(user_id):
+# 回傳 (狀態碼, 使用者資料)；發生例外時狀態碼為 None
+def fetch_user_profile(user_id):
     try:
-        url = f"https://api.line.me/v2/bot/profile/{user_id}"
+        url = f"{LINE_API_BASE}/v2/bot/profile/{user_id}"
         headers = {
             "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
         }
-        res = requests.get(url, headers=headers)
+        res = http_client.get(url, endpoint="line_profile", headers=headers)
         if res.status_code == 200:
-            return res.json()
+            return res.status_code, res.json()
         else:
-            logging.warning(f"取得使用者資料失敗，狀態碼：{res.status_code}")
+            logging.warning("取得使用者資料失敗，狀態碼：%s", res.status_code)
+            return res.status_code, {}
     except Exception as e:
         logging.error("[get_user_profile 錯誤]")
         logging.error(traceback.format_exc())
-    return {}  
+    return None, {}
+
+# === 使用者資料快取（TTL + LRU，404 短暫快取） ===
+profile_cache = ProfileCache(
+    fetch_user_profile,
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "600")),
+    negative_ttl=float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", "60")),
+    max_entries=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+)
+
+@instrument("get_user_profile", outcome=lambda profile: "success" if profile else "empty")
+def get_user_profile(user_id):
+    return profile_cache.get(user_id)
 
 
 # === 整合資料給模型 / API 使用 ===
+# 使用者資料在真正讀取 display_name 等欄位時才會查詢
 def prepare_analysis_data(user_id, message):
-    profile = get_user_profile(user_id)
-    history = user_chat_history.get(user_id, [])
-    return {
-        "user_id": user_id,
-        "display_name": profile.get("displayName", ""),
-        "picture_url": profile.get("pictureUrl", ""),
-        "language": profile.get("language", ""),
-        "current_message": message,
-        "chat_history": history
-    }
+    profile = LazyProfile(user_id, get_user_profile)
+    history = user_chat_history.recent(
+        user_id,
+        limit=HISTORY_CONTEXT_MESSAGES,
+        seconds=HISTORY_CONTEXT_SECONDS or None,
+        max_bytes=HISTORY_CONTEXT_BYTES or None,
+    )
+    return AnalysisData(profile, user_id, message, history)
+
+# === 儲存聊天紀錄（記憶體版，每位使用者固定長度並有總量上限） ===
+user_chat_history = ChatHistoryStore(
+    max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", "50")),
+    max_bytes=int(os.getenv("HISTORY_MAX_BYTES", str(256 * 1024 * 1024))),
+    idle_ttl=float(os.getenv("HISTORY_IDLE_TTL", str(7 * 24 * 3600))),
+)
+# === 每位使用者的對話風險（衰減的關鍵字類別分數 + 對話階段），每則訊息 O(1) 更新 ===
+RISK_WARN_THRESHOLD = float(os.getenv("RISK_WARN_THRESHOLD", "0.7"))
+# 設定後第一次使用時載入、結束時寫回，重新啟動不會遺失對話風險
+# 每個行程寫回各自的存檔（RISK_STATE_FILE.<pid>），多個 gunicorn worker 不會互相覆蓋；載入時合併全部
+RISK_STATE_FILE = os.getenv("RISK_STATE_FILE", "")
+
+def risk_state_files():
+    """RISK_STATE_FILE 本身與各行程的存檔"""
+    files = [path for path in glob.glob(glob.escape(RISK_STATE_FILE) + ".*")
+             if path.rsplit(".", 1)[1].isdigit()]
+    if os.path.exists(RISK_STATE_FILE):
+        files.append(RISK_STATE_FILE)
+    return files
+
+def save_risk_state(store, loaded):
+    """寫回這個行程的存檔，再刪除載入後沒有再變更的舊存檔（內容已包含在新的存檔中）"""
+    path = f"{RISK_STATE_FILE}.{os.getpid()}"
+    store.save(path)
+    for old_path, mtime in loaded.items():
+        if old_path == path:
+            continue
+        try:
+            if os.path.getmtime(old_path) == mtime:
+                os.remove(old_path)
+        except OSError:
+            pass
+
+def _create_risk_store():
+    store = RiskStateStore(
+        half_life=float(os.getenv("RISK_HALF_LIFE", str(24 * 3600))),
+        new_contact_window=float(os.getenv("RISK_NEW_CONTACT_WINDOW", str(7 * 24 * 3600))),
+        max_users=int(os.getenv("RISK_MAX_USERS", "1000000")),
+        idle_ttl=float(os.getenv("RISK_IDLE_TTL", str(30 * 24 * 3600))),
+    )
+    if RISK_STATE_FILE:
+        loaded = {}
+        for path in risk_state_files():
+            try:
+                mtime = os.path.getmtime(path)
+                store.merge(path)
+                loaded[path] = mtime
+            except Exception as e:
+                logging.error(f"載入對話風險存檔失敗（{path}）：{str(e)}")
+        if loaded:
+            logging.info("已從 %d 個存檔載入 %d 位使用者的對話風險", len(loaded), len(store))
+        atexit.register(save_risk_state, store, loaded)
+    return store
+
+# 每個行程各自寫回存檔，不在 fork 前載入
+risk_store = Component("risk_state", _create_risk_store)
 
-# === 儲存聊天紀錄（記憶體版） ===
-user_chat_history = {}  # key: userId, value: list of text messages
+# 提供給分析的上下文：最近幾則訊息、最近幾秒內（0 表示不限時間）、合計最多幾個位元組（0 表示不限大小）
+HISTORY_CONTEXT_MESSAGES = int(os.getenv("HISTORY_CONTEXT_MESSAGES", "20"))
+HISTORY_CONTEXT_SECONDS = float(os.getenv("HISTORY_CONTEXT_SECONDS", "0"))
+HISTORY_CONTEXT_BYTES = int(os.getenv("HISTORY_CONTEXT_BYTES", str(16 * 1024)))
 
 # === 圖片處理相關設定 ===
-IMAGE_STORAGE_DIR = "scam_images"
-os.makedirs(IMAGE_STORAGE_DIR, exist_ok=True)
+# memory：圖片只放在記憶體（超過 IMAGE_SPOOL_THRESHOLD 才暫存到磁碟）；disk：寫入 IMAGE_STORAGE_DIR
+IMAGE_PIPELINE_MODE = os.getenv("IMAGE_PIPELINE_MODE", "memory")
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_SPOOL_THRESHOLD = int(os.getenv("IMAGE_SPOOL_THRESHOLD", str(4 * 1024 * 1024)))
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", "scam_images")
+# 判定為詐騙的圖片保留在 IMAGE_STORAGE_DIR 作為證據（memory 模式也會另外寫入一份）
+IMAGE_KEEP_EVIDENCE = os.getenv("IMAGE_KEEP_EVIDENCE", "false").lower() == "true"
+
+# === 圖片儲存（雜湊分層目錄 + 索引 + 容量上限 + 背景清理） ===
+# 第一張圖片寫入時才建立目錄與索引
+IMAGE_STORE_ENABLED = IMAGE_PIPELINE_MODE == "disk" or IMAGE_KEEP_EVIDENCE
+
+def _create_image_store():
+    from image_storage import ImageStore
+    return ImageStore(
+        IMAGE_STORAGE_DIR,
+        max_bytes=int(os.getenv("IMAGE_STORAGE_MAX_BYTES", str(1024 * 1024 * 1024))),
+        orphan_ttl=float(os.getenv("IMAGE_ORPHAN_TTL", "3600")),
+        sweep_interval=float(os.getenv("IMAGE_SWEEP_INTERVAL", "300")),
+    )
+
+# SQLite 連線與清理執行緒不能跨 fork 共用
+image_store = Component("image_storage", _create_image_store)
+
+# === 圖片分析結果快取（內容雜湊 + 感知雜湊） ===
+def _create_image_result_cache():
+    return ImageResultCache(
+        max_entries=int(os.getenv("IMAGE_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("IMAGE_CACHE_TTL", str(24 * 3600))),
+        max_distance=int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "6")),
+        persist_path=os.getenv("IMAGE_CACHE_FILE") or None,
+    )
+
+# 存檔在 fork 前載入一次，工作行程共用
+image_result_cache = Component("image_cache", _create_image_result_cache, fork_safe=True)
+
+# === 向 LINE 取得圖片內容（串流） ===
+def request_image_content(message_id, user_id):
+    # 使用正確的 API 端點
+    url = f"{LINE_DATA_API_BASE}/v2/bot/message/{message_id}/content"
+    headers = {
+        "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
+    }
+    logging.info("=== 開始處理圖片 === Message ID: %s, User ID: %s", message_id, user_id)
+    logging.debug("請求 URL: %s", url)
+
+    # 獲取圖片
+    response = http_client.get(url, endpoint="line_content", headers=headers, stream=True)
+    logging.debug("回應狀態碼: %s", response.status_code)
 
-# === 處理圖片訊息 ===
+    if response.status_code != 200:
+        logging.error(f"無法獲取圖片，狀態碼：{response.status_code}")
+        logging.error(f"回應內容：{response.text}")
+        return None
+    return response
+
+def _found_outcome(result):
+    return "success" if result else "error"
+
+# === 處理圖片訊息（寫入磁碟） ===
+@instrument("download_image", "image", outcome=_found_outcome)
 def handle_image_message(message_id, user_id):
     try:
-        # 使用正確的 API 端點
-        url = f"https://api-data.line.me/v2/bot/message/{message_id}/content"
-        headers = {
-            "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
-        }
-        logging.info(f"=== 開始處理圖片 ===")
-        logging.info(f"Message ID: {message_id}")
-        logging.info(f"User ID: {user_id}")
-        logging.info(f"請求 URL: {url}")
-        
-        # 獲取圖片
-        response = requests.get(url, headers=headers, stream=True)
-        logging.info(f"回應狀態碼: {response.status_code}")
-        
-        if response.status_code == 200:
-            # 生成唯一的檔案名稱
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-            filepath = os.path.join(IMAGE_STORAGE_DIR, filename)
-            
-            # 確保目錄存在
-            os.makedirs(IMAGE_STORAGE_DIR, exist_ok=True)
-            
-            # 儲存圖片
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            logging.info(f"圖片已成功儲存至：{filepath}")
-            file_size = os.path.getsize(filepath)
-            logging.info(f"圖片大小: {file_size} bytes")
-            
-            if file_size > 0:
-                return filepath
-            else:
-                logging.error("下載的圖片檔案大小為 0")
-                return None
-        else:
-            logging.error(f"無法獲取圖片，狀態碼：{response.status_code}")
-            logging.error(f"回應內容：{response.text}")
+        response = request_image_content(message_id, user_id)
+        if response is None:
+            return None
+
+        # 先寫入暫存檔，完整下載後才 rename 到分層目錄並建立索引
+        # （超過大小上限或不是圖片時提早中止，暫存檔自動刪除）
+        try:
+            with image_store.writer(user_id, message_id) as f:
+                file_size, image_type = copy_image_stream(response, f, IMAGE_MAX_BYTES)
+        except ImageDownloadError as e:
+            logging.error(f"圖片下載中止：{str(e)}")
             return None
+        filepath = f.path
+
+        metrics.IMAGE_BYTES.observe(file_size)
+        logging.info("圖片已成功儲存至：%s（%s bytes, %s）", filepath, file_size, image_type)
+        return filepath
+    except Exception as e:
+        logging.error(f"處理圖片時發生錯誤：{str(e)}")
+        logging.error(traceback.format_exc())
+        return None
+
+# === 處理圖片訊息（只放在記憶體，過大才暫存到磁碟） ===
+@instrument("download_image", "image", outcome=_found_outcome)
+def download_image(message_id, user_id):
+    try:
+        response = request_image_content(message_id, user_id)
+        if response is None:
+            return None
+        try:
+            image = download_to_buffer(response, IMAGE_MAX_BYTES, IMAGE_SPOOL_THRESHOLD)
+        except ImageDownloadError as e:
+            logging.error(f"圖片下載中止：{str(e)}")
+            return None
+        metrics.IMAGE_BYTES.observe(image.size)
+        logging.info("圖片已下載：%r", image)
+        return image
     except Exception as e:
         logging.error(f"處理圖片時發生錯誤：{str(e)}")
         logging.error(traceback.format_exc())
         return None
 
 # === 分析圖片內容 ===
+# image_path 可以是檔案路徑、ImageBuffer 或 bytes / memoryview
+@instrument("analyze_image", "image", outcome=_found_outcome)
 def analyze_image(image_path):
     try:
-        if not os.path.exists(image_path):
+        if isinstance(image_path, str) and not os.path.exists(image_path):
             logging.error(f"圖片檔案不存在：{image_path}")
             return None
-            
-        # 獲取圖片大小
-        file_size = os.path.getsize(image_path)
-        
-        # 根據圖片大小和時間生成不同的模擬結果
-        current_hour = datetime.now().hour
-        current_minute = datetime.now().minute
-        
-        # 使用時間和檔案大小來生成不同的結果
-        if file_size < 100000:  # 小於 100KB
-            scam_type = "low_quality_scam"
-            confidence = 0.6
-            risk_level = "medium"
-            elements = ["blurry_image", "low_resolution"]
-        elif current_hour % 2 == 0:  # 偶數小時
-            scam_type = "investment_scam"
-            confidence = 0.85
-            risk_level = "high"
-            elements = ["fake_investment", "urgency", "high_returns"]
-        else:  # 奇數小時
-            scam_type = "phishing_scam"
-            confidence = 0.75
-            risk_level = "high"
-            elements = ["fake_website", "personal_info", "urgency"]
-            
-        # 根據分鐘數調整可信度
-        confidence = min(0.95, confidence + (current_minute / 100))
-        
-        analysis_result = {
-            "is_scam": True,
-            "confidence": confidence,
-            "details": {
-                "scam_type": scam_type,
-                "risk_level": risk_level,
-                "detected_elements": elements,
-                "image_size": file_size,
-                "analysis_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-        }
-        
-        logging.info(f"圖片分析完成：{image_path}")
-        logging.info(f"分析結果：{json.dumps(analysis_result, ensure_ascii=False)}")
+
+        # 記憶體中的圖片直接使用 memoryview，不複製
+        if IMAGE_BATCH_WINDOW > 0:
+            # 不設等待上限：分析器還在讀取這張圖片時不能先釋放緩衝區（行程池本身有逾時）
+            analysis_result = image_batcher.submit(image_bytes(image_path)).result()
+        else:
+            analysis_result = analysis.analyze_image(image_bytes(image_path))
+
+        logging.info("圖片分析完成：%s", image_path)
+        log_payload("分析結果", analysis_result)
         return analysis_result
     except Exception as e:
         logging.error(f"分析圖片時發生錯誤：{str(e)}")
@@ -374,18 +828,24 @@ def generate_image_warning(analysis_result):
 # === 清理圖片 ===
 def cleanup_image(image_path):
     try:
-        if os.path.exists(image_path):
+        if isinstance(image_path, ImageBuffer):
+            image_path.close()
+        elif IMAGE_STORE_ENABLED and image_store.get(image_path) is not None:
+            # 由圖片儲存管理的檔案：保留的證據不刪除
+            if image_store.discard(image_path):
+                logging.info("已刪除圖片：%s", image_path)
+        elif os.path.exists(image_path):
             os.remove(image_path)
-            logging.info(f"已刪除圖片：{image_path}")
+            logging.info("已刪除圖片：%s", image_path)
     except Exception as e:
         logging.error(f"清理圖片時發生錯誤：{str(e)}")
 
 # === 接收來自 LINE 的訊息 ===
-@app.route("/callback", methods=["GET", "POST", "OPTIONS"])
+@bp.route("/callback", methods=["GET", "POST", "OPTIONS"])
 def callback():
-    logging.info(f"=== 收到新的請求 ===")
-    logging.info(f"請求方法：{request.method}")
-    logging.info(f"請求標頭：{dict(request.headers)}")
+    logging.info("=== 收到新的請求 === %s", request.method)
+    if should_log_payload():
+        logging.info("請求標頭：%s", LazyJson(dict(request.headers)))
     
     if request.method == "OPTIONS":
         response = Response(status=200)
@@ -399,63 +859,26 @@ def callback():
         
     # 驗證請求簽名
     signature = request.headers.get('X-Line-Signature', '')
-    body = request.get_data(as_text=True)
+    body = request.get_data()
     
-    logging.info(f"收到 webhook 請求，簽名：{signature}")
-    logging.info(f"請求內容：{body}")
+    if should_log_payload():
+        logging.info("請求內容：%s", body.decode('utf-8', errors='replace'))
     
-    if not verify_signature(body, signature):
+    with timed_stage("verify_signature") as stage:
+        valid = verify_signature(body, signature)
+        stage.outcome = "success" if valid else "invalid"
+    if not valid:
         logging.error("請求簽名驗證失敗")
         return Response("OK", status=200)
 
     try:
-        json_data = json.loads(body)
-        logging.info("\n==== [Log] 接收到的資料 ====\n" + json.dumps(json_data, ensure_ascii=False, indent=2))
-
+        with timed_stage("parse_json"):
+            json_data = webhook_codec.loads(body)
         events = json_data.get("events", [])
-        for event in events:
-            if event["type"] == "message":
-                reply_token = event["replyToken"]
-                user_id = event["source"]["userId"]
-                
-                # 處理文字訊息
-                if event["message"]["type"] == "text":
-                    user_msg = event["message"]["text"]
-                    user_chat_history.setdefault(user_id, []).append(user_msg)
-                    analysis_data = prepare_analysis_data(user_id, user_msg)
-                    result = analyze_text(user_msg)
-                    reply_msg = generate_reply(result)
-                    if should_warn(result):
-                        reply_msg += "\n" + generate_warning(result)
-                    reply_to_user(reply_token, reply_msg)
-                
-                # 處理圖片訊息
-                elif event["message"]["type"] == "image":
-                    logging.info("=== 收到圖片訊息 ===")
-                    message_id = event["message"]["id"]
-                    logging.info(f"圖片訊息 ID: {message_id}")
-                    
-                    # 1. 接收並儲存圖片
-                    image_path = handle_image_message(message_id, user_id)
-                    if not image_path:
-                        logging.error("無法處理圖片")
-                        reply_to_user(reply_token, "無法處理圖片，請稍後再試。")
-                        continue
-                    
-                    try:
-                        # 2. 分析圖片
-                        analysis_result = analyze_image(image_path)
-                        
-                        # 3. 生成回覆訊息
-                        if analysis_result and analysis_result.get("is_scam"):
-                            warning_msg = generate_image_warning(analysis_result)
-                            reply_to_user(reply_token, warning_msg)
-                        else:
-                            reply_to_user(reply_token, "圖片分析完成，未發現明顯詐騙跡象，但仍請保持警覺。")
-                        
-                    finally:
-                        # 4. 清理圖片
-                        cleanup_image(image_path)
+        logging.info("收到 %d 個事件", len(events))
+
+        # 事件放入背景佇列後立即回應，避免 LINE 等待逾時而重送
+        dispatch_events(events, event_dispatcher.submit, deferred_dispatcher.submit)
 
     except Exception as e:
         logging.error("\n==== [Log] 發生錯誤 ====")
@@ -465,35 +888,576 @@ def callback():
 
     return Response("OK", status=200)
 
-# === 回傳訊息給使用者（使用 reply API） ===
-def reply_to_user(reply_token, text):
+# === 處理單一 webhook 事件，回傳要回覆給使用者的訊息 ===
+def process_event(event):
+    if event["type"] != "message":
+        return []
+
+    user_id = event["source"]["userId"]
+
+    # 處理文字訊息
+    if event["message"]["type"] == "text":
+        return [text_reply(user_id, event["message"]["text"])]
+
+    # 處理圖片訊息
+    elif event["message"]["type"] == "image":
+        message_id = event["message"]["id"]
+        logging.info("=== 收到圖片訊息 === 圖片訊息 ID: %s", message_id)
+
+        # 負載過高時不下載與分析，只回覆固定的提醒
+        if event.get(DEGRADED_KEY):
+            return [IMAGE_BUSY_REPLY]
+
+        # 1. 接收圖片（預設只放在記憶體）
+        if IMAGE_PIPELINE_MODE == "disk":
+            image_path = handle_image_message(message_id, user_id)
+        else:
+            image_path = download_image(message_id, user_id)
+        if not image_path:
+            logging.error("無法處理圖片")
+            return ["無法處理圖片，請稍後再試。"]
+
+        try:
+            # 2. 分析圖片並生成回覆訊息
+            analysis_result = analyze_image_cached(image_path)
+            keep_image_evidence(image_path, user_id, message_id, analysis_result)
+            return [image_reply(analysis_result)]
+
+        finally:
+            # 3. 清理圖片
+            cleanup_image(image_path)
+
+    return []
+
+# === 分析圖片（相同或相似的圖片直接使用快取的分析結果） ===
+def analyze_image_cached(image_path):
+    analysis_result, cache_key = image_result_cache.lookup(image_bytes(image_path))
+    if analysis_result is None:
+        analysis_result = analyze_image(image_path)
+        if analysis_result:
+            image_result_cache.store(cache_key, analysis_result)
+    return analysis_result
+
+# === 保留判定為詐騙的圖片作為證據 ===
+def keep_image_evidence(image_path, user_id, message_id, analysis_result):
+    if not IMAGE_KEEP_EVIDENCE or not analysis_result or not analysis_result.get("is_scam"):
+        return
     try:
-        url = "https://api.line.me/v2/bot/message/reply"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
-        }
-        payload = {
-            "replyToken": reply_token,
-            "messages": [
-                {
-                    "type": "text",
-                    "text": text
-                }
-            ]
-        }
-        res = requests.post(url, headers=headers, data=json.dumps(payload))
-        if res.status_code != 200:
-            logging.warning(f"回傳訊息失敗，狀態碼：{res.status_code}, 回傳內容：{res.text}")
+        if isinstance(image_path, str) and image_store.keep(image_path):
+            return
+        record = image_store.put(image_bytes(image_path), user_id, message_id, keep=True)
+        logging.info("已保留詐騙圖片證據：%s", record.path)
     except Exception as e:
-        logging.error("[reply_to_user 錯誤]")
-        logging.error(traceback.format_exc())
+        logging.error(f"保留圖片證據失敗：{str(e)}")
+
+def image_reply(analysis_result):
+    if analysis_result and analysis_result.get("is_scam"):
+        return generate_image_warning(analysis_result)
+    return "圖片分析完成，未發現明顯詐騙跡象，但仍請保持警覺。"
+
+# === 處理文字訊息，回傳回覆內容 ===
+def text_reply(user_id, user_msg):
+    user_chat_history.append(user_id, user_msg)
+    analysis_data = prepare_analysis_data(user_id, user_msg)
+    result = analyze_text(user_msg)
+    risk = risk_store.update(user_id, [(m["category"], m["weight"]) for m in result.get("matches", [])])
+    reply_msg = generate_reply(result)
+    if should_warn(result, risk):
+        reply_msg += "\n" + generate_warning(result, risk)
+    return reply_msg
+
+# === 重送事件去重：LINE 逾時重送的事件（相同 webhookEventId）不再處理一次 ===
+# 只在行程內去重；設定 EVENT_DEDUPE_FILE 時改用 SQLite 檔案，同一台機器的多個工作行程共用
+EVENT_DEDUPE = os.getenv("EVENT_DEDUPE", "true").lower() == "true"
+EVENT_DEDUPE_TTL = float(os.getenv("EVENT_DEDUPE_TTL", "3600"))
+EVENT_DEDUPE_FILE = os.getenv("EVENT_DEDUPE_FILE", "")
+
+def _create_event_deduper():
+    from event_dedupe import EventDeduper, SharedEventDeduper
+    if EVENT_DEDUPE_FILE:
+        deduper = SharedEventDeduper(EVENT_DEDUPE_FILE, ttl=EVENT_DEDUPE_TTL)
+        atexit.register(deduper.close)
+        return deduper
+    return EventDeduper(ttl=EVENT_DEDUPE_TTL, max_entries=int(os.getenv("EVENT_DEDUPE_SIZE", "1000000")))
+
+event_deduper = Component("event_dedupe", _create_event_deduper)
+
+def claim_event(event):
+    """回傳 False 表示這個事件已處理過或正在處理"""
+    event_id = event.get("webhookEventId")
+    if not EVENT_DEDUPE or not event_id:
+        return True
+    redelivery = bool((event.get("deliveryContext") or {}).get("isRedelivery"))
+    if redelivery:
+        metrics.EVENTS_REDELIVERED.inc()
+    reason = event_deduper.claim(event_id)
+    if reason is None:
+        return True
+    metrics.EVENTS_DEDUPLICATED.inc(reason=reason, redelivery="true" if redelivery else "false")
+    logging.info("略過重複的事件 %s（%s）", event_id, reason)
+    return False
+
+def finish_events(events, processed=True):
+    """處理完成後記錄為已處理；未處理（佇列已滿）或失敗時釋放，重送的事件可以重新處理"""
+    if not EVENT_DEDUPE:
+        return
+    for event in events:
+        event_id = event.get("webhookEventId")
+        if event_id:
+            if processed:
+                event_deduper.complete(event_id)
+            else:
+                event_deduper.release(event_id)
+
+# === 准入控制：負載過高時圖片改為延後處理或固定回覆，文字警示照常處理 ===
+# 處理中（含排隊）的事件達到 ADMISSION_MAX_IN_FLIGHT，或同一位使用者達到 ADMISSION_USER_MAX_IN_FLIGHT 時，
+# 圖片交給延後佇列（ADMISSION_DEFER=true，佇列已滿時改為固定回覆）；
+# 每位使用者每秒 ADMISSION_USER_RATE 個事件（最多累積 ADMISSION_USER_BURST 個），超過頻率的圖片只回覆固定訊息
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "200")),
+    max_user_in_flight=int(os.getenv("ADMISSION_USER_MAX_IN_FLIGHT", "5")),
+    user_rate=float(os.getenv("ADMISSION_USER_RATE", "1")),
+    user_burst=int(os.getenv("ADMISSION_USER_BURST", "20")),
+    max_users=int(os.getenv("ADMISSION_MAX_USERS", "100000")),
+)
+ADMISSION_DEFER = os.getenv("ADMISSION_DEFER", "true").lower() == "true"
+ADMISSION_DEFER_QUEUE = int(os.getenv("ADMISSION_DEFER_QUEUE", "100"))
+ADMISSION_DEFER_WORKERS = int(os.getenv("ADMISSION_DEFER_WORKERS", "1"))
+# 延後的事件最多等這麼久（秒）讓負載下降，之後不論負載都開始處理
+ADMISSION_DEFER_MAX_WAIT = float(os.getenv("ADMISSION_DEFER_MAX_WAIT", "30"))
+# 耗時、可以降級的訊息類型
+HEAVY_MESSAGE_TYPES = frozenset(["image"])
+
+# 降級的事件加上這個欄位（值為原因），process_event 只回覆固定訊息
+DEGRADED_KEY = "_degraded"
+IMAGE_BUSY_REPLY = "目前圖片分析的需求較多，暫時無法分析這張圖片。請先不要依照圖片內容匯款或提供個人資料，稍後可以再傳一次。\n如有疑慮請撥打 165 反詐騙專線"
 
+def admit_events(user_id, events):
+    """回傳 (立即處理的事件, 延後處理的事件)。
+    文字訊息一律處理；有事件延後後，這位使用者之後的事件（包含文字）也一起延後，維持處理順序"""
+    accepted, deferred = [], []
+    defer_tail = admission.has_deferred(user_id)
+    for event in events:
+        message_type = webhook_codec.event_routing(event)[1]
+        decision, reason = admission.admit(user_id, heavy=message_type in HEAVY_MESSAGE_TYPES)
+        if decision == DEGRADE:
+            # 超過頻率的圖片延後也沒有幫助；延後的結果以 push 送出，需要 push 的對象
+            if ADMISSION_DEFER and reason != "user_rate" and reply_target(event):
+                defer_tail = True
+            else:
+                degrade_event(event, reason)
+        (deferred if defer_tail else accepted).append(event)
+    return accepted, deferred
+
+def degrade_event(event, reason):
+    event[DEGRADED_KEY] = reason
+    metrics.EVENTS_DEGRADED.inc(reason=reason, message_type=webhook_codec.event_routing(event)[1])
+    return event
+
+def dispatch_events(events, submit, submit_deferred):
+    """分組並經過准入控制後交給 submit(user_id, group)，延後的事件交給 submit_deferred(user_id, group)。
+    submit 與 submit_deferred 在佇列已滿時回傳 False"""
+    profile = request_profiler.current()
+    for user_id, group in route_events(events):
+        accepted, deferred = admit_events(user_id, group)
+        if deferred:
+            admission.defer(user_id, len(deferred))
+            hold_profile(deferred, profile)
+            if submit_deferred(user_id, deferred):
+                for event in deferred:
+                    metrics.EVENTS_DEFERRED.inc(message_type=webhook_codec.event_routing(event)[1])
+            else:
+                # 延後佇列也滿了：圖片改為固定回覆，文字照常分析，依原本的順序放回同一次回覆
+                release_profile(deferred)
+                admission.undefer(user_id, len(deferred))
+                for event in deferred:
+                    if webhook_codec.event_routing(event)[1] in HEAVY_MESSAGE_TYPES and DEGRADED_KEY not in event:
+                        degrade_event(event, "defer_full")
+                accepted = accepted + deferred
+        if not accepted:
+            continue
+        admission.enter(user_id, len(accepted))
+        hold_profile(accepted, profile)
+        if not submit(user_id, accepted):
+            release_profile(accepted)
+            admission.leave(user_id, len(accepted))
+            EVENTS_DROPPED.inc(len(accepted))
+            finish_events(accepted, processed=False)
+
+def event_user(events):
+    return webhook_codec.event_routing(events[0])[3]
+
+# 延後的事件等到負載下降（或等待 ADMISSION_DEFER_MAX_WAIT 秒）才處理；
+# 這位使用者先前放入一般佇列的事件一定先處理完，維持處理順序
+def wait_for_capacity(user_id):
+    deadline = time.monotonic() + ADMISSION_DEFER_MAX_WAIT
+    while (admission.overloaded() and time.monotonic() < deadline) or admission.user_in_flight(user_id):
+        time.sleep(0.05)
+
+# === 依 replyToken 分組：同一個 token 的結果合併成一次回覆 ===
+# 請求執行緒只讀取路由欄位並計數，一次走訪完成；訊息內容留給背景工作執行緒
+def route_events(events):
+    """回傳 [(userId, 同一個 replyToken 的事件), ...]；重複的事件不會出現在結果中"""
+    groups = {}
+    for index, event in enumerate(events):
+        event_type, message_type, reply_token, user_id = webhook_codec.event_routing(event)
+        metrics.EVENTS_RECEIVED.inc(event_type=event_type, message_type=message_type)
+        if not claim_event(event):
+            continue
+        # 沒有 replyToken 的事件（例如 unfollow）各自一組
+        key = reply_token or ("no-reply", index)
+        entry = groups.get(key)
+        if entry is None:
+            groups[key] = (user_id, [event])
+        else:
+            entry[1].append(event)
+    return list(groups.values())
+
+# === 處理同一個 replyToken 的事件（由背景工作執行緒呼叫） ===
+def process_event_group(events, push=False):
+    """push=True（延後處理的事件）時 replyToken 多半已過期，結果直接以 push 送出"""
+    metrics.EVENTS_IN_FLIGHT.inc(len(events))
+    try:
+        messages = []
+        for event in events:
+            message_type = event.get("message", {}).get("type", "")
+            try:
+                messages.extend(process_event(event))
+                metrics.EVENTS_PROCESSED.inc(message_type=message_type, outcome="success")
+                finish_events([event])
+            except Exception:
+                metrics.EVENTS_PROCESSED.inc(message_type=message_type, outcome="error")
+                finish_events([event], processed=False)
+                logging.error("[process_event 錯誤]")
+                logging.error(traceback.format_exc())
+
+        reply_token = None if push else events[0].get("replyToken")
+        if messages and (reply_token or push):
+            reply_to_user(reply_token, messages, to=reply_target(events[0]), received_at=event_received_at(events[0]))
+    finally:
+        metrics.EVENTS_IN_FLIGHT.dec(len(events))
+
+# === 背景事件佇列設定 ===
+# 不同使用者的事件最多由 EVENT_WORKERS 個執行緒並行處理，同一使用者依序處理
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "4"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+
+def process_admitted_group(events):
+    try:
+        with event_profile(events):
+            process_event_group(events)
+    finally:
+        admission.leave(event_user(events), len(events))
+
+def process_deferred_group(events):
+    try:
+        with event_profile(events):
+            wait_for_capacity(event_user(events))
+            process_event_group(events, push=True)
+    finally:
+        admission.undefer(event_user(events), len(events))
+
+event_dispatcher = EventDispatcher(
+    process_admitted_group,
+    num_workers=EVENT_WORKERS,
+    max_queue_size=EVENT_QUEUE_SIZE,
+)
+# 延後處理的圖片：少量工作執行緒，不與一般事件搶執行緒
+deferred_dispatcher = EventDispatcher(
+    process_deferred_group,
+    num_workers=ADMISSION_DEFER_WORKERS,
+    max_queue_size=ADMISSION_DEFER_QUEUE,
+    name="deferred-worker",
+)
+
+# 佇列狀態在輸出 /metrics 時才讀取
+EVENTS_DROPPED = metrics.registry.counter(
+    "scam_bot_events_dropped_total", "佇列已滿而丟棄的事件數")
+EVENT_QUEUE_DEPTH = metrics.registry.gauge(
+    "scam_bot_event_queue_depth", "背景佇列中等待處理的事件組數")
+EVENT_WORKERS_BUSY = metrics.registry.gauge(
+    "scam_bot_event_workers_busy", "正在處理事件的工作執行緒數")
+
+def _collect_queue_metrics():
+    queue_stats = event_dispatcher.stats()
+    EVENT_QUEUE_DEPTH.set(queue_stats["queue_depth"])
+    EVENT_WORKERS_BUSY.set(queue_stats["busy_workers"])
+
+metrics.registry.add_collector(_collect_queue_metrics)
+
+# reply API 一次最多 5 則訊息
+LINE_REPLY_MAX_MESSAGES = 5
+
+# text 可以是單一字串或多則訊息；超過 5 則時，多出的內容併入最後一則
+def build_line_messages(text):
+    texts = [text] if isinstance(text, str) else list(text)
+    if len(texts) > LINE_REPLY_MAX_MESSAGES:
+        keep = LINE_REPLY_MAX_MESSAGES - 1
+        texts = texts[:keep] + ["\n\n".join(texts[keep:])]
+    return [
+        {
+            "type": "text",
+            "text": message
+        }
+        for message in texts
+    ]
+
+# 回傳 reply API 的 (url, headers, body)
+def build_reply_request(reply_token, text):
+    url = f"{LINE_API_BASE}/v2/bot/message/reply"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
+    }
+    payload = {
+        "replyToken": reply_token,
+        "messages": build_line_messages(text)
+    }
+    return url, headers, json.dumps(payload)
+
+# 回傳 push API 的 (url, headers, body)；retry_key 讓 LINE 忽略重試造成的重複訊息
+def build_push_request(to, text, retry_key=None):
+    url = f"{LINE_API_BASE}/v2/bot/message/push"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"
+    }
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+    payload = {
+        "to": to,
+        "messages": build_line_messages(text)
+    }
+    return url, headers, json.dumps(payload)
+
+def _response_outcome(result):
+    return "success" if result[0] == 200 else "error"
+
+# === 實際送出 reply / push 請求，回傳 (狀態碼, 回應標頭, 回應內容) ===
+@instrument("reply_to_user", outcome=_response_outcome)
+def send_reply_request(reply_token, text):
+    url, headers, body = build_reply_request(reply_token, text)
+    res = http_client.post(url, endpoint="line_reply", headers=headers, data=body)
+    return res.status_code, res.headers, res.text
+
+@instrument("push_message", outcome=_response_outcome)
+def send_push_request(to, text, retry_key=None):
+    url, headers, body = build_push_request(to, text, retry_key)
+    res = http_client.post(url, endpoint="line_push", headers=headers, data=body)
+    return res.status_code, res.headers, res.text
+
+# === 回覆佇列：依 LINE 的請求頻率上限限流，429 / 5xx 重試，replyToken 過期改用 push ===
+REPLY_DISPATCH_SETTINGS = dict(
+    rate=float(os.getenv("REPLY_RATE_LIMIT", "1000")),
+    burst=int(os.getenv("REPLY_RATE_BURST", "100")),
+    max_queue_size=int(os.getenv("REPLY_QUEUE_SIZE", "10000")),
+    max_attempts=int(os.getenv("REPLY_MAX_ATTEMPTS", "4")),
+    reply_token_ttl=float(os.getenv("REPLY_TOKEN_TTL", "50")),
+    push_fallback=os.getenv("REPLY_PUSH_FALLBACK", "true").lower() == "true",
+)
+
+def _create_reply_dispatcher():
+    from http_client import request_not_sent
+    # 被抽樣分析的請求，送出回覆的執行緒也一併抽樣
+    dispatcher = ReplyDispatcher(
+        functools.partial(request_profiler.call, send_reply_request),
+        functools.partial(request_profiler.call, send_push_request),
+        num_workers=int(os.getenv("REPLY_WORKERS", "4")),
+        request_not_sent=request_not_sent,
+        **REPLY_DISPATCH_SETTINGS,
+    )
+    # 結束時盡量送完佇列中的回覆
+    atexit.register(dispatcher.close, 5.0)
+    return dispatcher
+
+reply_dispatcher = Component("reply", _create_reply_dispatcher)
+
+# push 的對象：群組與聊天室中的訊息回到同一個群組 / 聊天室
+def reply_target(event):
+    source = event.get("source", {})
+    return source.get("groupId") or source.get("roomId") or source.get("userId")
+
+def event_received_at(event):
+    timestamp = event.get("timestamp")
+    return timestamp / 1000 if timestamp else None
+
+# === 回傳訊息給使用者（交給回覆佇列送出） ===
+# 回傳是否成功排入佇列
+def reply_to_user(reply_token, text, to=None, received_at=None):
+    return reply_dispatcher.submit(reply_token, to, text, received_at)
+
+
+# === 請求抽樣分析：依比例抽樣 /callback 與 /api/analyze，或分析帶有 X-Profile-Token 標頭的請求 ===
+# 記錄各階段耗時（驗證簽名、使用者資料、下載、分析、回覆）與呼叫堆疊，保留最慢的幾筆
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_HEADER = "X-Profile-Token"
+PROFILED_ENDPOINTS = frozenset(["callback", "mock_llm_api"])
+# 事件交給背景處理時，請求的分析紀錄放在第一個事件的這個欄位
+PROFILE_KEY = "_profile"
+
+request_profiler = RequestProfiler(
+    sample_rate=PROFILE_SAMPLE_RATE,
+    secret=PROFILE_SECRET,
+    interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+    max_profiles=int(os.getenv("PROFILE_MAX_PROFILES", "20")),
+)
+
+def hold_profile(events, profile):
+    if profile is not None:
+        request_profiler.hold(profile)
+        events[0][PROFILE_KEY] = profile
+
+def release_profile(events):
+    request_profiler.release(events[0].pop(PROFILE_KEY, None))
+
+@contextmanager
+def event_profile(events, sample=True):
+    """背景處理一組事件時沿用收到這些事件的請求的分析紀錄"""
+    profile = events[0].pop(PROFILE_KEY, None)
+    try:
+        with request_profiler.attach(profile, sample):
+            yield
+    finally:
+        request_profiler.release(profile)
+
+def profile_admin_denied(token):
+    """沒有設定 PROFILE_SECRET 時管理端點不存在，回傳 (訊息, 404)（只開啟抽樣也一樣，呼叫堆疊不公開）；
+    標頭的 X-Profile-Token 不相符時回傳 (訊息, 403)"""
+    if not PROFILE_SECRET:
+        return "Not Found", 404
+    if not request_profiler.authorized(token):
+        return "Forbidden", 403
+    return None
+
+def profiles_report(profile_id=None):
+    """回傳 (內容, 狀態碼)：沒有指定時為所有保留的紀錄（由慢到快），否則為單筆的詳細內容"""
+    if profile_id:
+        profile = request_profiler.find(profile_id)
+        if profile is None:
+            return {"error": "找不到這筆分析紀錄"}, 404
+        return profile.detail(), 200
+    return {
+        "profiler": request_profiler.stats(),
+        "profiles": [profile.summary() for profile in request_profiler.profiles()],
+    }, 200
+
+# === 處理中的 HTTP 請求數 ===
+@bp.before_app_request
+def _track_in_flight():
+    # fork 出的工作行程在第一個請求時重新設定日誌與指標
+    if not current_app.config.get("TESTING"):
+        init_process()
+    # 指標標籤不含 blueprint 名稱（scam_bot.callback → callback）
+    g.metrics_endpoint = (request.endpoint or "unknown").rpartition(".")[2]
+    metrics.HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+    if g.metrics_endpoint in PROFILED_ENDPOINTS:
+        profile = request_profiler.begin(g.metrics_endpoint, request.headers.get(PROFILE_HEADER))
+        if profile is not None:
+            g.profile = profile
+            g.profile_handle = request_profiler.activate(profile)
+
+@bp.teardown_app_request
+def _untrack_in_flight(exc):
+    endpoint = g.pop("metrics_endpoint", None)
+    if endpoint is not None:
+        metrics.HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_profiler.deactivate(g.pop("profile_handle"))
+        request_profiler.release(profile)
+
+# === 抽樣分析紀錄：GET /admin/profiles（?id= 取得單筆）與 flamegraph 用的 collapsed stacks ===
+@bp.route("/admin/profiles")
+def profiles_endpoint():
+    denied = profile_admin_denied(request.headers.get(PROFILE_HEADER))
+    if denied:
+        return Response(*denied)
+    body, status = profiles_report(request.args.get("id"))
+    return jsonify(body), status
+
+@bp.route("/admin/profiles/collapsed")
+def collapsed_profiles_endpoint():
+    denied = profile_admin_denied(request.headers.get(PROFILE_HEADER))
+    if denied:
+        return Response(*denied)
+    return Response(request_profiler.collapsed(request.args.get("id")), mimetype="text/plain; charset=utf-8")
+
+# === Prometheus 指標 ===
+@bp.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+# === 背景事件佇列狀態 ===
+@bp.route("/stats")
+def stats():
+    return jsonify({
+        "event_queue": event_dispatcher.stats(),
+        "deferred_queue": deferred_dispatcher.stats(),
+        "admission": admission.stats(),
+        "http": http_client.pool_stats(),
+        "profile_cache": profile_cache.stats(),
+        "chat_history": user_chat_history.stats(),
+        "risk_state": risk_store.stats(),
+        "analysis": analysis.stats(),
+        "image_batch": image_batcher.stats(),
+        "reply": reply_dispatcher.stats(),
+        "image_storage": image_store.stats() if IMAGE_STORE_ENABLED else None,
+        "image_cache": image_result_cache.stats(),
+        "text_cache": text_result_cache.stats(),
+        "api_cache": api_result_cache.stats(),
+        "analysis_sessions": analysis_session_store.stats(),
+        "analysis_session_client": analysis_session_client.stats() if ANALYSIS_SESSIONS else None,
+        "event_dedupe": event_deduper.stats() if EVENT_DEDUPE else None,
+        "profiler": request_profiler.stats(),
+        "components": default_registry.stats(),
+    })
 
 # === 測試首頁 ===
-@app.route("/")
+@bp.route("/")
 def index():
     return "Hello, Scam Bot!"
 
+# === 應用程式工廠 ===
+# APP_PRELOAD=true 時在建立應用程式時先建立可以 fork 的元件（關鍵字、分析器、圖片快取等），
+# 搭配 gunicorn --preload 由主行程載入一次，工作行程 fork 後直接使用；
+# scale-to-zero 部署建議維持 false，讓第一個請求只建立實際用到的元件
+APP_PRELOAD = os.getenv("APP_PRELOAD", "false").lower() == "true"
+
+def preload():
+    """建立所有 fork_safe 的元件並載入關鍵字檔案，回傳建立的元件名稱"""
+    keyword_engine.automaton
+    return default_registry.preload(fork_safe_only=True)
+
+def create_app(test_config=None):
+    """test_config 會放進 flask_app.config；TESTING 為 True 時不檢查憑證，也不設定日誌與多行程指標（測試用）"""
+    flask_app = Flask(__name__)
+    flask_app.config.update(test_config or {})
+    if not flask_app.config.get("TESTING"):
+        init_process()
+    CORS(flask_app)  # 啟用 CORS 支援
+    flask_app.register_blueprint(bp)
+    if APP_PRELOAD:
+        logging.info("已預先建立元件：%s", ", ".join(preload()) or "無")
+    return flask_app
+
+_app = None
+_app_lock = threading.Lock()
+
+def get_app():
+    """回傳這個模組共用的 Flask 應用程式（第一次呼叫時建立）"""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # 相容 `from app import app` 與 `gunicorn app:app`：第一次取用時才建立應用程式
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10001)))
+    create_app().run(host="0.0.0.0", port=int(os.environ.get("PORT", 10001)))
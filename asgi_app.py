@@ -0,0 +1,482 @@
+import asyncio
+import json
+import logging
+import os
+import traceback
+from urllib.parse import parse_qsl
+
+import metrics
+import webhook_codec
+from metrics import timed_stage
+from http_client import AsyncHttpClient, request_not_sent
+from image_pipeline import ImageDownloadError, async_download_to_buffer
+from log_config import log_payload, should_log_payload, LazyJson
+from reply_dispatcher import AsyncReplyDispatcher
+from components import default_registry
+from app import (
+    CHANNEL_ACCESS_TOKEN, LINE_DATA_API_BASE, HTTP_ENDPOINTS,
+    IMAGE_MAX_BYTES, IMAGE_SPOOL_THRESHOLD, IMAGE_KEEP_EVIDENCE, IMAGE_STORE_ENABLED, EVENT_QUEUE_SIZE,
+    IMAGE_PIPELINE_MODE,
+    init_process, preload, APP_PRELOAD,
+    verify_signature, analyze_request, dispatch_events, finish_events, build_reply_request, build_push_request,
+    admission, event_user, DEGRADED_KEY, IMAGE_BUSY_REPLY, ADMISSION_DEFER_QUEUE, ADMISSION_DEFER_WORKERS,
+    ADMISSION_DEFER_MAX_WAIT,
+    reply_target, event_received_at, REPLY_DISPATCH_SETTINGS,
+    text_reply, analyze_image_cached, image_reply, cleanup_image, keep_image_evidence,
+    profile_cache, user_chat_history, risk_store, image_result_cache, image_store, analysis,
+    text_result_cache, api_result_cache, analysis_session_store, event_deduper, EVENT_DEDUPE,
+    EVENT_QUEUE_DEPTH, EVENT_WORKERS_BUSY,
+    request_profiler, event_profile, profile_admin_denied, profiles_report, PROFILE_HEADER, PROFILED_ENDPOINTS,
+)
+
+# === 非同步（ASGI）服務模式 ===
+# 啟動：uvicorn asgi_app:app --host 0.0.0.0 --port 10001
+# /callback、/api/analyze 與 / 的行為與 app.py 相同；對外請求改用 aiohttp，
+# 每組事件是一個 asyncio task，等待 LINE API 時不佔用執行緒。
+
+# 同時處理中的事件組上限；另外最多 EVENT_QUEUE_SIZE 組排隊等待，超過則丟棄
+ASGI_MAX_IN_FLIGHT = int(os.getenv("ASGI_MAX_IN_FLIGHT", "5000"))
+ASGI_POOL_SIZE = int(os.getenv("ASGI_POOL_SIZE", "100"))
+
+http = AsyncHttpClient(
+    HTTP_ENDPOINTS,
+    pool_maxsize=ASGI_POOL_SIZE,
+    failure_threshold=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("HTTP_BREAKER_RESET", "30")),
+)
+
+
+# === 事件排程：同一使用者依序處理，不同使用者並行 ===
+class AsyncEventScheduler:
+    def __init__(self, handler, max_in_flight=5000, max_pending=1000):
+        self.handler = handler
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._user_locks = {}  # user_id -> [asyncio.Lock, 等待中的數量]
+        self._tasks = set()
+        self.active = 0
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, key, item):
+        """需在 event loop 中呼叫；超過上限時回傳 False"""
+        if len(self._tasks) >= self.max_in_flight + self.max_pending:
+            self.dropped += 1
+            logging.warning("事件排程已滿，丟棄事件（使用者 %s）", key)
+            return False
+        self.submitted += 1
+        task = asyncio.ensure_future(self._run(key, item))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, key, item):
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._semaphore:
+                self.active += 1
+                try:
+                    await self.handler(item)
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    logging.error("[事件處理錯誤]")
+                    logging.error(traceback.format_exc())
+                finally:
+                    self.active -= 1
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_locks.pop(key, None)
+
+    async def join(self, timeout=None):
+        """等待目前所有事件處理完畢"""
+        while self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                break
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "active": self.active,
+            "pending": len(self._tasks),
+            "users": len(self._user_locks),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+# === 下載圖片（只放在記憶體，過大才暫存到磁碟） ===
+async def download_image(message_id, user_id):
+    with timed_stage("download_image", "image") as stage:
+        stage.outcome = "error"
+        url = f"{LINE_DATA_API_BASE}/v2/bot/message/{message_id}/content"
+        headers = {"Authorization": f"Bearer {CHANNEL_ACCESS_TOKEN}"}
+        logging.info("=== 開始處理圖片 === Message ID: %s, User ID: %s", message_id, user_id)
+        try:
+            response = await http.get(url, endpoint="line_content", headers=headers, stream=True)
+            if response.status != 200:
+                body = await response.text()
+                response.release()
+                logging.error(f"無法獲取圖片，狀態碼：{response.status}")
+                logging.error(f"回應內容：{body}")
+                return None
+            image = await async_download_to_buffer(response, IMAGE_MAX_BYTES, IMAGE_SPOOL_THRESHOLD)
+        except ImageDownloadError as e:
+            logging.error(f"圖片下載中止：{str(e)}")
+            return None
+        except Exception as e:
+            logging.error(f"處理圖片時發生錯誤：{str(e)}")
+            logging.error(traceback.format_exc())
+            return None
+        metrics.IMAGE_BYTES.observe(image.size)
+        logging.info("圖片已下載：%r", image)
+        stage.outcome = "success"
+        return image
+
+# === 實際送出 reply / push 請求，回傳 (狀態碼, 回應標頭, 回應內容) ===
+async def _post_line(stage_name, endpoint, request):
+    url, headers, body = request
+    with timed_stage(stage_name) as stage:
+        res = await http.post(url, endpoint=endpoint, headers=headers, data=body)
+        text = await res.text() if res.status != 200 else ""
+        stage.outcome = "success" if res.status == 200 else "error"
+        return res.status, res.headers, text
+
+async def send_reply_request(reply_token, text):
+    return await _post_line("reply_to_user", "line_reply", build_reply_request(reply_token, text))
+
+async def send_push_request(to, text, retry_key=None):
+    return await _post_line("push_message", "line_push", build_push_request(to, text, retry_key))
+
+# 限流、重試與改用 push 的設定與 app.py 相同
+reply_dispatcher = AsyncReplyDispatcher(send_reply_request, send_push_request, request_not_sent=request_not_sent,
+                                        **REPLY_DISPATCH_SETTINGS)
+
+# === 回傳訊息給使用者（交給回覆佇列送出），回傳是否成功排入佇列 ===
+async def reply_to_user(reply_token, text, to=None, received_at=None):
+    return reply_dispatcher.submit(reply_token, to, text, received_at)
+
+# === 處理單一 webhook 事件，回傳要回覆給使用者的訊息 ===
+async def process_event(event):
+    if event["type"] != "message":
+        return []
+
+    user_id = event["source"]["userId"]
+
+    # 文字分析只在記憶體中比對關鍵字，直接在 event loop 中執行；
+    # 使用分析行程池時，等待結果的期間交給執行緒，不阻塞 event loop
+    if event["message"]["type"] == "text":
+        if analysis.remote:
+            return [await asyncio.to_thread(request_profiler.call, text_reply, user_id, event["message"]["text"])]
+        return [text_reply(user_id, event["message"]["text"])]
+
+    elif event["message"]["type"] == "image":
+        message_id = event["message"]["id"]
+        logging.info("=== 收到圖片訊息 === 圖片訊息 ID: %s", message_id)
+        if event.get(DEGRADED_KEY):
+            return [IMAGE_BUSY_REPLY]
+
+        image = await download_image(message_id, user_id)
+        if not image:
+            logging.error("無法處理圖片")
+            return ["無法處理圖片，請稍後再試。"]
+        try:
+            # 雜湊與圖片分析是 CPU 工作，交給執行緒池，不阻塞 event loop
+            analysis_result = await asyncio.to_thread(request_profiler.call, analyze_image_cached, image)
+            if IMAGE_KEEP_EVIDENCE:
+                await asyncio.to_thread(keep_image_evidence, image, user_id, message_id, analysis_result)
+            return [image_reply(analysis_result)]
+        finally:
+            cleanup_image(image)
+
+    return []
+
+# === 處理同一個 replyToken 的事件 ===
+async def process_event_group(events, push=False):
+    """push=True（延後處理的事件）時 replyToken 多半已過期，結果直接以 push 送出"""
+    metrics.EVENTS_IN_FLIGHT.inc(len(events))
+    try:
+        messages = []
+        for event in events:
+            message_type = event.get("message", {}).get("type", "")
+            try:
+                messages.extend(await process_event(event))
+                metrics.EVENTS_PROCESSED.inc(message_type=message_type, outcome="success")
+                finish_events([event])
+            except Exception:
+                metrics.EVENTS_PROCESSED.inc(message_type=message_type, outcome="error")
+                finish_events([event], processed=False)
+                logging.error("[process_event 錯誤]")
+                logging.error(traceback.format_exc())
+
+        reply_token = None if push else events[0].get("replyToken")
+        if messages and (reply_token or push):
+            await reply_to_user(reply_token, messages, to=reply_target(events[0]),
+                                received_at=event_received_at(events[0]))
+    finally:
+        metrics.EVENTS_IN_FLIGHT.dec(len(events))
+
+# event loop 由所有請求共用，只記錄階段耗時；交給執行緒的工作才抽樣呼叫堆疊
+async def process_admitted_group(events):
+    try:
+        with event_profile(events, sample=False):
+            await process_event_group(events)
+    finally:
+        admission.leave(event_user(events), len(events))
+
+# 延後的事件等到負載下降（或等待 ADMISSION_DEFER_MAX_WAIT 秒）才處理；
+# 這位使用者先前排入的事件一定先處理完，維持處理順序
+async def process_deferred_group(events):
+    user_id = event_user(events)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ADMISSION_DEFER_MAX_WAIT
+    try:
+        with event_profile(events, sample=False):
+            while (admission.overloaded() and loop.time() < deadline) or admission.user_in_flight(user_id):
+                await asyncio.sleep(0.05)
+            await process_event_group(events, push=True)
+    finally:
+        admission.undefer(user_id, len(events))
+
+event_scheduler = AsyncEventScheduler(
+    process_admitted_group,
+    max_in_flight=ASGI_MAX_IN_FLIGHT,
+    max_pending=EVENT_QUEUE_SIZE,
+)
+# 延後處理的圖片同時最多 ADMISSION_DEFER_WORKERS 組
+deferred_scheduler = AsyncEventScheduler(
+    process_deferred_group,
+    max_in_flight=ADMISSION_DEFER_WORKERS,
+    max_pending=ADMISSION_DEFER_QUEUE,
+)
+
+def _collect_scheduler_metrics():
+    scheduler_stats = event_scheduler.stats()
+    EVENT_QUEUE_DEPTH.set(scheduler_stats["pending"] - scheduler_stats["active"])
+    EVENT_WORKERS_BUSY.set(scheduler_stats["active"])
+
+metrics.registry.add_collector(_collect_scheduler_metrics)
+
+
+# === HTTP 請求與回應 ===
+class Request:
+    __slots__ = ("method", "headers", "query", "_receive")
+
+    def __init__(self, scope, receive):
+        self.method = scope["method"]
+        self.headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        self.query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self._receive = receive
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        if len(chunks) == 1:
+            return chunks[0]  # 一般 webhook 只有一個 chunk，直接沿用伺服器給的 bytes
+        return b"".join(chunks)
+
+
+class Response:
+    __slots__ = ("status", "body", "headers")
+
+    def __init__(self, body=b"", status=200, content_type="text/html; charset=utf-8", headers=None):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.status = status
+        self.headers = [("content-type", content_type), ("access-control-allow-origin", "*")]
+        self.headers.extend(headers or [])
+
+    async def send(self, send):
+        headers = [(key.encode("latin-1"), value.encode("latin-1")) for key, value in self.headers]
+        headers.append((b"content-length", str(len(self.body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+def json_response(obj, status=200):
+    # 與 Flask jsonify 相同的輸出格式
+    body = json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n"
+    return Response(body, status, "application/json")
+
+
+# === 接收來自 LINE 的訊息 ===
+async def callback(request):
+    logging.info("=== 收到新的請求 === %s", request.method)
+    if should_log_payload():
+        logging.info("請求標頭：%s", LazyJson(request.headers))
+
+    if request.method == "OPTIONS":
+        return Response(headers=[
+            ("access-control-allow-headers", "Content-Type,Authorization"),
+            ("access-control-allow-methods", "GET,POST,OPTIONS"),
+        ])
+
+    if request.method == "GET":
+        return Response("OK")
+
+    # 驗證請求簽名
+    signature = request.headers.get("x-line-signature", "")
+    body = await request.body()
+
+    if should_log_payload():
+        logging.info("請求內容：%s", body.decode("utf-8", errors="replace"))
+
+    with timed_stage("verify_signature") as stage:
+        valid = verify_signature(body, signature)
+        stage.outcome = "success" if valid else "invalid"
+    if not valid:
+        logging.error("請求簽名驗證失敗")
+        return Response("OK")
+
+    try:
+        with timed_stage("parse_json"):
+            json_data = webhook_codec.loads(body)
+        events = json_data.get("events", [])
+        logging.info("收到 %d 個事件", len(events))
+
+        # 事件交給背景 task 後立即回應，避免 LINE 等待逾時而重送
+        dispatch_events(events, event_scheduler.submit, deferred_scheduler.submit)
+    except Exception as e:
+        logging.error("\n==== [Log] 發生錯誤 ====")
+        logging.error(str(e))
+        logging.error(traceback.format_exc())
+
+    return Response("OK")
+
+# === 模擬 LLM 分析 API ===
+async def mock_llm_api(request):
+    try:
+        data = json.loads(await request.body())
+        log_payload("收到 API 請求", data)
+
+        if not data:
+            return json_response({"error": "無效的請求資料"}, 400)
+
+        response, status = analyze_request(data)
+        log_payload("API 回應", response)
+        return json_response(response, status)
+
+    except Exception as e:
+        logging.error(f"API 處理錯誤：{str(e)}")
+        logging.error(traceback.format_exc())
+        return json_response({"status": "error", "message": str(e)}, 500)
+
+async def metrics_endpoint(request):
+    return Response(metrics.render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def stats(request):
+    return json_response({
+        "event_queue": event_scheduler.stats(),
+        "deferred_queue": deferred_scheduler.stats(),
+        "admission": admission.stats(),
+        "http": http.pool_stats(),
+        "profile_cache": profile_cache.stats(),
+        "chat_history": user_chat_history.stats(),
+        "risk_state": risk_store.stats(),
+        "analysis": analysis.stats(),
+        "image_cache": image_result_cache.stats(),
+        "text_cache": text_result_cache.stats(),
+        "api_cache": api_result_cache.stats(),
+        "analysis_sessions": analysis_session_store.stats(),
+        "reply": reply_dispatcher.stats(),
+        "image_storage": image_store.stats() if IMAGE_STORE_ENABLED else None,
+        "event_dedupe": event_deduper.stats() if EVENT_DEDUPE else None,
+        "profiler": request_profiler.stats(),
+        "components": default_registry.stats(),
+    })
+
+async def profiles_endpoint(request):
+    denied = profile_admin_denied(request.headers.get(PROFILE_HEADER.lower()))
+    if denied:
+        return Response(*denied)
+    body, status = profiles_report(request.query.get("id"))
+    return json_response(body, status)
+
+async def collapsed_profiles_endpoint(request):
+    denied = profile_admin_denied(request.headers.get(PROFILE_HEADER.lower()))
+    if denied:
+        return Response(*denied)
+    return Response(request_profiler.collapsed(request.query.get("id")), content_type="text/plain; charset=utf-8")
+
+async def index(request):
+    return Response("Hello, Scam Bot!")
+
+ROUTES = {
+    "/callback": (callback, {"GET", "POST", "OPTIONS"}),
+    "/api/analyze": (mock_llm_api, {"POST"}),
+    "/metrics": (metrics_endpoint, {"GET"}),
+    "/stats": (stats, {"GET"}),
+    "/admin/profiles": (profiles_endpoint, {"GET"}),
+    "/admin/profiles/collapsed": (collapsed_profiles_endpoint, {"GET"}),
+    "/": (index, {"GET"}),
+}
+
+
+# === ASGI 進入點 ===
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    route, methods = ROUTES.get(scope["path"], (None, ()))
+    if route is None:
+        await Response("Not Found", 404).send(send)
+        return
+    if scope["method"] not in methods:
+        await Response("Method Not Allowed", 405, headers=[("allow", ", ".join(sorted(methods)))]).send(send)
+        return
+
+    request = Request(scope, receive)
+    profile = None
+    if route.__name__ in PROFILED_ENDPOINTS:
+        profile = request_profiler.begin(route.__name__, request.headers.get(PROFILE_HEADER.lower()))
+    metrics.HTTP_IN_FLIGHT.inc(endpoint=route.__name__)
+    try:
+        with request_profiler.attach(profile, sample=False):
+            response = await route(request)
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec(endpoint=route.__name__)
+        request_profiler.release(profile)
+    await response.send(send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # 與 create_app() 相同：檢查憑證並設定日誌，缺少憑證時啟動失敗
+            try:
+                init_process()
+                if IMAGE_PIPELINE_MODE == "disk":
+                    logging.warning("ASGI 模式不支援 IMAGE_PIPELINE_MODE=disk，圖片一律只下載到記憶體")
+                if APP_PRELOAD:
+                    logging.info("已預先建立元件：%s", ", ".join(await asyncio.to_thread(preload)) or "無")
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # 關機前處理完已收到的事件，並送出佇列中的回覆
+            shutdown_timeout = float(os.getenv("ASGI_SHUTDOWN_TIMEOUT", "10"))
+            await event_scheduler.join(timeout=shutdown_timeout)
+            await deferred_scheduler.join(timeout=shutdown_timeout)
+            await reply_dispatcher.join(timeout=shutdown_timeout)
+            await http.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
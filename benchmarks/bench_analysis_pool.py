@@ -0,0 +1,95 @@
+"""分析吞吐量測試：在執行緒中分析 vs 分析行程池（不同行程數）
+
+以固定耗時的 CPU 密集分析器模擬真正的模型（OCR、圖片分類），
+從多個執行緒同時送出圖片分析工作，回報每秒完成的工作數。
+在執行緒中分析時受 GIL 限制，吞吐量不會隨執行緒數增加；行程池則隨 CPU 核心數增加。
+
+用法：python benchmarks/bench_analysis_pool.py [--processes 1,2,4] [--jobs 200] [--work-ms 20] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+# 工作行程以「模組:類別」載入分析器，需要能 import 這個檔案
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [BENCH_DIR, os.environ.get("PYTHONPATH")]))
+
+from analyzers import Analyzer
+from analysis_pool import AnalysisPool, InlineAnalysis
+
+
+class BurnAnalyzer(Analyzer):
+    """每個工作佔用 CPU 約 BENCH_WORK_MS 毫秒"""
+    name = "burn"
+
+    def load(self):
+        self.work_seconds = float(os.environ.get("BENCH_WORK_MS", "20")) / 1000
+
+    def analyze_text(self, text):
+        return self.analyze_image(memoryview(text.encode("utf-8")))
+
+    def analyze_image(self, data):
+        deadline = time.thread_time() + self.work_seconds
+        total = 0
+        while time.thread_time() < deadline:
+            total += sum(data[:256])
+        return {"size": data.nbytes, "total": total}
+
+
+def run_jobs(analysis, jobs, threads, image):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        started = time.perf_counter()
+        list(pool.map(lambda _: analysis.analyze_image(image), range(jobs)))
+        return time.perf_counter() - started
+
+
+def run(process_counts, jobs, threads, work_ms, image_size):
+    os.environ["BENCH_WORK_MS"] = str(work_ms)
+    image = memoryview(bytes(image_size))
+    results = []
+
+    inline = InlineAnalysis(BurnAnalyzer())
+    elapsed = run_jobs(inline, jobs, threads, image)
+    results.append({"mode": "inline", "processes": 0, "jobs_per_second": round(jobs / elapsed, 1)})
+
+    for processes in process_counts:
+        pool = AnalysisPool("bench_analysis_pool:BurnAnalyzer", processes=processes, timeout=30)
+        pool.start()
+        try:
+            run_jobs(pool, processes * 2, threads, image)  # 等待工作行程就緒
+            elapsed = run_jobs(pool, jobs, threads, image)
+        finally:
+            pool.close()
+        results.append({"mode": "process", "processes": processes, "jobs_per_second": round(jobs / elapsed, 1)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", default="1,2,4", help="要測試的行程數")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16, help="同時送出工作的執行緒數")
+    parser.add_argument("--work-ms", type=float, default=20, help="每個工作的 CPU 時間（毫秒）")
+    parser.add_argument("--image-size", type=int, default=150 * 1024)
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    process_counts = [int(p) for p in args.processes.split(",") if p]
+    results = run(process_counts, args.jobs, args.threads, args.work_ms, args.image_size)
+
+    if args.json:
+        print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+        return
+
+    print(f"CPU 核心數 {os.cpu_count()}，每個工作 {args.work_ms} ms")
+    print(f"{'模式':<10} {'行程數':>6} {'工作/秒':>10}")
+    for row in results:
+        print(f"{row['mode']:<10} {row['processes']:>6} {row['jobs_per_second']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""分析 API 請求大小與延遲：完整對話紀錄、上下文視窗與 session 差量傳送的比較
+
+模擬一位使用者連續傳送 --messages 則訊息，每則都呼叫一次 send_to_api（送到本機的 /api/analyze），
+回報每個請求的平均與最後 100 個請求的大小（bytes）、整段對話的總傳送量，以及延遲的中位數與 p99。
+  full   ：附上所有保留的對話紀錄（HISTORY_CONTEXT_MESSAGES = HISTORY_MAX_MESSAGES，不限大小）
+  window ：附上最近 HISTORY_CONTEXT_MESSAGES 則、合計不超過 HISTORY_CONTEXT_BYTES 的訊息
+  session：ANALYSIS_SESSIONS=true，只傳送 API 端還沒有的訊息，上下文由 API 端保留
+
+每個模式在新的 Python 行程中執行（設定在 import app 時讀取）。
+
+用法：python benchmarks/bench_analysis_session.py [--messages 500] [--message-chars 60] [--json]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子行程中執行：啟動本機的分析 API，依序送出訊息並以 JSON 輸出每個請求的大小與延遲
+CHILD_CODE = r"""
+import json, sys, threading, time
+from werkzeug.serving import make_server
+import app, metrics
+
+messages, chars = int(sys.argv[1]), int(sys.argv[2])
+server = make_server("127.0.0.1", int(sys.argv[3]), app.create_app(), threaded=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+def sent_bytes():
+    return sum(data[-1] for data in metrics.ANALYSIS_REQUEST_BYTES.snapshot().values())
+
+sizes, latencies = [], []
+for i in range(messages):
+    text = (f"第{i}則訊息：" + "請問要匯到哪個帳戶才能領回投資的獲利" * chars)[:chars]
+    app.user_chat_history.append("bench-user", text)
+    data = app.prepare_analysis_data("bench-user", text)
+    before = sent_bytes()
+    started = time.perf_counter()
+    result = app.send_to_api(data)
+    latencies.append(time.perf_counter() - started)
+    sizes.append(sent_bytes() - before)
+    assert result.get("label") != "unknown", result
+server.shutdown()
+print(json.dumps({"sizes": sizes, "latencies": latencies, "sessions": app.analysis_session_store.stats()}))
+"""
+
+MODES = {
+    "full": {"HISTORY_CONTEXT_MESSAGES": "50", "HISTORY_CONTEXT_BYTES": "0", "ANALYSIS_SESSIONS": "false"},
+    "window": {"ANALYSIS_SESSIONS": "false"},
+    "session": {"ANALYSIS_SESSIONS": "true"},
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run_mode(mode, messages, chars):
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault("CHANNEL_ACCESS_TOKEN", "bench-token")
+    env.setdefault("CHANNEL_SECRET", "bench-secret")
+    env.update({
+        "LOG_LEVEL": "WARNING",
+        "ANALYSIS_API_URL": f"http://127.0.0.1:{port}/api/analyze",
+        # 使用者資料查詢也送到本機（404 後短暫快取），不連到 LINE
+        "LINE_API_BASE": f"http://127.0.0.1:{port}",
+        "HISTORY_MAX_MESSAGES": "50",
+    })
+    env.update(MODES[mode])
+    result = subprocess.run([sys.executable, "-c", CHILD_CODE, str(messages), str(chars), str(port)],
+                            cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True)
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sizes, latencies = sample["sizes"], sample["latencies"][1:]  # 第一個請求含建立連線
+    tail = sizes[-100:]
+    return {
+        "avg_bytes": round(sum(sizes) / len(sizes)),
+        "tail_avg_bytes": round(sum(tail) / len(tail)),
+        "total_kb": round(sum(sizes) / 1024, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "resyncs": sample["sessions"]["resyncs"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=500, help="對話的訊息數")
+    parser.add_argument("--message-chars", type=int, default=60, help="每則訊息的字數")
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    results = {mode: run_mode(mode, args.messages, args.message_chars) for mode in MODES}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'模式':<8} {'平均 bytes':>11} {'最後100則平均':>14} {'總傳送 KB':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<8} {r['avg_bytes']:>11} {r['tail_avg_bytes']:>14} {r['total_kb']:>10} "
+              f"{r['p50_ms']:>8} {r['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""webhook 事件去重效能測試：每個事件 claim + complete 的耗時與每筆紀錄的記憶體
+
+用法：python benchmarks/bench_event_dedupe.py [--events 1000000] [--shared-events 100000] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_dedupe import EventDeduper, SharedEventDeduper
+
+
+def event_ids(count):
+    # 與 webhookEventId 相同長度（26 字元的 ULID）
+    return [f"01H{i:023d}" for i in range(count)]
+
+
+def fill(dedupe, ids):
+    for event_id in ids:
+        dedupe.claim(event_id)
+        dedupe.complete(event_id)
+
+
+def run_memory(count):
+    ids = event_ids(count)
+    # 記憶體另外量測，tracemalloc 會拖慢計時
+    tracemalloc.start()
+    measured = EventDeduper(ttl=24 * 3600, max_entries=count)
+    fill(measured, ids)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+
+    dedupe = EventDeduper(ttl=24 * 3600, max_entries=count)
+    started = time.perf_counter()
+    fill(dedupe, ids)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    duplicates = sum(1 for event_id in ids[:100000] if dedupe.claim(event_id))
+    lookup = time.perf_counter() - started
+    return {
+        "backend": "memory",
+        "events": count,
+        "claim_complete_us": round(elapsed / count * 1e6, 2),
+        "duplicate_check_us": round(lookup / min(count, 100000) * 1e6, 2),
+        "bytes_per_event": round(current / count, 1),
+        "duplicates_found": duplicates,
+    }
+
+
+def run_shared(count):
+    root = tempfile.mkdtemp()
+    try:
+        dedupe = SharedEventDeduper(os.path.join(root, "dedupe.sqlite3"), ttl=24 * 3600)
+        ids = event_ids(count)
+        started = time.perf_counter()
+        fill(dedupe, ids)
+        elapsed = time.perf_counter() - started
+        dedupe.close()
+        size = sum(os.path.getsize(os.path.join(root, name)) for name in os.listdir(root))
+        return {
+            "backend": "sqlite",
+            "events": count,
+            "claim_complete_us": round(elapsed / count * 1e6, 2),
+            "bytes_per_event": round(size / count, 1),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--shared-events", type=int, default=100000)
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    results = [run_memory(args.events), run_shared(args.shared_events)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'後端':>8} {'事件數':>10} {'claim+complete(us)':>20} {'bytes/事件':>12}")
+    for row in results:
+        print(f"{row['backend']:>8} {row['events']:>10} {row['claim_complete_us']:>20} {row['bytes_per_event']:>12}")
+
+
+if __name__ == "__main__":
+    main()
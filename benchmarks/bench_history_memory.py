@@ -0,0 +1,92 @@
+"""聊天紀錄記憶體用量測試：原本的 dict[str, list[str]] vs ChatHistoryStore
+
+用法：python benchmarks/bench_history_memory.py [--users 1000000] [--messages 3] [--json]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import ChatHistoryStore
+
+SAMPLE_MESSAGES = [
+    "你好，最近過得好嗎？",
+    "我這邊有一個很好的投資機會，保證獲利",
+    "錢怎麼轉給你比較方便？",
+    "我相信你，我沒有別人可以相信了",
+    "今天晚上要一起吃飯嗎",
+]
+
+
+# 每則訊息都是新的字串物件，模擬從 webhook JSON 解析出來的文字
+def make_message(u, m):
+    return f"{SAMPLE_MESSAGES[(u + m) % len(SAMPLE_MESSAGES)]}{m}"
+
+
+def fill_plain(users, messages):
+    history = {}
+    for u in range(users):
+        user_id = f"U{u:032x}"
+        for m in range(messages):
+            history.setdefault(user_id, []).append(make_message(u, m))
+    return history
+
+
+def fill_store(users, messages):
+    store = ChatHistoryStore(max_messages=50, max_bytes=1 << 40, idle_ttl=0)
+    now = time.time()
+    for u in range(users):
+        user_id = f"U{u:032x}"
+        for m in range(messages):
+            store.append(user_id, make_message(u, m), timestamp=now)
+    return store
+
+
+def measure(fill, users, messages):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    obj = fill(users, messages)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    gc.collect()
+    return {
+        "bytes": current,
+        "bytes_per_user": round(current / users, 1),
+        "fill_seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--messages", type=int, default=3, help="每位使用者的訊息數")
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    results = {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "plain_dict": measure(fill_plain, args.users, args.messages),
+        "history_store": measure(fill_store, args.users, args.messages),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name in ("plain_dict", "history_store"):
+        row = results[name]
+        print(f"{name:>14}: {row['bytes'] / 1024 / 1024:8.1f} MiB "
+              f"({row['bytes_per_user']} bytes/使用者, 填入 {row['fill_seconds']} 秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""關鍵字比對效能測試：逐一子字串掃描 vs Aho-Corasick 自動機
+
+用法：python benchmarks/bench_keywords.py [--sizes 10,1000,50000] [--messages 200] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_engine import Keyword, KeywordAutomaton
+
+# 常用中文字，用來產生隨機關鍵字與訊息
+CHARS = "的一是不了人我在有他這中大來上個國到說們為子和你地出道也時年得就那要下以生會自著去之過家學對可她裡後小麼心多天而能好都然沒日於起還發成事只作當想看文無開手十用主行方又如前所本見經頭面公同三已老從動兩長錢轉匯投資相信"
+
+
+def random_phrase(rng, min_len=3, max_len=8):
+    return "".join(rng.choice(CHARS) for _ in range(rng.randint(min_len, max_len)))
+
+
+def build_keywords(rng, count):
+    phrases = set()
+    while len(phrases) < count:
+        phrases.add(random_phrase(rng))
+    return [Keyword(p, "general", 1.0) for p in phrases]
+
+
+def build_messages(rng, keywords, count, length=80, hit_ratio=0.2):
+    messages = []
+    for _ in range(count):
+        text = random_phrase(rng, length, length)
+        if rng.random() < hit_ratio:
+            pos = rng.randint(0, length)
+            text = text[:pos] + rng.choice(keywords).phrase + text[pos:]
+        messages.append(text)
+    return messages
+
+
+# 原本 analyze_text 的做法：每個關鍵字各做一次子字串搜尋
+def linear_any(phrases, text):
+    return any(word in text for word in phrases)
+
+
+def linear_all(phrases, text):
+    return [word for word in phrases if word in text]
+
+
+def time_per_message(func, messages, min_seconds=0.5):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        for text in messages:
+            func(text)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / (runs * len(messages))
+
+
+def run(sizes, message_count, seed=42):
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        keywords = build_keywords(rng, size)
+        phrases = [k.phrase for k in keywords]
+        messages = build_messages(rng, keywords, message_count)
+
+        started = time.perf_counter()
+        automaton = KeywordAutomaton(keywords)
+        build_seconds = time.perf_counter() - started
+
+        results.append({
+            "keywords": size,
+            "build_ms": round(build_seconds * 1000, 2),
+            "linear_any_us": round(time_per_message(lambda t: linear_any(phrases, t), messages) * 1e6, 2),
+            "linear_all_us": round(time_per_message(lambda t: linear_all(phrases, t), messages) * 1e6, 2),
+            "automaton_us": round(time_per_message(automaton.scan, messages) * 1e6, 2),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,1000,50000")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run(sizes, args.messages)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'關鍵字數':>10} {'建構(ms)':>10} {'any(us)':>12} {'全部命中(us)':>14} {'自動機(us)':>12}")
+    for row in results:
+        print(f"{row['keywords']:>10} {row['build_ms']:>10} {row['linear_any_us']:>12} "
+              f"{row['linear_all_us']:>14} {row['automaton_us']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""冷啟動測試：每次開新的 Python 行程，量測 import app、create_app() 與第一個請求的耗時
+
+scale-to-zero 部署（Cloud Run、Knative 等）的第一個請求要等行程啟動完成，
+這裡回報各階段的中位數與最大值，以及行程的記憶體高峰（RSS）。
+  lazy   ：APP_PRELOAD=false（預設），元件在第一次使用時建立
+  preload：APP_PRELOAD=true，create_app() 先建立可以 fork 的元件
+
+用法：python benchmarks/bench_startup.py [--runs 10] [--budget-ms 500] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子行程中執行：依序量測各階段並以 JSON 輸出
+CHILD_CODE = r"""
+import json, resource, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+client = flask_app.test_client()
+client.get("/")
+first_get = time.perf_counter()
+reply = app.text_reply("bench-user", "請問錢怎麼轉給你")
+first_text = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first_get - created) * 1000,
+    "first_text_ms": (first_text - first_get) * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+STAGES = ["process_ms", "import_ms", "create_app_ms", "first_request_ms", "first_text_ms", "ready_ms", "rss_mb"]
+
+
+def run_once(preload):
+    env = dict(os.environ)
+    env.setdefault("CHANNEL_ACCESS_TOKEN", "bench-token")
+    env.setdefault("CHANNEL_SECRET", "bench-secret")
+    env["APP_PRELOAD"] = "true" if preload else "false"
+    env["LOG_LEVEL"] = "WARNING"
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD_CODE], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    total_ms = (time.perf_counter() - started) * 1000
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    # process_ms 含直譯器啟動與結束；ready_ms 為 import 到回覆第一個文字訊息為止
+    sample["process_ms"] = total_ms
+    sample["ready_ms"] = sum(sample[k] for k in ("import_ms", "create_app_ms", "first_request_ms", "first_text_ms"))
+    return sample
+
+
+def summarize(samples):
+    summary = {}
+    for stage in STAGES:
+        values = [s[stage] for s in samples]
+        summary[stage] = {"median": round(statistics.median(values), 1), "max": round(max(values), 1)}
+    return summary
+
+
+def run(runs):
+    results = {}
+    for mode, preload in (("lazy", False), ("preload", True)):
+        samples = [run_once(preload) for _ in range(runs)]
+        results[mode] = summarize(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=500, help="ready_ms 的上限（中位數），超過時結束碼為 1")
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    over_budget = results["lazy"]["ready_ms"]["median"] > args.budget_ms
+
+    if args.json:
+        print(json.dumps({"budget_ms": args.budget_ms, "over_budget": over_budget, "results": results}, indent=2))
+    else:
+        print(f"{'階段':<18} {'lazy 中位數':>12} {'lazy 最大':>10} {'preload 中位數':>14} {'preload 最大':>12}")
+        for stage in STAGES:
+            lazy, preload = results["lazy"][stage], results["preload"][stage]
+            print(f"{stage:<18} {lazy['median']:>12} {lazy['max']:>10} {preload['median']:>14} {preload['max']:>12}")
+        status = "超過" if over_budget else "符合"
+        print(f"\n冷啟動預算 {args.budget_ms:.0f} ms（ready_ms 中位數）：{status}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
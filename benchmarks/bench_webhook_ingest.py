@@ -0,0 +1,122 @@
+"""webhook 接收路徑效能測試：原本的 str 路徑 vs 原始 bytes 路徑（json / orjson）
+
+每個請求量測：驗證簽名 → 解析 JSON → 取出路由欄位並依 replyToken 分組，
+回報每個請求的平均耗時與 tracemalloc 量到的記憶體配置峰值。
+
+用法：python benchmarks/bench_webhook_ingest.py [--events 100] [--image-ratio 0.2] [--json]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import webhook_codec
+from webhook_payloads import PayloadGenerator
+
+SIGNING_KEY = "bench-signing-key"
+
+
+# 原本的做法：body 先解碼成 str，簽名時再編碼回 bytes，json.loads 解析 str
+def ingest_str(raw, signature):
+    body = raw.decode("utf-8")
+    digest = hmac.new(SIGNING_KEY.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    if not hmac.compare_digest(base64.b64encode(digest).decode("utf-8"), signature):
+        raise ValueError("簽名錯誤")
+    events = json.loads(body).get("events", [])
+    received = [(event.get("type", ""), event.get("message", {}).get("type", "")) for event in events]
+    groups = {}
+    for index, event in enumerate(events):
+        groups.setdefault(event.get("replyToken") or ("no-reply", index), []).append(event)
+    return [(group[0].get("source", {}).get("userId", ""), group) for group in groups.values()], received
+
+
+def make_ingest_bytes(loads):
+    key = SIGNING_KEY.encode("utf-8")
+
+    def ingest(raw, signature):
+        if not webhook_codec.verify(key, raw, signature):
+            raise ValueError("簽名錯誤")
+        events = loads(raw).get("events", [])
+        received = []
+        groups = {}
+        for index, event in enumerate(events):
+            event_type, message_type, reply_token, user_id = webhook_codec.event_routing(event)
+            received.append((event_type, message_type))
+            entry = groups.get(reply_token or ("no-reply", index))
+            if entry is None:
+                groups[reply_token or ("no-reply", index)] = (user_id, [event])
+            else:
+                entry[1].append(event)
+        return list(groups.values()), received
+
+    return ingest
+
+
+def time_per_request(func, raw, signature, number=200, repeat=5):
+    """取 repeat 輪中最快的一輪，降低其他行程干擾造成的誤差"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func(raw, signature)
+        elapsed = (time.perf_counter() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_allocation(func, raw, signature):
+    tracemalloc.start()
+    func(raw, signature)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run(events, image_ratio, seed=42):
+    generator = PayloadGenerator(SIGNING_KEY, image_ratio, events, users=max(1, events // 4), seed=seed)
+    raw, signature = generator.payload()
+
+    variants = {"str + json": ingest_str, "bytes + json": make_ingest_bytes(webhook_codec.json_loads)}
+    if webhook_codec.orjson is not None:
+        variants["bytes + orjson"] = make_ingest_bytes(webhook_codec.orjson.loads)
+
+    results = {"events": events, "payload_bytes": len(raw), "variants": []}
+    for name, func in variants.items():
+        results["variants"].append({
+            "name": name,
+            "per_request_us": round(time_per_request(func, raw, signature) * 1e6, 1),
+            "peak_alloc_kb": round(peak_allocation(func, raw, signature) / 1024, 1),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100, help="每個 webhook 請求的事件數")
+    parser.add_argument("--image-ratio", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    args = parser.parse_args()
+
+    results = run(args.events, args.image_ratio)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+
+    print(f"事件數 {results['events']}，請求大小 {results['payload_bytes']} bytes")
+    print(f"{'路徑':<16} {'每個請求(us)':>14} {'配置峰值(KB)':>14}")
+    for row in results["variants"]:
+        print(f"{row['name']:<16} {row['per_request_us']:>14} {row['peak_alloc_kb']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""本機模擬的 LINE API（api.line.me / api-data.line.me），供壓力測試離線使用
+
+支援的端點：
+  POST /v2/bot/message/reply
+  POST /v2/bot/message/push
+  GET  /v2/bot/profile/<userId>
+  GET  /v2/bot/message/<messageId>/content
+  GET  /__stats（各端點的請求次數，供壓力測試讀取）
+
+用法：python benchmarks/fake_line_api.py [--port 18080] [--latency 0.05] [--jitter 0.02] [--error-rate 0.01]
+接著設定 LINE_API_BASE=http://127.0.0.1:18080 與 LINE_DATA_API_BASE=http://127.0.0.1:18080 再啟動 app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROFILE_PATH = re.compile(r"^/v2/bot/profile/([^/]+)$")
+CONTENT_PATH = re.compile(r"^/v2/bot/message/([^/]+)/content$")
+REPLY_PATH = "/v2/bot/message/reply"
+PUSH_PATH = "/v2/bot/message/push"
+STATS_PATH = "/__stats"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 預設的 listen backlog 只有 5，高並行時連線會被丟棄後重送
+    request_queue_size = 1024
+
+
+def make_image(size):
+    """產生指定大小、開頭為 JPEG 標記的假圖片"""
+    header = b"\xff\xd8\xff\xe0"
+    return header + bytes(max(0, size - len(header)))
+
+
+class FakeLineApi:
+    """latency / jitter 為每個請求的延遲秒數；error_rate 為回應 500 的比例"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 image_size=150 * 1024, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image = make_image(image_size)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"reply": 0, "push": 0, "profile": 0, "content": 0, "errors": 0, "not_found": 0}
+        self.reply_messages = 0
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-line-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, reply_messages=self.reply_messages)
+
+    def _count(self, key, messages=0):
+        with self._lock:
+            self.counts[key] += 1
+            self.reply_messages += messages
+
+    def _delay_and_fail(self):
+        """模擬網路延遲；回傳 True 表示這次要注入錯誤"""
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            self._count("errors")
+        return fail
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status, obj):
+                self._send(status, json.dumps(obj).encode("utf-8"))
+
+            def do_GET(self):
+                if self.path == STATS_PATH:
+                    return self._send_json(200, api.stats())
+                if api._delay_and_fail():
+                    return self._send_json(500, {"message": "injected error"})
+                match = PROFILE_PATH.match(self.path)
+                if match:
+                    api._count("profile")
+                    user_id = match.group(1)
+                    return self._send_json(200, {
+                        "userId": user_id,
+                        "displayName": f"user-{user_id[-6:]}",
+                        "pictureUrl": "",
+                        "language": "zh-TW",
+                    })
+                if CONTENT_PATH.match(self.path):
+                    api._count("content")
+                    return self._send(200, api.image, "image/jpeg")
+                api._count("not_found")
+                self._send_json(404, {"message": "Not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                if api._delay_and_fail():
+                    return self._send_json(500, {"message": "injected error"})
+                if self.path not in (REPLY_PATH, PUSH_PATH):
+                    api._count("not_found")
+                    return self._send_json(404, {"message": "Not found"})
+                try:
+                    messages = len(json.loads(body).get("messages", []))
+                except ValueError:
+                    return self._send_json(400, {"message": "invalid JSON"})
+                api._count("reply" if self.path == REPLY_PATH else "push", messages)
+                self._send_json(200, {})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲的隨機變動範圍（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回應 500 的比例（0～1）")
+    parser.add_argument("--image-size", type=int, default=150 * 1024, help="圖片大小（bytes）")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    api = FakeLineApi(args.host, args.port, args.latency, args.jitter, args.error_rate, args.image_size, args.seed)
+    print(f"模擬 LINE API 已啟動：{api.url}", flush=True)
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api._server.server_close()
+        print(json.dumps(api.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""webhook 壓力測試：以固定速率送出已簽名的請求到 /callback，離線執行
+
+預設另外啟動兩個子行程：模擬的 LINE API（fake_line_api.py）與 app，
+回報吞吐量、p50/p95/p99 延遲、背景事件處理速度與 app 行程的記憶體用量。
+  --server flask：python app.py（Werkzeug 多執行緒伺服器 + 背景工作執行緒）
+  --server asgi ：uvicorn asgi_app:app（asyncio task + aiohttp）
+
+用法：python benchmarks/load_test.py [--server flask|asgi] [--rate 200] [--duration 10] [--image-ratio 0.2]
+                                     [--latency 0.05] [--error-rate 0.01] [--json] [--output result.json]
+
+測試已啟動的服務（例如 gunicorn）時使用 --url，並讓該服務的 LINE_API_BASE /
+LINE_DATA_API_BASE 指向 benchmarks/fake_line_api.py；此時只回報用戶端的數據。
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from webhook_payloads import PayloadGenerator
+
+SIGNING_KEY = "load-test-signing-key"
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "p50": round(percentile(samples, 50) * 1000, 2),
+        "p95": round(percentile(samples, 95) * 1000, 2),
+        "p99": round(percentile(samples, 99) * 1000, 2),
+        "max": round(samples[-1] * 1000, 2) if samples else 0.0,
+        "mean": round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def process_memory_mb(pid):
+    """讀取 /proc/<pid>/status 的目前（VmRSS）與最高（VmHWM）常駐記憶體"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = round(int(value.split()[0]) / 1024, 1)
+    except (OSError, ValueError):
+        return None
+    return {"rss": memory.get("VmRSS"), "peak_rss": memory.get("VmHWM")}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"子行程已結束（結束碼 {process.returncode}）：{url}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.05)
+    raise RuntimeError(f"等待服務啟動逾時：{url}")
+
+
+def start_fake_line_api(args):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_line_api.py"),
+        "--port", str(port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--image-size", str(args.image_size), "--seed", str(args.seed),
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    wait_until_ready(url + "/__stats", process)
+    return process, url
+
+
+def start_app(args, fake_url):
+    """啟動 app 子行程，LINE API 指向模擬伺服器"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "ASSERTION_SIGNING_KEY": SIGNING_KEY,
+        "LINE_API_BASE": fake_url,
+        "LINE_DATA_API_BASE": fake_url,
+        "PORT": str(port),
+    })
+    env.setdefault("CHANNEL_ACCESS_TOKEN", "load-test-token")
+    env.setdefault("CHANNEL_SECRET", "load-test-secret")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if args.workers:
+        env["EVENT_WORKERS"] = str(args.workers)
+
+    if args.server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    else:
+        command = [sys.executable, "app.py"]
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    wait_until_ready(url + "/", process)
+    return process, url
+
+
+def wait_drained(base_url, timeout):
+    """輪詢 /stats，直到背景事件（含延後處理的事件）全部處理完畢、回覆全部送出；
+    回傳 (是否完成, /stats 內容)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = requests.get(base_url + "/stats", timeout=5).json()
+        queues = [q for q in (stats["event_queue"], stats.get("deferred_queue")) if q]
+        done = all(q["processed"] + q["failed"] >= q["submitted"] for q in queues) \
+            and not (stats.get("reply") or {}).get("pending")
+        if done or time.monotonic() >= deadline:
+            return done, stats
+        time.sleep(0.05)
+
+
+def run_load(url, generator, rate, duration, concurrency, timeout):
+    """開放式負載：第 i 個請求預定在 start + i / rate 送出，延遲從預定時間起算，
+    避免伺服器變慢時用戶端跟著降速而低估延遲（coordinated omission）"""
+    local = threading.local()
+    latencies = []
+    service_times = []
+    status_counts = {}
+    lock = threading.Lock()
+
+    def send(scheduled, body, signature):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        sent = time.perf_counter()
+        try:
+            res = session.post(url, data=body, timeout=timeout, headers={
+                "Content-Type": "application/json",
+                "X-Line-Signature": signature,
+            })
+            status = str(res.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            latencies.append(finished - scheduled)
+            service_times.append(finished - sent)
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    total = int(rate * duration)
+    payloads = [generator.payload() for _ in range(total)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        for index, (body, signature) in enumerate(payloads):
+            scheduled = started + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, scheduled, body, signature)
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "status_counts": status_counts,
+        "latency_ms": summarize(latencies),
+        "service_time_ms": summarize(service_times),
+    }, started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask", help="要啟動的服務模式")
+    parser.add_argument("--url", help="改為測試已啟動的服務，例如 http://127.0.0.1:10001/callback")
+    parser.add_argument("--signing-key", default=SIGNING_KEY, help="搭配 --url 使用的 ASSERTION_SIGNING_KEY")
+    parser.add_argument("--rate", type=float, default=100, help="每秒送出的 webhook 請求數")
+    parser.add_argument("--duration", type=float, default=10, help="測試秒數")
+    parser.add_argument("--concurrency", type=int, default=32, help="用戶端同時連線數")
+    parser.add_argument("--events-per-request", type=int, default=1)
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="圖片事件比例")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="模擬 LINE API 延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬 LINE API 錯誤比例")
+    parser.add_argument("--image-size", type=int, default=150 * 1024)
+    parser.add_argument("--workers", type=int, default=0, help="覆寫 EVENT_WORKERS（flask 模式）")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="等待背景事件處理完畢的秒數")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="輸出 JSON 格式結果")
+    parser.add_argument("--output", help="把 JSON 結果寫入檔案")
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.url:
+            url, signing_key, base_url = args.url, args.signing_key, None
+        else:
+            fake_process, fake_url = start_fake_line_api(args)
+            processes.append(fake_process)
+            app_process, base_url = start_app(args, fake_url)
+            processes.append(app_process)
+            url, signing_key = base_url + "/callback", SIGNING_KEY
+            memory_before = process_memory_mb(app_process.pid)
+
+        generator = PayloadGenerator(signing_key, args.image_ratio, args.events_per_request, args.users, args.seed)
+        client, started = run_load(url, generator, args.rate, args.duration, args.concurrency, args.timeout)
+
+        results = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("json", "output", "signing_key")},
+            "events_sent": dict(generator.events),
+            "client": client,
+        }
+
+        if base_url is not None:
+            # 等待背景事件處理完畢，計算事件從收到到回覆的整體處理速度
+            drained, stats = wait_drained(base_url, args.drain_timeout)
+            processed_at = time.perf_counter()
+            events = sum(generator.events.values())
+            memory_after = process_memory_mb(app_process.pid)
+            results["server"] = {
+                "mode": args.server,
+                "drained": drained,
+                "events_per_second": round(events / (processed_at - started), 1),
+                "event_queue": stats["event_queue"],
+                "admission": stats.get("admission"),
+                "fake_line_api": requests.get(fake_url + "/__stats", timeout=5).json(),
+                "memory_mb": {
+                    "rss_before": memory_before and memory_before["rss"],
+                    "rss_after": memory_after and memory_after["rss"],
+                    "peak_rss": memory_after and memory_after["peak_rss"],
+                },
+            }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if args.json:
+        print(text)
+    else:
+        latency = client["latency_ms"]
+        print(f"請求數 {client['requests']}，吞吐量 {client['throughput_rps']} req/s，狀態 {client['status_counts']}")
+        print(f"延遲 p50 {latency['p50']} ms / p95 {latency['p95']} ms / p99 {latency['p99']} ms / 最大 {latency['max']} ms")
+        if "server" in results:
+            server_stats = results["server"]
+            print(f"背景事件處理 {server_stats['events_per_second']} events/s（已清空：{server_stats['drained']}）")
+            print(f"記憶體 {server_stats['memory_mb']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""產生已簽名的 LINE webhook 請求內容（文字與圖片事件混合）
+
+簽名方式與 app.verify_signature 相同：base64(HMAC-SHA256(ASSERTION_SIGNING_KEY, body))
+"""
+import base64
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+
+TEXT_MESSAGES = [
+    "你好，最近過得好嗎？",
+    "我這邊有一個很好的投資機會，保證獲利",
+    "錢怎麼轉給你比較方便？",
+    "我相信你，我沒有別人可以相信了",
+    "今天晚上要一起吃飯嗎",
+    "幫我看一下這個連結",
+]
+
+
+def sign(body, secret):
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def make_event(kind, user_id, text=None, message_id=None):
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "source": {"type": "user", "userId": user_id},
+    }
+    message_id = message_id or str(random.randint(10 ** 17, 10 ** 18 - 1))
+    if kind == "image":
+        event["message"] = {"type": "image", "id": message_id,
+                            "contentProvider": {"type": "line"}}
+    else:
+        event["message"] = {"type": "text", "id": message_id, "text": text or TEXT_MESSAGES[0]}
+    return event
+
+
+class PayloadGenerator:
+    """image_ratio：圖片事件的比例；events_per_request：每個 webhook 請求的事件數；
+    users：模擬的使用者數量。回傳 (body bytes, X-Line-Signature)。"""
+
+    def __init__(self, secret="", image_ratio=0.2, events_per_request=1, users=100, seed=None):
+        self.secret = secret
+        self.image_ratio = image_ratio
+        self.events_per_request = max(1, events_per_request)
+        self.users = [f"U{index:032x}" for index in range(max(1, users))]
+        self.rng = random.Random(seed)
+        self.events = {"text": 0, "image": 0}
+
+    def event(self):
+        kind = "image" if self.rng.random() < self.image_ratio else "text"
+        self.events[kind] += 1
+        return make_event(
+            kind,
+            self.rng.choice(self.users),
+            text=self.rng.choice(TEXT_MESSAGES),
+            message_id=str(self.rng.randint(10 ** 17, 10 ** 18 - 1)),
+        )
+
+    def payload(self):
+        events = [self.event() for _ in range(self.events_per_request)]
+        body = json.dumps({"destination": "U" + "0" * 32, "events": events},
+                          ensure_ascii=False).encode("utf-8")
+        return body, sign(body, self.secret) if self.secret else ""
+
+    def __iter__(self):
+        while True:
+            yield self.payload()
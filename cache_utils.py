@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+# === 具 TTL 與 LRU 淘汰的執行緒安全快取 ===
+class TTLCache:
+    """on_evict(key, value) 會在項目因過期、淘汰或 pop 被移除時呼叫（持有鎖時呼叫，請勿回頭操作快取）"""
+
+    def __init__(self, max_entries=10000, ttl=300.0, clock=time.monotonic, on_evict=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.clock = clock
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (到期時間, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+                self._evicted(key, value)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                self.evictions += 1
+                self._evicted(old_key, old_value)
+
+    def _evicted(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is not _MISSING:
+                self._evicted(key, entry[1])
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            items = list(self._data.items())
+            self._data.clear()
+            for key, (_, value) in items:
+                self._evicted(key, value)
+
+    def items(self):
+        """目前未過期的 (key, 值, 剩餘秒數)"""
+        now = self.clock()
+        with self._lock:
+            return [
+                (key, value, expires_at - now)
+                for key, (expires_at, value) in self._data.items()
+                if expires_at > now
+            ]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# === 合併同時間相同 key 的請求，只實際執行一次 ===
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
@@ -0,0 +1,165 @@
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+# === 緊湊的訊息格式 ===
+# 每位使用者只有一個 bytes 物件（不可變，因此沒有預留空間的浪費）：
+#   [訊息數:H] + 多筆紀錄（由舊到新）
+#   每筆紀錄：[長度:H][UTF-8 內容][時間戳記（秒）:I][長度:H]
+# 前後都記錄長度，因此可以直接跳過最舊的一筆，也可以由新到舊逐筆讀取。
+_COUNT = struct.Struct("<H")
+_HEAD = struct.Struct("<H")
+_TAIL = struct.Struct("<IH")
+RECORD_OVERHEAD = _HEAD.size + _TAIL.size
+
+# 每個使用者的估計額外成本（OrderedDict 項目、bytes 物件標頭與使用者 ID 字串）
+USER_OVERHEAD = 200
+
+MAX_MESSAGES_LIMIT = 0xFFFF
+MAX_MESSAGE_BYTES = 0xFFFF
+_EMPTY = _COUNT.pack(0)
+
+
+def _append_record(buf, data, timestamp, capacity):
+    """回傳加入一筆訊息後的新緩衝區，超過 capacity 時捨棄最舊的一筆"""
+    (count,) = _COUNT.unpack_from(buf, 0)
+    keep_from = _COUNT.size
+    if count >= capacity:
+        (size,) = _HEAD.unpack_from(buf, keep_from)
+        keep_from += size + RECORD_OVERHEAD
+        count -= 1
+    size = len(data)
+    # 只複製一次：保留的舊紀錄 + 新紀錄
+    return b"".join((
+        _COUNT.pack(count + 1),
+        memoryview(buf)[keep_from:],
+        _HEAD.pack(size),
+        data,
+        _TAIL.pack(int(timestamp), size),
+    ))
+
+
+def _iter_newest(buf):
+    """由新到舊逐筆產生 (時間戳記, 起點, 終點)，只讀取紀錄標頭，不複製內容"""
+    end = len(buf)
+    while end > _COUNT.size:
+        timestamp, size = _TAIL.unpack_from(buf, end - _TAIL.size)
+        start = end - _TAIL.size - size
+        yield timestamp, start, start + size
+        end = start - _HEAD.size
+
+
+def _last_seen(buf):
+    return _TAIL.unpack_from(buf, len(buf) - _TAIL.size)[0]
+
+
+# === 聊天紀錄儲存：每位使用者固定長度，並有全域記憶體上限 ===
+class ChatHistoryStore:
+    """每位使用者保留最近 max_messages 則訊息；總用量超過 max_bytes 時淘汰最久未活動的使用者，
+    閒置超過 idle_ttl 秒的使用者也會被移除。"""
+
+    def __init__(self, max_messages=50, max_bytes=256 * 1024 * 1024, idle_ttl=7 * 24 * 3600,
+                 clock=time.time):
+        self.max_messages = min(MAX_MESSAGES_LIMIT, max(1, int(max_messages)))
+        self.max_bytes = int(max_bytes)
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self._users = OrderedDict()  # 依最後活動時間排序，最舊的在前
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.evicted_users = 0
+        self.expired_users = 0
+
+    def append(self, user_id, text, timestamp=None):
+        now = self.clock() if timestamp is None else timestamp
+        data = text.encode("utf-8")
+        if len(data) > MAX_MESSAGE_BYTES:
+            data = data[:MAX_MESSAGE_BYTES].decode("utf-8", "ignore").encode("utf-8")
+        with self._lock:
+            buf = self._users.get(user_id)
+            if buf is None:
+                buf = _EMPTY
+                user_id = sys.intern(user_id)
+                self.nbytes += USER_OVERHEAD + len(buf)
+            else:
+                self._users.move_to_end(user_id)
+            new_buf = _append_record(buf, data, now, self.max_messages)
+            self._users[user_id] = new_buf
+            self.nbytes += len(new_buf) - len(buf)
+            self._expire_idle(now)
+            self._enforce_budget(keep=user_id)
+
+    def _remove_oldest(self):
+        _, buf = self._users.popitem(last=False)
+        self.nbytes -= USER_OVERHEAD + len(buf)
+
+    def _expire_idle(self, now):
+        if not self.idle_ttl:
+            return
+        cutoff = now - self.idle_ttl
+        while self._users:
+            oldest = next(iter(self._users.values()))
+            if _last_seen(oldest) >= cutoff:
+                break
+            self._remove_oldest()
+            self.expired_users += 1
+
+    def _enforce_budget(self, keep=None):
+        while self.nbytes > self.max_bytes and len(self._users) > 1:
+            if next(iter(self._users)) == keep:
+                break
+            self._remove_oldest()
+            self.evicted_users += 1
+
+    def recent(self, user_id, limit=None, seconds=None, now=None, max_bytes=None):
+        """取得最近 limit 則、或最近 seconds 秒內的訊息（由舊到新），只解碼需要的部分；
+        max_bytes 限制合計的大小（UTF-8），但至少會包含最新的一則"""
+        with self._lock:
+            buf = self._users.get(user_id)
+            if buf is None:
+                return []
+            cutoff = None
+            if seconds is not None:
+                cutoff = (self.clock() if now is None else now) - seconds
+            result = []
+            total = 0
+            for timestamp, start, end in _iter_newest(buf):
+                if limit is not None and len(result) >= limit:
+                    break
+                if cutoff is not None and timestamp < cutoff:
+                    break
+                total += end - start
+                if max_bytes is not None and result and total > max_bytes:
+                    break
+                result.append(buf[start:end].decode("utf-8"))
+        result.reverse()
+        return result
+
+    def expire(self, now=None):
+        with self._lock:
+            self._expire_idle(self.clock() if now is None else now)
+
+    def remove(self, user_id):
+        with self._lock:
+            buf = self._users.pop(user_id, None)
+            if buf is not None:
+                self.nbytes -= USER_OVERHEAD + len(buf)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "estimated_bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "max_messages_per_user": self.max_messages,
+            "evicted_users": self.evicted_users,
+            "expired_users": self.expired_users,
+        }
@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+
+# === 延遲建立的元件 ===
+class Component:
+    """第一次使用（讀取任何屬性）時才呼叫 factory() 建立實際物件，之後直接轉給該物件。
+    屬性讀取全部轉給實際物件，代理本身只提供 resolve() 與 initialized，
+    名稱等資訊由 ComponentRegistry 讀取。
+
+    fork_safe=True 表示建立後可以安全地 fork（沒有執行緒、開啟的連線或檔案鎖），
+    可在 gunicorn --preload 的主行程先建立，讓所有工作行程共用載入結果；
+    其他元件（行程池、SQLite 連線等）在每個工作行程第一次使用時各自建立。
+    """
+
+    def __init__(self, name, factory, fork_safe=False, registry=None):
+        self._name = name
+        self._factory = factory
+        self._fork_safe = fork_safe
+        self._instance = None
+        self._lock = threading.Lock()
+        self._init_seconds = None
+        (registry if registry is not None else default_registry).add(self)
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def resolve(self):
+        """回傳實際物件，尚未建立時先建立"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                started = time.perf_counter()
+                self._instance = self._factory()
+                self._init_seconds = time.perf_counter() - started
+                logging.debug("元件 %s 已建立（%.1f ms）", self._name, self._init_seconds * 1000)
+            return self._instance
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        state = "ready" if self.initialized else "lazy"
+        return f"<Component {self._name} {state}>"
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self._components = []
+
+    def add(self, component):
+        self._components.append(component)
+
+    def __iter__(self):
+        return iter(list(self._components))
+
+    def preload(self, fork_safe_only=True):
+        """預先建立元件；fork_safe_only=True 時只建立可以在 fork 前建立的元件。回傳建立的名稱"""
+        loaded = []
+        for component in self:
+            if fork_safe_only and not component._fork_safe:
+                continue
+            if not component.initialized:
+                component.resolve()
+                loaded.append(component._name)
+        return loaded
+
+    def stats(self):
+        return {
+            component._name: {
+                "initialized": component.initialized,
+                "fork_safe": component._fork_safe,
+                "init_ms": round(component._init_seconds * 1000, 2) if component._init_seconds is not None else None,
+            }
+            for component in self
+        }
+
+
+default_registry = ComponentRegistry()
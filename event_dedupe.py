@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+# 處理中的事件超過這段時間（秒）沒有完成，視為工作行程已中止，允許重新處理
+DEFAULT_IN_FLIGHT_TIMEOUT = 300.0
+
+
+def event_key(event_id):
+    """webhookEventId 轉成 64 位元整數（約 70 bytes / 筆），碰撞機率可忽略"""
+    return int.from_bytes(hashlib.blake2b(event_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# === 去除重複的 webhook 事件（行程內） ===
+class EventDeduper:
+    """記錄處理中與已處理的 webhookEventId，LINE 重送（isRedelivery）的事件不再處理一次。
+
+    claim(event_id) 回傳 None 表示可以處理，否則回傳重複的原因（"in_flight" / "processed"）；
+    處理完呼叫 complete()，失敗或未處理（佇列已滿）時呼叫 release() 讓重送的事件可以重新處理。
+
+    已處理的事件分成 generations 個時間區段的 set，每 ttl / generations 秒換一個新區段並丟棄
+    最舊的區段，不需逐筆檢查到期時間；總數超過 max_entries 時提早丟棄最舊的區段。
+    """
+
+    def __init__(self, ttl=3600.0, max_entries=1_000_000, generations=4,
+                 in_flight_timeout=DEFAULT_IN_FLIGHT_TIMEOUT, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.generations = max(2, int(generations))
+        self.in_flight_timeout = in_flight_timeout
+        self.clock = clock
+        self._span = ttl / self.generations
+        self._sets = [set()]
+        self._rotated_at = clock()
+        self._in_flight = {}  # key -> 開始處理的時間
+        self._lock = threading.Lock()
+        self.claimed = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def _rotate(self, now):
+        steps = int((now - self._rotated_at) // self._span)
+        if steps >= self.generations:
+            # 閒置超過 ttl，所有區段都已過期
+            self._sets = [set()]
+            self._rotated_at = now
+        elif steps > 0:
+            self._sets.extend(set() for _ in range(steps))
+            self._rotated_at += steps * self._span
+        # 保留 generations 個區段：最舊的區段內的事件已超過 ttl
+        while len(self._sets) > self.generations:
+            self._sets.pop(0)
+        while len(self._sets) > 1 and sum(map(len, self._sets)) > self.max_entries:
+            self.evicted += len(self._sets.pop(0))
+
+    def claim(self, event_id):
+        key = event_key(event_id)
+        with self._lock:
+            now = self.clock()
+            self._rotate(now)
+            started = self._in_flight.get(key)
+            if started is not None and now - started < self.in_flight_timeout:
+                self.duplicates += 1
+                return "in_flight"
+            for seen in self._sets:
+                if key in seen:
+                    self.duplicates += 1
+                    return "processed"
+            self._in_flight[key] = now
+            self.claimed += 1
+            return None
+
+    def complete(self, event_id):
+        key = event_key(event_id)
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._sets[-1].add(key)
+
+    def release(self, event_id):
+        with self._lock:
+            self._in_flight.pop(event_key(event_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": sum(map(len, self._sets)),
+                "in_flight": len(self._in_flight),
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+                "evicted": self.evicted,
+            }
+
+
+# === 去除重複的 webhook 事件（多個工作行程共用） ===
+class SharedEventDeduper:
+    """以 SQLite 檔案記錄事件，同一台機器上的多個工作行程（gunicorn -w N）共用。
+
+    介面與 EventDeduper 相同；處理中的事件以較短的 in_flight_timeout 到期，
+    工作行程中止時重送的事件仍可被處理。每 purge_every 次 claim 刪除一次過期的紀錄。
+    """
+
+    def __init__(self, path, ttl=3600.0, in_flight_timeout=DEFAULT_IN_FLIGHT_TIMEOUT,
+                 purge_every=1000, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.in_flight_timeout = in_flight_timeout
+        self.purge_every = max(1, int(purge_every))
+        self.clock = clock
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " key INTEGER PRIMARY KEY, done INTEGER NOT NULL, expires_at REAL NOT NULL)")
+        self.claimed = 0
+        self.duplicates = 0
+        self._claims_since_purge = 0
+
+    @staticmethod
+    def _key(event_id):
+        # SQLite 的 INTEGER 為有號 64 位元
+        key = event_key(event_id)
+        return key - (1 << 64) if key >= 1 << 63 else key
+
+    def claim(self, event_id):
+        key = self._key(event_id)
+        with self._lock:
+            now = self.clock()
+            # 沒有紀錄或紀錄已過期時寫入（原子操作，多個行程同時 claim 只有一個成功）
+            cursor = self._db.execute(
+                "INSERT INTO events (key, done, expires_at) VALUES (?, 0, ?) "
+                "ON CONFLICT(key) DO UPDATE SET done = 0, expires_at = excluded.expires_at "
+                "WHERE events.expires_at <= ?",
+                (key, now + self.in_flight_timeout, now))
+            if cursor.rowcount == 1:
+                self.claimed += 1
+                self._claims_since_purge += 1
+                if self._claims_since_purge >= self.purge_every:
+                    self._claims_since_purge = 0
+                    self._db.execute("DELETE FROM events WHERE expires_at <= ?", (now,))
+                return None
+            self.duplicates += 1
+            row = self._db.execute("SELECT done FROM events WHERE key = ?", (key,)).fetchone()
+            return "processed" if row and row[0] else "in_flight"
+
+    def complete(self, event_id):
+        with self._lock:
+            self._db.execute("UPDATE events SET done = 1, expires_at = ? WHERE key = ?",
+                             (self.clock() + self.ttl, self._key(event_id)))
+
+    def release(self, event_id):
+        with self._lock:
+            self._db.execute("DELETE FROM events WHERE key = ? AND done = 0", (self._key(event_id),))
+
+    def stats(self):
+        with self._lock:
+            entries, in_flight = self._db.execute(
+                "SELECT COUNT(*), COUNT(*) - COALESCE(SUM(done), 0) FROM events WHERE expires_at > ?",
+                (self.clock(),)).fetchone()
+            return {
+                "backend": "sqlite",
+                "entries": entries,
+                "in_flight": in_flight,
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+            }
+
+    def close(self):
+        with self._lock:
+            try:
+                self._db.close()
+            except sqlite3.Error as e:
+                logging.warning(f"關閉事件去重索引失敗：{str(e)}")
@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+import zlib
+
+
+# === 背景事件處理：有界佇列 + 工作執行緒池 ===
+class EventDispatcher:
+    """將 webhook 事件放入有界佇列，由背景工作執行緒處理。
+
+    同一個 key（使用者 ID）的事件永遠分派到同一個工作執行緒，因此會依序處理；
+    不同使用者的事件則可以並行。
+    """
+
+    def __init__(self, handler, num_workers=4, max_queue_size=1000, name="event-worker"):
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.max_queue_size = max(self.num_workers, int(max_queue_size))
+        self.name = name
+
+        # 每個工作執行緒一個佇列，總容量約為 max_queue_size
+        per_worker = max(1, self.max_queue_size // self.num_workers)
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(self.num_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started_at = None
+
+        # 統計資料
+        self._busy = [False] * self.num_workers
+        self._busy_seconds = [0.0] * self.num_workers
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    # 第一次送出事件時才啟動執行緒，import 時不產生副作用
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.monotonic()
+            for index in range(self.num_workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    args=(index,),
+                    name=f"{self.name}-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _shard(self, key):
+        if not key:
+            return 0
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_workers
+
+    def submit(self, key, item):
+        """送出一個工作；佇列已滿時回傳 False（不阻塞 webhook）"""
+        self.start()
+        try:
+            self._queues[self._shard(key)].put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logging.error(f"事件佇列已滿，丟棄事件（key={key}）")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _worker_loop(self, index):
+        work_queue = self._queues[index]
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+            self._busy[index] = True
+            started = time.monotonic()
+            try:
+                self.handler(item)
+                with self._lock:
+                    self.processed += 1
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                logging.error("[背景事件處理錯誤]")
+                logging.error(traceback.format_exc())
+            finally:
+                self._busy_seconds[index] += time.monotonic() - started
+                self._busy[index] = False
+                work_queue.task_done()
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self):
+        """等待目前佇列中的事件全部處理完畢（測試與關機時使用）"""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for work_queue in self._queues:
+            work_queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        busy_total = sum(self._busy_seconds)
+        utilisation = busy_total / (elapsed * self.num_workers) if elapsed > 0 else 0.0
+        return {
+            "workers": self.num_workers,
+            "busy_workers": sum(1 for busy in self._busy if busy),
+            "utilisation": round(min(1.0, utilisation), 4),
+            "queue_depth": self.queue_depth(),
+            "queue_capacity": sum(q.maxsize for q in self._queues),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,339 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+
+def _load_aiohttp():
+    """aiohttp 只有非同步模式（asgi_app.py）需要，第一次使用時才 import，未安裝時回傳 None"""
+    try:
+        import aiohttp
+    except ImportError:
+        return None
+    return aiohttp
+
+
+def __getattr__(name):
+    # http_client.aiohttp：import 約需 0.2 秒，不在載入模組時進行
+    if name == "aiohttp":
+        return _load_aiohttp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 可重試的 HTTP 狀態碼
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# 預設逾時（連線, 讀取），單位秒
+DEFAULT_TIMEOUT = (3.05, 10)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """斷路器開啟中，直接失敗而不送出請求"""
+
+
+def request_not_sent(error):
+    """例外是否代表請求確定沒有送出（建立連線失敗、連線逾時、斷路器開啟）。
+
+    讀取逾時、送出後連線被中斷等錯誤回傳 False：對方可能已經處理了這個請求。
+    """
+    if isinstance(error, (CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        # 送出後連線中斷也是 ConnectionError，只有建立連線失敗時原因才是 NewConnectionError
+        cause = error.args[0] if error.args else None
+        if isinstance(cause, MaxRetryError):
+            cause = cause.reason
+        return isinstance(cause, (NewConnectionError, ConnectTimeoutError))
+    aiohttp = _load_aiohttp()
+    if aiohttp is not None:
+        return isinstance(error, (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", ())))
+    return False
+
+
+# === 斷路器：連續失敗過多時暫停對該主機送出請求 ===
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            # 半開狀態只放行一個試探請求
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """不計成功或失敗（例如 429），只釋放半開狀態的試探名額，下一個請求可以再試探"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"斷路器開啟（連續失敗 {self.failures} 次）")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+# === 共用 HTTP 用戶端：連線池、逾時、重試與斷路器 ===
+class _RetryingClient:
+    """同步與非同步用戶端共用的重試、退避與斷路器設定。
+
+    endpoints 為「端點名稱 -> 設定」的字典，設定可包含：
+    - timeout：(連線逾時, 讀取逾時)
+    - retries：最多重試次數
+    - idempotent：False 時只在請求確定未送達（連線失敗、429）時重試
+    """
+
+    def __init__(self, endpoints=None, max_retries=2,
+                 backoff_base=0.2, backoff_cap=2.0, max_retry_after=5.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.endpoints = dict(endpoints or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.short_circuited = 0
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, min(float(retry_after), self.max_retry_after))
+        return delay
+
+    def _policy(self, method, endpoint):
+        """回傳 (逾時, 最多重試次數, 是否冪等)"""
+        config = self.endpoints.get(endpoint, {})
+        return (
+            config.get("timeout", DEFAULT_TIMEOUT),
+            config.get("retries", self.max_retries),
+            config.get("idempotent", method.upper() in ("GET", "HEAD", "OPTIONS")),
+        )
+
+    def _check_breaker(self, breaker, host):
+        if not breaker.allow():
+            with self._lock:
+                self.short_circuited += 1
+            raise CircuitOpenError(f"{host} 斷路器開啟中，暫停送出請求")
+
+    def _count_retry(self, method, host, attempt, delay):
+        with self._lock:
+            self.retries += 1
+        logging.warning(f"{method} {host} 第 {attempt} 次重試，等待 {delay:.2f} 秒")
+
+    def _breaker_stats(self):
+        with self._lock:
+            breakers = {host: breaker.state for host, breaker in self._breakers.items()}
+        return {
+            "circuit_breakers": breakers,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class HttpClient(_RetryingClient):
+    """所有對外 HTTP 請求共用的用戶端（requests，連線池 + 重試 + 斷路器）"""
+
+    def __init__(self, endpoints=None, pool_maxsize=20, **kwargs):
+        super().__init__(endpoints, **kwargs)
+        # 每個主機各自有一個 keep-alive 連線池
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        timeout, retries, idempotent = self._policy(method, endpoint)
+        kwargs.setdefault("timeout", timeout)
+
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+
+        attempt = 0
+        while True:
+            self._check_breaker(breaker, host)
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                breaker.record_failure()
+                # 非冪等請求在讀取逾時時可能已被處理，不重試
+                if attempt >= retries or not (idempotent or request_not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                # 429 代表被限流，不算主機故障，但要釋放半開狀態的試探名額
+                if status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                if attempt >= retries or not (idempotent or status == 429):
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+
+            attempt += 1
+            self._count_retry(method, host, attempt, delay)
+            time.sleep(delay)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def pool_stats(self):
+        """各主機連線池的重用統計：hits 為重用既有連線的請求數，misses 為新建連線數"""
+        hosts = {}
+        seen = set()
+        for adapter in self.session.adapters.values():
+            if id(adapter) in seen:
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+                misses = pool.num_connections
+                hosts[host] = {
+                    "requests": pool.num_requests,
+                    "hits": max(0, pool.num_requests - misses),
+                    "misses": misses,
+                }
+        stats = {"pools": hosts}
+        stats.update(self._breaker_stats())
+        return stats
+
+
+class AsyncHttpClient(_RetryingClient):
+    """非同步用戶端（aiohttp），重試與斷路器規則與 HttpClient 相同。
+
+    回傳 aiohttp 的回應；stream=False 時內容已讀取完畢並歸還連線，
+    stream=True 時呼叫端需讀取內容後呼叫 response.release()（或 close()）。
+    """
+
+    def __init__(self, endpoints=None, pool_maxsize=100, **kwargs):
+        self._aiohttp = _load_aiohttp()
+        if self._aiohttp is None:
+            raise RuntimeError("非同步模式需要安裝 aiohttp（pip install aiohttp）")
+        super().__init__(endpoints, **kwargs)
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+
+    def session(self):
+        # aiohttp 的 session 需在 event loop 中建立
+        if self._session is None or self._session.closed:
+            aiohttp = self._aiohttp
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize, limit_per_host=self.pool_maxsize)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, method, url, endpoint=None, stream=False, **kwargs):
+        import asyncio
+        aiohttp = self._aiohttp
+        timeout, retries, idempotent = self._policy(method, endpoint)
+        connect, read = kwargs.pop("timeout", timeout)
+        kwargs["timeout"] = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+
+        attempt = 0
+        while True:
+            self._check_breaker(breaker, host)
+
+            try:
+                response = await self.session().request(method, url, **kwargs)
+                if not stream:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                # 非冪等請求在讀取逾時時可能已被處理，不重試
+                if attempt >= retries or not (idempotent or request_not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                status = response.status
+                if status not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                # 429 代表被限流，不算主機故障，但要釋放半開狀態的試探名額
+                if status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                if attempt >= retries or not (idempotent or status == 429):
+                    return response
+                delay = self._backoff(attempt, response)
+                response.release()
+
+            attempt += 1
+            self._count_retry(method, host, attempt, delay)
+            await asyncio.sleep(delay)
+
+    async def get(self, url, endpoint=None, **kwargs):
+        return await self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    async def post(self, url, endpoint=None, **kwargs):
+        return await self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def pool_stats(self):
+        return self._breaker_stats()
@@ -0,0 +1,248 @@
+import atexit
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from cache_utils import TTLCache
+
+
+@functools.lru_cache(maxsize=None)
+def _pillow():
+    """Pillow 為選用套件，第一次計算感知雜湊時才 import；沒有安裝時回傳 None，只比對內容雜湊"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def __getattr__(name):
+    # image_cache.Image：import PIL.Image 不在載入模組時進行
+    if name == "Image":
+        return _pillow()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+ImageKey = namedtuple("ImageKey", ["content_hash", "phash"])
+
+HASH_BITS = 64
+
+
+# === 內容雜湊：完全相同的圖片 ===
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# === 感知雜湊（dHash）：重新壓縮或縮放後的圖片仍會得到相近的值 ===
+def perceptual_hash(data, hash_size=8):
+    Image = _pillow()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG 可直接以較低解析度解碼，省下大部分解碼時間
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+            pixels = small.tobytes()
+    except Exception as e:
+        logging.warning(f"無法計算圖片感知雜湊：{str(e)}")
+        return None
+
+    value = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * width + col]
+            right = pixels[row * width + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+# === 感知雜湊的近鄰索引 ===
+class PerceptualIndex:
+    """把 64 位元雜湊切成 max_distance + 1 段：距離不超過 max_distance 的兩個雜湊，
+    至少會有一段完全相同（鴿籠原理），因此只需比對同段相同的候選項目。"""
+
+    def __init__(self, max_distance=6, bits=HASH_BITS):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        widths = [bits // bands + (1 if i < bits % bands else 0) for i in range(bands)]
+        self._bands = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._bands]
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, phash):
+        with self._lock:
+            if key in self._hashes:
+                return
+            self._hashes[key] = phash
+            for table, (shift, mask) in zip(self._tables, self._bands):
+                table.setdefault((phash >> shift) & mask, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            phash = self._hashes.pop(key, None)
+            if phash is None:
+                return
+            for table, (shift, mask) in zip(self._tables, self._bands):
+                band = (phash >> shift) & mask
+                bucket = table.get(band)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del table[band]
+
+    def nearest(self, phash):
+        """回傳距離最近且不超過 max_distance 的 (key, 距離)，找不到時回傳 (None, None)"""
+        best_key, best_distance = None, None
+        with self._lock:
+            seen = set()
+            for table, (shift, mask) in zip(self._tables, self._bands):
+                for key in table.get((phash >> shift) & mask, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming_distance(phash, self._hashes[key])
+                    if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                        best_key, best_distance = key, distance
+        return best_key, best_distance
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+# === 圖片分析結果快取 ===
+class ImageResultCache:
+    """以內容雜湊與感知雜湊快取圖片分析結果；可選擇在重新啟動間保存到檔案"""
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600, max_distance=6,
+                 persist_path=None, save_every=100):
+        self.ttl = ttl
+        self.index = PerceptualIndex(max_distance=max_distance)
+        # 值為 (感知雜湊, 分析結果)
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl, on_evict=self._on_evict)
+        self.persist_path = persist_path
+        self.save_every = save_every
+        self._unsaved = 0
+        self._save_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def _on_evict(self, key, value):
+        self.index.remove(key)
+
+    def lookup(self, data):
+        """回傳 (快取的分析結果或 None, ImageKey)；ImageKey 供之後 store 使用"""
+        with self._stats_lock:
+            self.lookups += 1
+        digest = content_hash(data)
+        entry = self.cache.get(digest)
+        if entry is not None:
+            with self._stats_lock:
+                self.exact_hits += 1
+            return entry[1], ImageKey(digest, entry[0])
+
+        phash = perceptual_hash(data)
+        key = ImageKey(digest, phash)
+        if phash is None:
+            return None, key
+
+        similar, distance = self.index.nearest(phash)
+        if similar is not None:
+            entry = self.cache.get(similar)
+            if entry is not None:
+                with self._stats_lock:
+                    self.perceptual_hits += 1
+                logging.info(f"找到相似圖片的分析結果（距離 {distance}）")
+                # 記住這份內容，下次可直接以內容雜湊命中
+                self.store(key, entry[1])
+                return entry[1], key
+        return None, key
+
+    def store(self, key, result):
+        self.cache.set(key.content_hash, (key.phash, result))
+        if key.phash is not None:
+            self.index.add(key.content_hash, key.phash)
+        if self.persist_path:
+            with self._save_lock:
+                self._unsaved += 1
+                should_save = self._unsaved >= self.save_every
+            if should_save:
+                self.save()
+
+    # === 保存到檔案（暫存檔 + rename，確保檔案完整） ===
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._save_lock:
+            entries = [
+                {"content_hash": key, "phash": phash, "result": result, "ttl": remaining}
+                for key, (phash, result), remaining in self.cache.items()
+            ]
+            data = {"saved_at": time.time(), "entries": entries}
+            directory = os.path.dirname(os.path.abspath(self.persist_path))
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.persist_path)
+                self._unsaved = 0
+            except Exception as e:
+                logging.error(f"保存圖片分析快取失敗：{str(e)}")
+
+    def load(self):
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"讀取圖片分析快取失敗：{str(e)}")
+            return
+        elapsed = max(0.0, time.time() - data.get("saved_at", 0))
+        loaded = 0
+        for entry in data.get("entries", []):
+            remaining = entry.get("ttl", 0) - elapsed
+            if remaining <= 0:
+                continue
+            key = ImageKey(entry["content_hash"], entry.get("phash"))
+            self.cache.set(key.content_hash, (key.phash, entry["result"]), ttl=remaining)
+            if key.phash is not None:
+                self.index.add(key.content_hash, key.phash)
+            loaded += 1
+        logging.info(f"已載入 {loaded} 筆圖片分析快取")
+
+    def stats(self):
+        hits = self.exact_hits + self.perceptual_hits
+        return {
+            "size": len(self.cache),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "perceptual_hits": self.perceptual_hits,
+            "hit_ratio": round(hits / self.lookups, 4) if self.lookups else 0.0,
+            "evictions": self.cache.evictions,
+            "perceptual_hashing": _pillow() is not None,
+        }
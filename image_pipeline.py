@@ -0,0 +1,200 @@
+import io
+import mmap
+import tempfile
+
+
+class ImageDownloadError(Exception):
+    """圖片下載失敗"""
+
+
+class ImageTooLargeError(ImageDownloadError):
+    """圖片超過大小上限"""
+
+
+class NotAnImageError(ImageDownloadError):
+    """內容的檔頭不是支援的圖片格式"""
+
+
+# === 依檔頭（magic bytes）判斷圖片格式 ===
+SNIFF_BYTES = 12
+
+def sniff_image_type(head):
+    head = bytes(head[:SNIFF_BYTES])
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "webp"
+    if head.startswith(b"BM"):
+        return "bmp"
+    return None
+
+
+# === 記憶體中的圖片內容 ===
+class ImageBuffer:
+    """小圖片只放在記憶體；超過 spool_threshold 才寫入暫存檔。
+
+    view() 回傳不複製資料的 memoryview（記憶體內為 BytesIO 緩衝區，暫存檔則使用 mmap）。
+    """
+
+    def __init__(self, spool_threshold=4 * 1024 * 1024):
+        self.spool_threshold = spool_threshold
+        self.size = 0
+        self.image_type = None
+        self._file = io.BytesIO()
+        self._in_memory = True
+        self._mmap = None
+        self._view = None
+
+    @property
+    def in_memory(self):
+        return self._in_memory
+
+    def write(self, chunk):
+        if self._view is not None:
+            raise ValueError("已取得 memoryview 的圖片不能再寫入")
+        if self._in_memory and self.size + len(chunk) > self.spool_threshold:
+            spooled = tempfile.TemporaryFile()
+            spooled.write(self._file.getbuffer())
+            self._file.close()
+            self._file = spooled
+            self._in_memory = False
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def view(self):
+        if self._view is None:
+            if self._in_memory:
+                self._view = self._file.getbuffer()
+            elif self.size == 0:
+                self._view = memoryview(b"")
+            else:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+        return self._view
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        where = "memory" if self._in_memory else "spooled"
+        return f"<ImageBuffer {self.image_type or 'unknown'} {self.size} bytes ({where})>"
+
+
+# === 串流複製圖片內容，超過上限或不是圖片時提早中止 ===
+class ImageStreamChecker:
+    """逐塊檢查下載內容並寫入 sink（需有 write 方法）；同步與非同步下載共用"""
+
+    def __init__(self, sink, max_bytes, content_length=None):
+        if content_length and str(content_length).isdigit() and int(content_length) > max_bytes:
+            raise ImageTooLargeError(f"圖片大小 {content_length} bytes 超過上限 {max_bytes} bytes")
+        self.sink = sink
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.image_type = None
+        self._head = b""
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ImageTooLargeError(f"圖片大小超過上限 {self.max_bytes} bytes")
+        if self.image_type is not None:
+            self.sink.write(chunk)
+            return
+        self._head += chunk
+        if len(self._head) >= SNIFF_BYTES:
+            self._sniff()
+
+    def _sniff(self):
+        self.image_type = sniff_image_type(self._head)
+        if self.image_type is None:
+            raise NotAnImageError("下載的內容不是支援的圖片格式")
+        self.sink.write(self._head)
+        self._head = b""
+
+    def finish(self):
+        """回傳 (大小, 圖片格式)"""
+        # 內容太短，無法湊滿檔頭
+        if self.image_type is None and self._head:
+            self._sniff()
+        if self.size == 0:
+            raise ImageDownloadError("下載的圖片大小為 0")
+        return self.size, self.image_type
+
+
+def copy_image_stream(response, sink, max_bytes, chunk_size=65536):
+    """把 HTTP 回應內容寫入 sink（需有 write 方法），回傳 (大小, 圖片格式)"""
+    try:
+        checker = ImageStreamChecker(sink, max_bytes, response.headers.get("Content-Length"))
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            checker.feed(chunk)
+        return checker.finish()
+    finally:
+        response.close()
+
+
+async def async_copy_image_stream(response, sink, max_bytes, chunk_size=65536):
+    """非同步版本，response 為 aiohttp 以 stream=True 取得的回應"""
+    try:
+        checker = ImageStreamChecker(sink, max_bytes, response.headers.get("Content-Length"))
+        async for chunk in response.content.iter_chunked(chunk_size):
+            checker.feed(chunk)
+        result = checker.finish()
+    except BaseException:
+        # 內容未讀完，不能把連線放回連線池
+        response.close()
+        raise
+    response.release()
+    return result
+
+
+def download_to_buffer(response, max_bytes, spool_threshold):
+    buffer = ImageBuffer(spool_threshold=spool_threshold)
+    try:
+        _, buffer.image_type = copy_image_stream(response, buffer, max_bytes)
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
+
+
+async def async_download_to_buffer(response, max_bytes, spool_threshold):
+    buffer = ImageBuffer(spool_threshold=spool_threshold)
+    try:
+        _, buffer.image_type = await async_copy_image_stream(response, buffer, max_bytes)
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
+
+
+# === 取得圖片內容（檔案路徑、ImageBuffer 或 bytes） ===
+def image_bytes(image):
+    """ImageBuffer 與 bytes 直接回傳 memoryview（不複製）；檔案路徑則讀取檔案內容"""
+    if isinstance(image, ImageBuffer):
+        return image.view()
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return memoryview(f.read())
+    return memoryview(image)
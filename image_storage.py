@@ -0,0 +1,368 @@
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+
+StoredImage = namedtuple("StoredImage", ["id", "path", "user_id", "message_id", "size", "created_at", "kept"])
+
+INDEX_FILE = "index.sqlite3"
+TMP_DIR = "tmp"
+TMP_SUFFIX = ".part"
+
+# 這個 store 寫入的檔名（uuid4().hex + 副檔名）與分層目錄名稱；清理只會刪除符合的檔案
+_IMAGE_NAME = re.compile(r"^([0-9a-f]{32})(\.[A-Za-z0-9]{1,8})?$")
+_SHARD_NAME = re.compile(r"^[0-9a-f]{2}$")
+
+
+class ImageStoreFull(Exception):
+    """標記保留的圖片已佔滿容量上限，沒有可以刪除的圖片"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    kept INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_user ON images (user_id, created_at);
+CREATE INDEX IF NOT EXISTS images_message ON images (message_id);
+CREATE INDEX IF NOT EXISTS images_created ON images (created_at);
+CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals VALUES ('bytes', 0);
+"""
+
+
+# === 圖片儲存：雜湊分層目錄 + SQLite 索引 + 容量上限 + 背景清理 ===
+class ImageStore:
+    """圖片存放在 root/ab/cd/<id>.jpg（id 為隨機 UUID，前幾碼分層），單一目錄不會累積大量檔案。
+
+    - 寫入先寫到 root/tmp 的暫存檔，完成後 rename 到最終位置，不會留下寫到一半的圖片
+    - SQLite 索引記錄使用者、訊息 ID、大小與時間，可依使用者或訊息查詢，不必列目錄
+    - 總大小超過 max_bytes 時從最舊的未保留圖片開始刪除；保留的圖片本身就超過上限時寫入失敗（ImageStoreFull）
+    - 沒有標記保留（keep）的圖片只是處理中的暫存；超過 orphan_ttl 秒仍在的視為流程中斷遺留，
+      由背景清理執行緒刪除，沒有索引的檔案（例如寫入後行程當掉）也一併清除。
+      只會刪除 tmp/ 的暫存檔與分層目錄中符合命名規則的檔案，目錄中其他的檔案不受影響
+    多個工作行程可以共用同一個目錄與索引。
+    """
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, orphan_ttl=3600, sweep_interval=300,
+                 sweep_shards=16, shard_depth=2, fsync=True, clock=time.time):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        self.orphan_ttl = orphan_ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_shards = max(1, int(sweep_shards))
+        self.shard_depth = max(0, int(shard_depth))
+        self.fsync = fsync
+        self.clock = clock
+        self._tmp_dir = os.path.join(self.root, TMP_DIR)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+        self._sweeper = None
+        self._sweep_cursor = 0
+        self.stored = 0
+        self.evicted = 0
+        self.swept_orphans = 0
+        self.swept_untracked = 0
+
+    # === 路徑 ===
+    def _relative_path(self, image_id, suffix):
+        shards = [image_id[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(*shards, image_id + suffix)
+
+    def _absolute(self, relative):
+        return os.path.join(self.root, relative)
+
+    def _relative(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        return None if relative.startswith(os.pardir) else relative
+
+    # === 寫入 ===
+    def writer(self, user_id, message_id, suffix=".jpg", keep=False):
+        """with store.writer(...) as f: f.write(...)；區塊正常結束才會出現在最終位置與索引中"""
+        self._start_sweeper()
+        return _ImageWriter(self, user_id, message_id, suffix, keep)
+
+    def put(self, data, user_id, message_id, suffix=".jpg", keep=False):
+        with self.writer(user_id, message_id, suffix, keep) as f:
+            f.write(data)
+        return f.record
+
+    def _commit(self, tmp_path, image_id, user_id, message_id, suffix, size, keep):
+        relative = self._relative_path(image_id, suffix)
+        final_path = self._absolute(relative)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        created_at = self.clock()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (image_id, relative, user_id, str(message_id), size, created_at, int(keep)))
+                self._db.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'", (size,))
+                self._evict_over_quota(keep_id=image_id)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                _unlink(final_path)
+                raise
+            self.stored += 1
+        return StoredImage(image_id, final_path, user_id, str(message_id), size, created_at, bool(keep))
+
+    def _evict_over_quota(self, keep_id=None):
+        """在交易中呼叫：總大小超過上限時從最舊的未保留圖片開始刪除，保留的證據不刪除"""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        # 先確認刪除所有未保留的圖片後能降到上限以下，才開始刪除檔案（交易失敗時刪掉的檔案無法復原）
+        (pinned,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM images WHERE kept = 1 OR id = ?", (keep_id or "",)).fetchone()
+        if pinned > self.max_bytes:
+            raise ImageStoreFull(f"保留的圖片已佔滿儲存空間上限（{pinned} / {self.max_bytes} bytes）")
+        while total > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT id, path, size FROM images WHERE kept = 0 AND id != ? ORDER BY created_at LIMIT 64",
+                (keep_id or "",)).fetchall()
+            if not rows:
+                break
+            for image_id, relative, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._delete_row(image_id, relative, size)
+                total -= size
+                self.evicted += 1
+                logging.info("圖片儲存空間超過上限，刪除最舊的圖片：%s", relative)
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+
+    def _delete_row(self, image_id, relative, size):
+        cursor = self._db.execute("DELETE FROM images WHERE id = ?", (image_id,))
+        if cursor.rowcount:
+            self._db.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (size,))
+        _unlink(self._absolute(relative))
+
+    # === 查詢與刪除 ===
+    def _record(self, row):
+        image_id, relative, user_id, message_id, size, created_at, kept = row
+        return StoredImage(image_id, self._absolute(relative), user_id, message_id, size, created_at, bool(kept))
+
+    def get(self, path):
+        relative = self._relative(path)
+        if relative is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT * FROM images WHERE path = ?", (relative,)).fetchone()
+        return self._record(row) if row else None
+
+    def find(self, user_id=None, message_id=None, limit=100):
+        """依使用者或訊息 ID 查詢，新的在前"""
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if message_id is not None:
+            conditions.append("message_id = ?")
+            params.append(str(message_id))
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM images{where} ORDER BY created_at DESC LIMIT ?", params + [limit]).fetchall()
+        return [self._record(row) for row in rows]
+
+    def keep(self, path):
+        """標記為保留的證據，背景清理與容量上限都不會刪除"""
+        relative = self._relative(path)
+        with self._lock:
+            cursor = self._db.execute("UPDATE images SET kept = 1 WHERE path = ?", (relative,))
+        return cursor.rowcount > 0
+
+    def discard(self, path):
+        """處理完畢後刪除暫存圖片；標記保留的圖片不刪除。回傳是否有刪除"""
+        relative = self._relative(path)
+        with self._lock:
+            row = self._db.execute("SELECT id, size, kept FROM images WHERE path = ?", (relative,)).fetchone()
+            if row is None:
+                return False
+            image_id, size, kept = row
+            if kept:
+                return False
+            self._delete_row(image_id, relative, size)
+        return True
+
+    def remove(self, path):
+        relative = self._relative(path)
+        with self._lock:
+            row = self._db.execute("SELECT id, size FROM images WHERE path = ?", (relative,)).fetchone()
+            if row is None:
+                return False
+            self._delete_row(row[0], relative, row[1])
+        return True
+
+    # === 背景清理 ===
+    # 第一次寫入時才啟動，import 時不產生副作用
+    def _start_sweeper(self):
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="image-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"清理圖片儲存目錄失敗：{str(e)}")
+
+    def sweep(self, now=None, full=False):
+        """刪除遺留的暫存圖片與沒有索引的檔案；每次只檢查部分分層目錄，full=True 時檢查全部"""
+        now = self.clock() if now is None else now
+        cutoff = now - self.orphan_ttl
+
+        # 1. 索引中超過 orphan_ttl 仍未保留也未刪除的圖片
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, path, size FROM images WHERE kept = 0 AND created_at < ?", (cutoff,)).fetchall()
+            for image_id, relative, size in rows:
+                self._delete_row(image_id, relative, size)
+            self.swept_orphans += len(rows)
+
+        # 2. 沒有索引的檔案：寫到一半的暫存檔、寫入後來不及建立索引的圖片
+        untracked = 0
+        for path in self._untracked_candidates(full):
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            relative = self._relative(path)
+            with self._lock:
+                indexed = self._db.execute("SELECT 1 FROM images WHERE path = ?", (relative,)).fetchone()
+            if not indexed:
+                _unlink(path)
+                untracked += 1
+        self.swept_untracked += untracked
+        if rows or untracked:
+            logging.info("圖片儲存清理完成：遺留暫存 %d 張，沒有索引的檔案 %d 個", len(rows), untracked)
+        return len(rows), untracked
+
+    def _untracked_candidates(self, full):
+        with os.scandir(self._tmp_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(TMP_SUFFIX):
+                    yield entry.path
+        shards = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_dir() and _SHARD_NAME.match(entry.name):
+                    shards.append(entry.path)
+        shards.sort()
+        if not full and len(shards) > self.sweep_shards:
+            # 輪流檢查，每次只走訪 sweep_shards 個第一層目錄
+            start = self._sweep_cursor % len(shards)
+            self._sweep_cursor = start + self.sweep_shards
+            shards = (shards + shards)[start:start + self.sweep_shards]
+        for shard in shards:
+            yield from self._shard_files(shard, [os.path.basename(shard)])
+
+    def _shard_files(self, directory, prefixes):
+        """分層目錄中的圖片：只走訪兩碼十六進位的子目錄，檔名的 ID 開頭必須與所在的分層目錄相符"""
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+        for entry in entries:
+            if len(prefixes) < self.shard_depth:
+                if entry.is_dir() and _SHARD_NAME.match(entry.name):
+                    yield from self._shard_files(entry.path, prefixes + [entry.name])
+                continue
+            match = _IMAGE_NAME.match(entry.name)
+            if match and entry.is_file() and match.group(1).startswith("".join(prefixes)):
+                yield entry.path
+
+    def stats(self):
+        with self._lock:
+            count, kept = self._db.execute("SELECT COUNT(*), COALESCE(SUM(kept), 0) FROM images").fetchone()
+            total = self._total_bytes()
+        return {
+            "root": self.root,
+            "images": count,
+            "kept": kept,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "stored": self.stored,
+            "evicted": self.evicted,
+            "swept_orphans": self.swept_orphans,
+            "swept_untracked": self.swept_untracked,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _ImageWriter:
+    """暫存檔寫入器；with 區塊正常結束時 rename 到最終位置並建立索引，發生例外時刪除暫存檔"""
+
+    def __init__(self, store, user_id, message_id, suffix, keep):
+        self.store = store
+        self.user_id = user_id
+        self.message_id = message_id
+        self.suffix = suffix
+        self.keep = keep
+        self.id = uuid.uuid4().hex
+        self.size = 0
+        self.record = None
+        fd, self.tmp_path = tempfile.mkstemp(dir=store._tmp_dir, suffix=TMP_SUFFIX)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        written = self._file.write(data)
+        self.size += written
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._file.flush()
+                if self.store.fsync:
+                    os.fsync(self._file.fileno())
+            self._file.close()
+            if exc_type is None:
+                self.record = self.store._commit(self.tmp_path, self.id, self.user_id, self.message_id,
+                                                 self.suffix, self.size, self.keep)
+        finally:
+            if self.record is None:
+                _unlink(self.tmp_path)
+        return False
+
+    @property
+    def path(self):
+        return self.record.path if self.record else None
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from text_cache import normalize_text
+
+
+# 單一關鍵字定義與比對結果
+Keyword = namedtuple("Keyword", ["phrase", "category", "weight"])
+KeywordMatch = namedtuple("KeywordMatch", ["phrase", "category", "weight", "start", "end"])
+
+
+# === Aho-Corasick 多關鍵字比對自動機 ===
+class KeywordAutomaton:
+    """建構一次後，每則訊息只需掃描一遍即可找出所有關鍵字"""
+
+    def __init__(self, keywords, version=""):
+        self.keywords = list(keywords)
+        self.version = version
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._build()
+
+    def _build(self):
+        goto, fail, out = self._goto, self._fail, self._out
+
+        # 1. 建立 trie
+        for index, keyword in enumerate(self.keywords):
+            if not keyword.phrase:
+                continue
+            node = 0
+            for ch in keyword.phrase:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                node = nxt
+            out[node] = out[node] + (index,)
+
+        # 2. 以 BFS 計算失敗連結，並把後綴節點的輸出合併進來
+        pending = deque(goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in goto[node].items():
+                pending.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(ch, 0)
+                fail[child] = target if target != child else 0
+                out[child] = out[child] + out[fail[child]]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def scan(self, text):
+        """回傳文字中所有命中的關鍵字（含位置）"""
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        matches = []
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for index in out[node]:
+                    keyword = keywords[index]
+                    start = pos + 1 - len(keyword.phrase)
+                    matches.append(KeywordMatch(keyword.phrase, keyword.category, keyword.weight, start, pos + 1))
+        return matches
+
+
+# === 讀取關鍵字檔案 ===
+# 格式：每行「關鍵字<TAB>類別<TAB>權重」，類別與權重可省略，# 開頭為註解
+# 關鍵字以 normalize_text 正規化，與正規化後的訊息比對
+def parse_keyword_lines(lines, default_category="general", default_weight=1.0):
+    keywords = {}
+    for line_no, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [part.strip() for part in line.split("\t")]
+        phrase = normalize_text(parts[0])
+        if not phrase:
+            continue
+        category = parts[1] if len(parts) > 1 and parts[1] else default_category
+        try:
+            weight = float(parts[2]) if len(parts) > 2 and parts[2] else default_weight
+        except ValueError:
+            logging.warning(f"關鍵字檔案第 {line_no} 行權重格式錯誤：{raw!r}")
+            weight = default_weight
+        # 重複的關鍵字以最後一筆為準
+        keywords[phrase] = Keyword(phrase, category, weight)
+    return list(keywords.values())
+
+
+def load_keyword_file(path):
+    with open(path, "rb") as f:
+        content = f.read()
+    keywords = parse_keyword_lines(content.decode("utf-8").splitlines())
+    version = hashlib.blake2b(content, digest_size=8).hexdigest()
+    return KeywordAutomaton(keywords, version=version)
+
+
+# === 可熱更新的關鍵字引擎 ===
+class KeywordEngine:
+    """從檔案建立自動機；檔案修改後自動重建並以原子方式替換，不需重新啟動"""
+
+    def __init__(self, path, reload_interval=2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._automaton = KeywordAutomaton([])
+        self._mtime = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload_count = 0
+
+    @property
+    def automaton(self):
+        self._maybe_reload()
+        return self._automaton
+
+    @property
+    def version(self):
+        return self.automaton.version
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        # 只讓一個執行緒檢查檔案，其他執行緒繼續使用舊的自動機
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.reload_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                if self._mtime is not None:
+                    logging.warning(f"找不到關鍵字檔案，沿用目前的關鍵字：{self.path}")
+                self._mtime = None
+                return
+            if mtime != self._mtime:
+                self._load(mtime)
+        finally:
+            self._reload_lock.release()
+
+    def _load(self, mtime):
+        try:
+            automaton = load_keyword_file(self.path)
+        except Exception as e:
+            logging.error(f"載入關鍵字檔案失敗，沿用目前的關鍵字：{str(e)}")
+            return
+        # 參考替換為原子操作，正在掃描的執行緒仍使用舊的自動機
+        self._automaton = automaton
+        self._mtime = mtime
+        self.reload_count += 1
+        logging.info(f"已載入 {len(automaton)} 個詐騙關鍵字（版本 {automaton.version}）")
+
+    def reload(self):
+        """強制立即重新檢查關鍵字檔案"""
+        self._next_check = 0.0
+        self._mtime = None
+        self._maybe_reload()
+
+    def scan(self, text):
+        """訊息先以 normalize_text 正規化再比對，回傳的位置是正規化後文字中的位置"""
+        return self.automaton.scan(normalize_text(text))
@@ -0,0 +1,157 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# LogRecord 內建的欄位，其餘欄位（logging 的 extra=）會輸出到 JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+# === 遮蔽敏感資訊：token、簽名與授權標頭 ===
+class Redactor:
+    PATTERNS = [
+        (re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1***"),
+        (re.compile(
+            r"""((?:x-line-signature|authorization|channel_access_token|channel_secret|"""
+            r"""assertion_signing_key|replytoken)['"]?\s*[:=]\s*['"]?)([^'",\s}]+)""",
+            re.IGNORECASE,
+        ), r"\1***"),
+    ]
+
+    def __init__(self, secrets=()):
+        # 已知的密鑰值直接取代（太短的值容易誤判，略過）
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 8]
+
+    def __call__(self, text):
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, "***")
+        for pattern, replacement in self.PATTERNS:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+class RedactingFormatter(logging.Formatter):
+    def __init__(self, redactor, fmt=TEXT_FORMAT, datefmt=DATE_FORMAT):
+        super().__init__(fmt=fmt, datefmt=datefmt)
+        self.redactor = redactor
+
+    def format(self, record):
+        return self.redactor(super().format(record))
+
+
+# === 結構化 JSON 日誌 ===
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": self.redactor(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.redactor(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# === 延遲序列化：只有真正輸出日誌時才執行 json.dumps ===
+class LazyJson:
+    __slots__ = ("obj", "indent")
+
+    def __init__(self, obj, indent=None):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.obj, ensure_ascii=False, indent=self.indent, default=str)
+        except Exception:
+            return repr(self.obj)
+
+
+# === 大型內容（請求標頭、原始內容、API 回應）依比例抽樣記錄 ===
+PAYLOAD_SAMPLE_RATE = 1.0
+
+def should_log_payload(level=logging.INFO):
+    if not logging.getLogger().isEnabledFor(level):
+        return False
+    return PAYLOAD_SAMPLE_RATE >= 1.0 or random.random() < PAYLOAD_SAMPLE_RATE
+
+def log_payload(label, obj, level=logging.INFO):
+    if should_log_payload(level):
+        logging.log(level, "%s：%s", label, LazyJson(obj))
+
+
+# === 非同步寫出：請求執行緒只把 LogRecord 放入佇列 ===
+class RawQueueHandler(logging.handlers.QueueHandler):
+    """原本的 QueueHandler 會在呼叫端組合訊息與格式化例外；這裡直接放入原始的 LogRecord，
+    組合訊息（包含 LazyJson 的序列化）、遮蔽與 JSON 格式化都由背景執行緒的 handler 進行"""
+
+    def prepare(self, record):
+        return record
+
+
+# === 設定 root logger ===
+_listener = None
+_installed_handlers = []
+
+def configure_logging(level="INFO", fmt="text", async_handler=True, payload_sample_rate=1.0,
+                      secrets=(), stream=None):
+    """fmt 為 text 或 json；async_handler 為 True 時透過 QueueHandler 由背景執行緒格式化並寫出，
+    請求執行緒不會因格式化或 I/O 阻塞。"""
+    global _listener, PAYLOAD_SAMPLE_RATE
+    PAYLOAD_SAMPLE_RATE = max(0.0, min(1.0, float(payload_sample_rate)))
+
+    redactor = Redactor(secrets)
+    formatter = JsonFormatter(redactor) if fmt == "json" else RedactingFormatter(redactor)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level if isinstance(level, int) else str(level).upper())
+
+    # 可重複呼叫：先移除上次安裝的 handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in _installed_handlers:
+        root.removeHandler(handler)
+    _installed_handlers.clear()
+
+    if async_handler:
+        log_queue = queue.SimpleQueue()
+        handler = RawQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    root.addHandler(handler)
+    _installed_handlers.append(handler)
+    return handler
+
+
+def stop_logging():
+    """送出佇列中剩餘的日誌（程式結束時呼叫）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
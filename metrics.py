@@ -0,0 +1,361 @@
+import atexit
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import request_profiler
+
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+IMAGE_SIZE_BUCKETS = (10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PAYLOAD_SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+# === 指標型別 ===
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [各區間計數..., +Inf 計數, 總和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            data[index] += 1
+            data[-1] += value
+
+    def count(self, **labels):
+        data = self._values.get(_label_key(self.labelnames, labels))
+        return sum(data[:-1]) if data else 0
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): list(data) for key, data in self._values.items()}
+
+
+# === 指標註冊表 ===
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, func):
+        """輸出前呼叫 func()，用來更新佇列深度之類的即時數值"""
+        self._collectors.append(func)
+
+    def collect(self):
+        for func in self._collectors:
+            try:
+                func()
+            except Exception as e:
+                logging.error(f"更新指標時發生錯誤：{str(e)}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                "type": metric.kind,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.snapshot(),
+            }
+            for metric in metrics
+        }
+
+
+# === 多個工作行程：各行程把快照寫到共用目錄，輸出時加總 ===
+class MultiProcessStore:
+    def __init__(self, registry, directory, flush_interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        try:
+            snapshot = {"pid": os.getpid(), "metrics": self.registry.collect()}
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._path(os.getpid()))
+        except Exception as e:
+            logging.error(f"寫入指標快照失敗：{str(e)}")
+
+    def collect(self):
+        # 先寫入本行程最新的數值，再合併所有行程
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(snapshot.get("pid"))
+            for name, metric in snapshot.get("metrics", {}).items():
+                # 已結束行程的 gauge（例如處理中的請求數）不再計入
+                if metric["type"] == "gauge" and not alive:
+                    continue
+                target = merged.setdefault(name, dict(metric, samples={}))
+                for key, value in metric["samples"].items():
+                    if key not in target["samples"]:
+                        target["samples"][key] = value
+                    elif metric["type"] == "histogram":
+                        target["samples"][key] = [a + b for a, b in zip(target["samples"][key], value)]
+                    else:
+                        target["samples"][key] += value
+        return merged
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# === Prometheus 文字格式 ===
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(collected):
+    lines = []
+    for name in sorted(collected):
+        metric = collected[name]
+        labelnames = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric["samples"]):
+            values = json.loads(key)
+            sample = metric["samples"][key]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, values)} {_format_number(sample)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float("inf")], sample[:-1]):
+                cumulative += count
+                le = _format_number(bound)
+                lines.append(f"{name}_bucket{_format_labels(labelnames, values, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_number(sample[-1])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# === 全域註冊表與常用指標 ===
+registry = Registry()
+
+STAGE_DURATION = registry.histogram(
+    "scam_bot_stage_duration_seconds", "各處理階段耗時（秒）", ["stage", "message_type", "outcome"])
+STAGE_ERRORS = registry.counter(
+    "scam_bot_stage_errors_total", "各處理階段的錯誤次數", ["stage", "message_type"])
+EVENTS_RECEIVED = registry.counter(
+    "scam_bot_events_received_total", "收到的 webhook 事件數", ["event_type", "message_type"])
+EVENTS_PROCESSED = registry.counter(
+    "scam_bot_events_processed_total", "處理完成的 webhook 事件數", ["message_type", "outcome"])
+IMAGE_BYTES = registry.histogram(
+    "scam_bot_image_bytes", "下載的圖片大小（bytes）", [], buckets=IMAGE_SIZE_BUCKETS)
+HTTP_IN_FLIGHT = registry.gauge(
+    "scam_bot_http_requests_in_flight", "處理中的 HTTP 請求數", ["endpoint"])
+EVENTS_IN_FLIGHT = registry.gauge(
+    "scam_bot_events_in_flight", "背景處理中的事件數")
+EVENTS_REDELIVERED = registry.counter(
+    "scam_bot_events_redelivered_total", "LINE 標記為重送（isRedelivery）的事件數")
+EVENTS_DEDUPLICATED = registry.counter(
+    "scam_bot_events_deduplicated_total", "已處理或處理中而略過的重複事件數", ["reason", "redelivery"])
+EVENTS_DEGRADED = registry.counter(
+    "scam_bot_events_degraded_total", "負載過高或超過頻率而只回覆固定訊息的圖片數", ["reason", "message_type"])
+EVENTS_DEFERRED = registry.counter(
+    "scam_bot_events_deferred_total", "負載過高而延後處理的事件數", ["message_type"])
+BATCH_SIZE = registry.histogram(
+    "scam_bot_batch_size", "微批次每批的項目數", ["batcher"], buckets=BATCH_SIZE_BUCKETS)
+BATCH_QUEUE_WAIT = registry.histogram(
+    "scam_bot_batch_queue_wait_seconds", "項目在微批次佇列中等待的時間（秒）", ["batcher"], buckets=QUEUE_WAIT_BUCKETS)
+REPLY_DISPATCH_SECONDS = registry.histogram(
+    "scam_bot_reply_dispatch_seconds", "回覆從排入佇列到送達或放棄的時間（秒）", ["method", "outcome"])
+REPLIES_DROPPED = registry.counter(
+    "scam_bot_replies_dropped_total", "無法送出而放棄的回覆數", ["reason"])
+REPLY_RETRIES = registry.counter(
+    "scam_bot_reply_retries_total", "回覆重試次數", ["method", "status"])
+REPLY_PUSH_FALLBACK = registry.counter(
+    "scam_bot_reply_push_fallback_total", "replyToken 無法使用而改用 push 的回覆數", ["reason"])
+ANALYSIS_REQUEST_BYTES = registry.histogram(
+    "scam_bot_analysis_request_bytes", "送到分析 API 的請求大小（bytes）", ["mode"], buckets=PAYLOAD_SIZE_BUCKETS)
+ANALYSIS_SESSION_RESYNCS = registry.counter(
+    "scam_bot_analysis_session_resyncs_total", "分析 API 要求重新同步 session 的次數")
+
+_multiprocess = None
+
+
+def configure_multiprocess(directory, flush_interval=5.0):
+    """設定共用目錄後，/metrics 會合併所有工作行程的數值"""
+    global _multiprocess
+    if not directory:
+        _multiprocess = None
+        return
+    _multiprocess = MultiProcessStore(registry, directory, flush_interval)
+    _multiprocess.start()
+    atexit.register(_multiprocess.flush)
+
+
+def observe_stage(stage, seconds, message_type="", outcome="success"):
+    STAGE_DURATION.observe(seconds, stage=stage, message_type=message_type, outcome=outcome)
+    # 這個請求有被抽樣分析時，一併記錄在它的階段耗時中
+    request_profiler.record_stage(stage, seconds)
+    if outcome == "error":
+        STAGE_ERRORS.inc(stage=stage, message_type=message_type)
+
+
+class timed_stage:
+    """以 with 區塊計時：with timed_stage("verify_signature") as t: ...；可設定 t.outcome"""
+
+    __slots__ = ("stage", "message_type", "outcome", "_started")
+
+    def __init__(self, stage, message_type=""):
+        self.stage = stage
+        self.message_type = message_type
+        self.outcome = "success"
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "error" if exc_type is not None else self.outcome
+        observe_stage(self.stage, time.perf_counter() - self._started, self.message_type, outcome)
+        return False
+
+
+def instrument(stage, message_type="", outcome=None):
+    """函式計時裝飾器；outcome(result) 可依回傳值判斷成功（"success"）或失敗（"error"）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result_outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                result_outcome = outcome(result) if outcome else "success"
+                return result
+            finally:
+                observe_stage(stage, time.perf_counter() - started, message_type, result_outcome)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    collected = _multiprocess.collect() if _multiprocess is not None else registry.collect()
+    return render_prometheus(collected)
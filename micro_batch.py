@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+
+# === 微批次：在短時間窗口內收集多個請求，一次送出 ===
+class MicroBatcher:
+    """收集 window 秒內（或滿 max_batch 筆）的項目後呼叫 process_batch(items)。
+
+    process_batch 需回傳與 items 等長的結果串列；某一筆結果若是 Exception，
+    只有該筆的 Future 會失敗。整批失敗時，所有 Future 都會收到該例外。
+
+    最多同時處理 max_concurrency 批（例如分析行程池的工作行程數）；全部都在處理中時，
+    新的項目繼續排隊，等有空位時一起組成下一批。
+    """
+
+    def __init__(self, process_batch, window=0.01, max_batch=50, name="micro-batch", max_concurrency=1):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max(1, int(max_batch))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.in_flight = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                if self.max_concurrency > 1:
+                    self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix=self.name)
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        self._start()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            # 先等到有空位再收集，處理中的批次越久，下一批收集到的項目越多
+            self._slots.acquire()
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            # 批次大小與等待時間用來調整 window / max_batch（吞吐量與延遲的取捨）
+            started = time.monotonic()
+            metrics.BATCH_SIZE.observe(len(batch), batcher=self.name)
+            for _, _, enqueued in batch:
+                metrics.BATCH_QUEUE_WAIT.observe(started - enqueued, batcher=self.name)
+            with self._lock:
+                self.in_flight += 1
+            if self._executor is None:
+                self._run(batch)
+            else:
+                self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            self._process(batch)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _process(self, batch):
+        items = [item for item, _, _ in batch]
+        try:
+            results = list(self.process_batch(items))
+            if len(results) != len(items):
+                raise RuntimeError(f"批次結果數量不符：送出 {len(items)} 筆，收到 {len(results)} 筆")
+        except Exception as e:
+            logging.error(f"[{self.name}] 批次處理失敗：{str(e)}")
+            logging.error(traceback.format_exc())
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "pending": self._queue.qsize(),
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
@@ -0,0 +1,113 @@
+import logging
+from collections.abc import Mapping
+
+from cache_utils import TTLCache, SingleFlight
+
+
+# === LINE 使用者資料快取 ===
+class ProfileCache:
+    """使用者資料快取：TTL + LRU，404 也會短暫快取，同一使用者同時間的查詢只送出一次。
+
+    fetcher(user_id) 需回傳 (HTTP 狀態碼, 使用者資料 dict)；發生錯誤時可回傳 (None, {})。
+    """
+
+    def __init__(self, fetcher, ttl=600.0, negative_ttl=60.0, max_entries=10000):
+        self.fetcher = fetcher
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.flight = SingleFlight()
+        self.fetches = 0
+        self.not_found = 0
+
+    def get(self, user_id):
+        profile = self.cache.get(user_id)
+        if profile is not None:
+            return profile
+        return self.flight.do(user_id, lambda: self._fetch(user_id))
+
+    def _fetch(self, user_id):
+        self.fetches += 1
+        return self._store(user_id, *self.fetcher(user_id))
+
+    def _store(self, user_id, status, profile):
+        if status == 200:
+            self.cache.set(user_id, profile)
+            return profile
+        if status == 404:
+            self.not_found += 1
+            self.cache.set(user_id, {}, ttl=self.negative_ttl)
+        # 其他錯誤不快取，下次再試
+        return {}
+
+    def invalidate(self, user_id):
+        self.cache.pop(user_id)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({
+            "fetches": self.fetches,
+            "not_found": self.not_found,
+            "coalesced": self.flight.coalesced,
+        })
+        return stats
+
+
+# === 延遲載入的使用者資料：第一次讀取欄位時才查詢 ===
+class LazyProfile(Mapping):
+    def __init__(self, user_id, loader):
+        self.user_id = user_id
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _load(self):
+        if self._data is None:
+            try:
+                self._data = self._loader(self.user_id) or {}
+            except Exception as e:
+                logging.error(f"載入使用者資料失敗：{str(e)}")
+                self._data = {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+# === 給模型 / API 使用的分析資料 ===
+class AnalysisData(Mapping):
+    """與原本 prepare_analysis_data 回傳的 dict 欄位相同，但使用者資料欄位只在讀取時才載入"""
+
+    PROFILE_FIELDS = {
+        "display_name": "displayName",
+        "picture_url": "pictureUrl",
+        "language": "language",
+    }
+    KEYS = ("user_id", "display_name", "picture_url", "language", "current_message", "chat_history")
+
+    def __init__(self, profile, user_id, current_message, chat_history):
+        self.profile = profile
+        self._fields = {
+            "user_id": user_id,
+            "current_message": current_message,
+            "chat_history": chat_history,
+        }
+
+    def __getitem__(self, key):
+        if key in self.PROFILE_FIELDS:
+            return self.profile.get(self.PROFILE_FIELDS[key], "")
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
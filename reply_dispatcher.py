@@ -0,0 +1,360 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+
+
+# 可重試的狀態碼（None 代表連線失敗或逾時；可能已送達的 reply 不重試）
+RETRY_STATUSES = frozenset([None, 429, 500, 502, 503, 504])
+
+
+# === 令牌桶：限制每秒送出的請求數 ===
+class TokenBucket:
+    """每秒補充 rate 個令牌，最多累積 burst 個。
+
+    reserve() 一定會預扣一個令牌並回傳需要等待的秒數（令牌不足時以「欠額」排隊），
+    同步與非同步呼叫端各自 sleep 即可，不需要輪詢。
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def try_acquire(self):
+        """有令牌時取走一個並回傳 True；不足時不預扣，回傳 False"""
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def penalize(self, seconds):
+        """被限流（429）時，接下來 seconds 秒內不再發出令牌"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill(self.clock())
+            return self._tokens
+
+
+class _ReplyJob:
+    __slots__ = ("reply_token", "to", "messages", "enqueued_at", "expires_at", "method", "attempts", "retry_key",
+                 "context")
+
+    def __init__(self, reply_token, to, messages, enqueued_at, expires_at):
+        self.reply_token = reply_token
+        self.to = to
+        self.messages = messages
+        self.enqueued_at = enqueued_at
+        self.expires_at = expires_at
+        self.method = "reply" if reply_token else "push"
+        self.attempts = 0
+        # push API 以 X-Line-Retry-Key 去除重複，重試時沿用同一個 key
+        self.retry_key = None
+        # 送出時沿用排入佇列時的 contextvars（例如請求的抽樣分析）
+        self.context = None
+
+
+# === 回覆佇列：限流、重試退避、replyToken 過期改用 push ===
+class _ReplyPolicy:
+    """同步與非同步回覆佇列共用的限流、重試與改用 push 的判斷。
+
+    send_reply(reply_token, messages) 與 send_push(to, messages, retry_key) 回傳
+    (狀態碼, 回應標頭, 回應內容)；連線失敗時拋出例外。
+    - 429、5xx 與連線失敗以指數退避重試（遵守 Retry-After），最多 max_attempts 次
+    - reply 在送出後才失敗（例如讀取逾時）時可能已經送達，不重試也不改用 push，避免使用者收到兩次；
+      request_not_sent(例外) 回傳 True 代表請求確定沒有送出，預設只有 ConnectionRefusedError
+    - replyToken 超過 reply_token_ttl 秒（從收到事件起算）或被 LINE 判定無效時，
+      push_fallback=True 就改用 push API 送給 to（使用者、群組或聊天室 ID）
+    """
+
+    def __init__(self, send_reply, send_push, rate=1000.0, burst=100, max_queue_size=10000,
+                 max_attempts=4, backoff_base=0.5, backoff_cap=8.0, max_retry_after=30.0,
+                 reply_token_ttl=50.0, push_fallback=True, request_not_sent=None, clock=time.monotonic,
+                 name="reply"):
+        self.send_reply = send_reply
+        self.send_push = send_push
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_queue_size = max_queue_size
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.reply_token_ttl = reply_token_ttl
+        self.push_fallback = push_fallback
+        self.request_not_sent = request_not_sent or (lambda error: isinstance(error, ConnectionRefusedError))
+        self.clock = clock
+        self.name = name
+
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.retries = 0
+        self.push_fallbacks = 0
+
+    def _new_job(self, reply_token, to, messages, received_at):
+        """received_at 為收到事件的時間（epoch 秒，LINE 事件的 timestamp / 1000）；佇列已滿時回傳 None"""
+        with self._lock:
+            if self.pending >= self.max_queue_size:
+                self.dropped += 1
+                metrics.REPLIES_DROPPED.inc(reason="queue_full")
+                logging.warning("回覆佇列已滿，丟棄回覆（%s）", to)
+                return None
+            self.pending += 1
+            self.submitted += 1
+        now = self.clock()
+        age = max(0.0, time.time() - received_at) if received_at else 0.0
+        return _ReplyJob(reply_token, to, messages, now, now + self.reply_token_ttl - age)
+
+    def _switch_to_push(self, job, reason):
+        """改用 push；沒有對象或未啟用時回傳 False"""
+        if not self.push_fallback or not job.to:
+            return False
+        job.method = "push"
+        job.attempts = 0
+        with self._lock:
+            self.push_fallbacks += 1
+        metrics.REPLY_PUSH_FALLBACK.inc(reason=reason)
+        logging.info("replyToken 無法使用（%s），改用 push 送出", reason)
+        return True
+
+    def _before_send(self, job):
+        """送出前檢查 replyToken 是否已過期；回傳 False 代表放棄這則回覆"""
+        if job.method == "reply" and self.clock() >= job.expires_at:
+            if not self._switch_to_push(job, "expired"):
+                self._finish(job, "dropped", "expired")
+                return False
+        if job.method == "push" and job.retry_key is None:
+            job.retry_key = str(uuid.uuid4())
+        return True
+
+    def _after_send(self, job, status, headers, text, error=None):
+        """依回應決定下一步：回傳 None 代表結束，否則為重試前要等待的秒數；error 為送出時拋出的例外"""
+        job.attempts += 1
+        if job.method == "reply" and error is not None and not self.request_not_sent(error):
+            # 可能已經送達：重試會因 replyToken 已使用而改用 push，使用者會收到兩次
+            logging.warning("回傳訊息送出後失敗，無法確認是否送達，不再重試（reply）：%s", error)
+            self._finish(job, "dropped", "unconfirmed")
+            return None
+        if status == 200 or (job.method == "push" and status == 409):
+            # 409：相同 retry key 的 push 先前已被接受
+            self._finish(job, "delivered")
+            return None
+        if job.method == "reply" and status == 400 and "reply token" in (text or "").lower():
+            # 過期或已使用過的 replyToken；可能送達的嘗試不會重試，先前的嘗試都確定沒有送達
+            if self._switch_to_push(job, "invalid_token"):
+                return 0.0
+            self._finish(job, "dropped", "invalid_token")
+            return None
+        if status not in RETRY_STATUSES:
+            logging.warning("回傳訊息失敗（%s），狀態碼：%s, 回傳內容：%s", job.method, status, text)
+            self._finish(job, "dropped", "rejected")
+            return None
+        if job.attempts >= self.max_attempts:
+            logging.warning("回傳訊息重試 %d 次仍失敗（%s），狀態碼：%s", job.attempts, job.method, status)
+            self._finish(job, "dropped", "retries_exhausted")
+            return None
+
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** (job.attempts - 1))))
+        retry_after = (headers or {}).get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_retry_after))
+        if status == 429:
+            # 整個頻道被限流，所有回覆一起暫停
+            self.bucket.penalize(delay)
+        with self._lock:
+            self.retries += 1
+        metrics.REPLY_RETRIES.inc(method=job.method, status=str(status or "error"))
+        return delay
+
+    def _finish(self, job, outcome, reason=None):
+        with self._lock:
+            self.pending -= 1
+            if outcome == "delivered":
+                self.delivered += 1
+            else:
+                self.dropped += 1
+        if reason:
+            metrics.REPLIES_DROPPED.inc(reason=reason)
+        metrics.REPLY_DISPATCH_SECONDS.observe(self.clock() - job.enqueued_at, method=job.method, outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "retries": self.retries,
+                "push_fallbacks": self.push_fallbacks,
+                "tokens": round(self.bucket.available, 1),
+            }
+
+
+class ReplyDispatcher(_ReplyPolicy):
+    """以工作執行緒送出回覆；等待重試的回覆放在依時間排序的 heap，不佔用執行緒"""
+
+    def __init__(self, send_reply, send_push, num_workers=4, **kwargs):
+        super().__init__(send_reply, send_push, **kwargs)
+        self.num_workers = max(1, int(num_workers))
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._workers = []
+        self._closed = False
+
+    def _start(self):
+        with self._cond:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, reply_token, to, messages, received_at=None):
+        """排入佇列；佇列已滿時回傳 False"""
+        job = self._new_job(reply_token, to, messages, received_at)
+        if job is None:
+            return False
+        job.context = contextvars.copy_context()
+        self._start()
+        self._schedule(job, 0.0)
+        return True
+
+    def _schedule(self, job, delay):
+        with self._cond:
+            heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    wait = self._heap[0][0] - self.clock()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)[2]
+                elif self._closed:
+                    return None
+                else:
+                    wait = None
+                self._cond.wait(wait)
+
+    def _loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._attempt(job)
+            except Exception:
+                logging.error(f"[{self.name}] 送出回覆時發生錯誤")
+                logging.error(traceback.format_exc())
+                self._finish(job, "dropped", "error")
+
+    def _attempt(self, job):
+        if not self._before_send(job):
+            return
+        wait = self.bucket.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        error = None
+        try:
+            if job.method == "reply":
+                status, headers, text = job.context.run(self.send_reply, job.reply_token, job.messages)
+            else:
+                status, headers, text = job.context.run(self.send_push, job.to, job.messages, job.retry_key)
+        except Exception as e:
+            logging.warning(f"回傳訊息連線失敗（{job.method}）：{str(e)}")
+            status, headers, text, error = None, None, None, e
+        delay = self._after_send(job, status, headers, text, error)
+        if delay is not None:
+            self._schedule(job, delay)
+
+    def close(self, timeout=None):
+        """等待佇列中的回覆送完後停止工作執行緒"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+
+class AsyncReplyDispatcher(_ReplyPolicy):
+    """非同步版本：每則回覆是一個 asyncio task，send_reply / send_push 為 coroutine function"""
+
+    def __init__(self, send_reply, send_push, **kwargs):
+        super().__init__(send_reply, send_push, **kwargs)
+        self._tasks = set()
+
+    def submit(self, reply_token, to, messages, received_at=None):
+        """需在 event loop 中呼叫；佇列已滿時回傳 False"""
+        import asyncio
+        job = self._new_job(reply_token, to, messages, received_at)
+        if job is None:
+            return False
+        task = asyncio.ensure_future(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, job):
+        import asyncio
+        try:
+            while self._before_send(job):
+                wait = self.bucket.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                error = None
+                try:
+                    if job.method == "reply":
+                        status, headers, text = await self.send_reply(job.reply_token, job.messages)
+                    else:
+                        status, headers, text = await self.send_push(job.to, job.messages, job.retry_key)
+                except Exception as e:
+                    logging.warning(f"回傳訊息連線失敗（{job.method}）：{str(e)}")
+                    status, headers, text, error = None, None, None, e
+                delay = self._after_send(job, status, headers, text, error)
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+        except Exception:
+            logging.error(f"[{self.name}] 送出回覆時發生錯誤")
+            logging.error(traceback.format_exc())
+            self._finish(job, "dropped", "error")
+
+    async def join(self, timeout=None):
+        """等待目前所有回覆送完"""
+        import asyncio
+        while self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                break
@@ -0,0 +1,286 @@
+import contextvars
+import heapq
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+
+# 目前執行中的工作屬於哪一個請求的分析（沒有抽樣時為 None）
+_current = contextvars.ContextVar("request_profile", default=None)
+
+
+def record_stage(stage, seconds):
+    """metrics.observe_stage 呼叫：目前的請求有被抽樣時記下這個階段的耗時"""
+    profile = _current.get()
+    if profile is not None:
+        profile.add_stage(stage, seconds)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, max_depth=64):
+    """由外到內以 ; 連接的呼叫堆疊（flamegraph.pl / speedscope 的 collapsed 格式），最多保留最內層 max_depth 層"""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+# === 單一請求的分析結果 ===
+class RequestProfile:
+    """一個被抽樣的請求：各階段耗時與呼叫堆疊的抽樣次數。
+
+    /callback 的事件在背景處理，請求本身與每組事件各持有一次（hold / release），
+    全部結束時才算完成；回覆佇列較晚送出的 reply 階段仍會附加到已完成的紀錄上。
+    """
+
+    MAX_STAGES = 1000
+
+    def __init__(self, endpoint, forced=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.forced = forced
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.samples = 0
+        self.stacks = Counter()
+        self.stages = []  # [(階段, 開始時間（相對請求開始，秒）, 耗時, 執行緒名稱)]
+        self._pending = 1
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        offset = time.perf_counter() - self._started - seconds
+        with self._lock:
+            if len(self.stages) < self.MAX_STAGES:
+                self.stages.append((stage, offset, seconds, threading.current_thread().name))
+
+    def add_sample(self, stack):
+        with self._lock:
+            self.samples += 1
+            self.stacks[stack] += 1
+
+    def summary(self):
+        with self._lock:
+            totals = {}
+            for stage, _, seconds, _ in self.stages:
+                entry = totals.setdefault(stage, {"count": 0, "total_ms": 0.0})
+                entry["count"] += 1
+                entry["total_ms"] += seconds * 1000
+            return {
+                "id": self.id,
+                "endpoint": self.endpoint,
+                "forced": self.forced,
+                "started_at": self.started_at,
+                "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+                "samples": self.samples,
+                "stages": {stage: {"count": e["count"], "total_ms": round(e["total_ms"], 2)}
+                           for stage, e in totals.items()},
+            }
+
+    def detail(self, top=20):
+        result = self.summary()
+        with self._lock:
+            result["timeline"] = [
+                {"stage": stage, "start_ms": round(offset * 1000, 2), "duration_ms": round(seconds * 1000, 2),
+                 "thread": thread}
+                for stage, offset, seconds, thread in self.stages
+            ]
+            result["top_stacks"] = [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(top)]
+        return result
+
+    def collapsed(self):
+        with self._lock:
+            return dict(self.stacks)
+
+
+# === 抽樣分析器 ===
+class RequestProfiler:
+    """依 sample_rate 比例或帶有 secret 的請求標頭啟用分析；被分析的請求執行期間，
+    背景執行緒每 interval 秒以 sys._current_frames() 讀取相關執行緒的呼叫堆疊（不使用 sys.setprofile，
+    沒有被分析的請求不受影響）。保留耗時最長的 max_profiles 筆。
+
+    sample_rate=0 且沒有設定 secret 時完全停用，begin() 一律回傳 None。
+    """
+
+    def __init__(self, sample_rate=0.0, secret="", interval=0.005, max_profiles=20, max_depth=64):
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.interval = interval
+        self.max_profiles = max(1, int(max_profiles))
+        self.max_depth = max_depth
+        self._threads = {}  # 執行緒 ID -> RequestProfile
+        self._slowest = []  # heap：(耗時, 序號, RequestProfile)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+        self.started = 0
+        self.completed = 0
+        self.sampler_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.secret)
+
+    def authorized(self, token):
+        if not self.secret or not token:
+            return False
+        # 標頭可能含非 ASCII 字元，compare_digest 只接受 ASCII 字串，先轉成 bytes 再比較
+        return hmac.compare_digest(token.encode("utf-8", "surrogateescape"), self.secret.encode("utf-8"))
+
+    def begin(self, endpoint, token=None):
+        """決定這個請求是否要分析；要分析時回傳 RequestProfile（請求結束時呼叫 release）"""
+        if not self.enabled:
+            return None
+        forced = self.authorized(token)
+        if not forced and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        with self._lock:
+            self.started += 1
+        return RequestProfile(endpoint, forced)
+
+    def current(self):
+        return _current.get()
+
+    def hold(self, profile):
+        if profile is not None:
+            with profile._lock:
+                profile._pending += 1
+
+    def release(self, profile):
+        if profile is None:
+            return
+        with profile._lock:
+            profile._pending -= 1
+            if profile._pending > 0:
+                return
+            profile.duration = time.perf_counter() - profile._started
+        with self._lock:
+            self.completed += 1
+            heapq.heappush(self._slowest, (profile.duration, next(self._seq), profile))
+            if len(self._slowest) > self.max_profiles:
+                heapq.heappop(self._slowest)
+
+    # 設定目前的分析對象；sample=True 時同時抽樣目前執行緒的呼叫堆疊（asyncio 的事件迴圈由多個請求共用，不抽樣）
+    def activate(self, profile, sample=True):
+        previous = _current.get()
+        _current.set(profile)
+        if profile is None or not sample:
+            return previous, None, None
+        ident = threading.get_ident()
+        with self._lock:
+            previous_thread = self._threads.get(ident)
+            self._threads[ident] = profile
+        self._ensure_sampler()
+        return previous, ident, previous_thread
+
+    def deactivate(self, handle):
+        previous, ident, previous_thread = handle
+        _current.set(previous)
+        if ident is None:
+            return
+        with self._lock:
+            if previous_thread is None:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] = previous_thread
+
+    @contextmanager
+    def attach(self, profile, sample=True):
+        handle = self.activate(profile, sample)
+        try:
+            yield profile
+        finally:
+            self.deactivate(handle)
+
+    def call(self, func, *args):
+        """在其他執行緒（asyncio.to_thread）執行 func，並抽樣目前請求在這個執行緒的呼叫堆疊"""
+        profile = self.current()
+        if profile is None:
+            return func(*args)
+        with self.attach(profile):
+            return func(*args)
+
+    def _ensure_sampler(self):
+        self._wakeup.set()
+        if self._sampler is not None and self._sampler.is_alive():
+            return
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(target=self._loop, name="request-profiler", daemon=True)
+            self._sampler.start()
+
+    def _loop(self):
+        own = threading.get_ident()
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                active = dict(self._threads)
+            if not active:
+                # 沒有被分析的請求時不佔用 CPU
+                self._wakeup.wait()
+                continue
+            try:
+                started = time.perf_counter()
+                frames = sys._current_frames()
+                for ident, profile in active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        profile.add_sample(collapse_stack(frame, self.max_depth))
+                del frames
+                self.sampler_seconds += time.perf_counter() - started
+            except Exception as e:
+                logging.warning(f"讀取呼叫堆疊失敗：{str(e)}")
+            time.sleep(self.interval)
+
+    def profiles(self):
+        """由慢到快"""
+        with self._lock:
+            ordered = sorted(self._slowest, reverse=True)
+        return [profile for _, _, profile in ordered]
+
+    def find(self, profile_id):
+        for profile in self.profiles():
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def collapsed(self, profile_id=None):
+        """flamegraph 相容的 collapsed stacks（每行「堆疊 次數」）；沒有指定時合併所有保留的紀錄"""
+        if profile_id is not None:
+            profile = self.find(profile_id)
+            selected = [profile] if profile is not None else []
+        else:
+            selected = self.profiles()
+        merged = Counter()
+        for profile in selected:
+            merged.update(profile.collapsed())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(merged.items()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval": self.interval,
+                "active_threads": len(self._threads),
+                "started": self.started,
+                "completed": self.completed,
+                "kept": len(self._slowest),
+                "sampler_ms": round(self.sampler_seconds * 1000, 1),
+            }
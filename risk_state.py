@@ -0,0 +1,259 @@
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# === 對話階段 ===
+# 詐騙通常依序經過：建立信任 → 投資邀約 → 要求轉帳，越後面的階段風險越高
+DEFAULT_STAGES = {"trust": 1, "investment": 2, "money_transfer": 3}
+STAGE_NAMES = {0: "", 1: "建立信任", 2: "投資邀約", 3: "要求轉帳"}
+STAGE_BONUS = (0.0, 0.0, 0.5, 1.0)
+
+# 各類別累計分數低於此值時視為對話已冷卻，階段歸零
+COLD_SCORE = 0.05
+
+RiskAssessment = namedtuple("RiskAssessment", ["score", "stage", "categories", "messages", "contact_seconds"])
+
+
+# === 緊湊的狀態格式 ===
+# 每位使用者只有一個 bytes 物件：
+#   [第一次聯絡時間:I][最後更新時間:I][訊息數:H][階段:B] + 各類別的衰減分數（float32，依類別編號排列）
+# 類別編號由整個 store 共用，使用者的分數陣列可以比類別數短（後面視為 0）
+_HEADER = struct.Struct("<IIHB")
+_SCORE = struct.Struct("<f")
+USER_OVERHEAD = 200
+MAX_CATEGORIES = 64
+MAX_MESSAGES = 0xFFFF
+
+_FILE_MAGIC = b"RSK1"
+_LENGTH = struct.Struct("<I")
+_RECORD_HEAD = struct.Struct("<HH")
+
+
+def _unpack(buf):
+    first, last, messages, stage = _HEADER.unpack_from(buf, 0)
+    count = (len(buf) - _HEADER.size) // _SCORE.size
+    scores = list(struct.unpack_from(f"<{count}f", buf, _HEADER.size))
+    return first, last, messages, stage, scores
+
+
+def _pack(first, last, messages, stage, scores):
+    return _HEADER.pack(first, last, messages, stage) + struct.pack(f"<{len(scores)}f", *scores)
+
+
+# === 每位使用者的對話風險狀態 ===
+class RiskStateStore:
+    """每則訊息以 O(類別數) 更新：舊分數依經過時間指數衰減（半衰期 half_life 秒）後加上本則的關鍵字權重，
+    不需要重新掃描聊天紀錄。最多保留 max_users 位使用者，閒置超過 idle_ttl 秒的使用者會被移除。"""
+
+    def __init__(self, half_life=24 * 3600, new_contact_window=7 * 24 * 3600, known_contact_factor=0.5,
+                 max_users=1_000_000, idle_ttl=30 * 24 * 3600, stages=None, clock=time.time):
+        self.half_life = float(half_life)
+        self.new_contact_window = new_contact_window
+        self.known_contact_factor = known_contact_factor
+        self.max_users = max(1, int(max_users))
+        self.idle_ttl = idle_ttl
+        self.stages = dict(DEFAULT_STAGES if stages is None else stages)
+        self.clock = clock
+        self._categories = {}
+        self._users = OrderedDict()  # 依最後更新時間排序，最舊的在前
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.evicted_users = 0
+        self.expired_users = 0
+
+    def _category_index(self, category):
+        index = self._categories.get(category)
+        if index is None:
+            if len(self._categories) >= MAX_CATEGORIES:
+                return None
+            index = self._categories[category] = len(self._categories)
+        return index
+
+    def _decay(self, scores, elapsed):
+        if elapsed <= 0 or not self.half_life:
+            return scores
+        factor = 0.5 ** (elapsed / self.half_life)
+        return [score * factor for score in scores]
+
+    def _assess(self, first, messages, stage, scores, now):
+        contact_seconds = max(0, now - first)
+        factor = 1.0 if contact_seconds <= self.new_contact_window else self.known_contact_factor
+        raw = sum(scores) * factor + STAGE_BONUS[stage]
+        names = list(self._categories)
+        categories = {names[i]: round(score, 4) for i, score in enumerate(scores) if score > 0}
+        return RiskAssessment(1.0 - math.exp(-raw), stage, categories, messages, contact_seconds)
+
+    def update(self, user_id, matches, timestamp=None):
+        """matches 為本則訊息命中的 (類別, 權重)；回傳更新後的 RiskAssessment"""
+        now = int(self.clock() if timestamp is None else timestamp)
+        with self._lock:
+            buf = self._users.get(user_id)
+            if buf is None:
+                user_id = sys.intern(user_id)
+                first, last, messages, stage, scores = now, now, 0, 0, []
+                self.nbytes += USER_OVERHEAD
+            else:
+                self._users.move_to_end(user_id)
+                first, last, messages, stage, scores = _unpack(buf)
+                scores = self._decay(scores, now - last)
+                if sum(scores) < COLD_SCORE:
+                    stage = 0
+
+            for category, weight in matches:
+                index = self._category_index(category)
+                if index is None:
+                    continue
+                if index >= len(scores):
+                    scores.extend([0.0] * (index + 1 - len(scores)))
+                scores[index] += weight
+                stage = max(stage, self.stages.get(category, 0))
+
+            messages = min(MAX_MESSAGES, messages + 1)
+            new_buf = _pack(first, max(now, last), messages, stage, scores)
+            self._users[user_id] = new_buf
+            self.nbytes += len(new_buf) - (len(buf) if buf is not None else 0)
+            self._expire_idle(now)
+            while len(self._users) > self.max_users:
+                self._remove_oldest()
+                self.evicted_users += 1
+            return self._assess(first, messages, stage, scores, now)
+
+    def get(self, user_id, now=None):
+        """以目前時間衰減後的風險，不修改狀態；沒有紀錄時回傳 None"""
+        now = int(self.clock() if now is None else now)
+        with self._lock:
+            buf = self._users.get(user_id)
+            if buf is None:
+                return None
+            first, last, messages, stage, scores = _unpack(buf)
+            scores = self._decay(scores, now - last)
+            if sum(scores) < COLD_SCORE:
+                stage = 0
+            return self._assess(first, messages, stage, scores, now)
+
+    def _remove_oldest(self):
+        _, buf = self._users.popitem(last=False)
+        self.nbytes -= USER_OVERHEAD + len(buf)
+
+    def _expire_idle(self, now):
+        if not self.idle_ttl:
+            return
+        cutoff = now - self.idle_ttl
+        while self._users:
+            oldest = next(iter(self._users.values()))
+            if _HEADER.unpack_from(oldest, 0)[1] >= cutoff:
+                break
+            self._remove_oldest()
+            self.expired_users += 1
+
+    def remove(self, user_id):
+        with self._lock:
+            buf = self._users.pop(user_id, None)
+            if buf is not None:
+                self.nbytes -= USER_OVERHEAD + len(buf)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    # === 存檔與載入（重新啟動後延續狀態） ===
+    # 格式：[RSK1][類別 JSON 長度:I][類別 JSON] + 多筆 [使用者 ID 長度:H][狀態長度:H][使用者 ID][狀態]
+    def save(self, path):
+        with self._lock:
+            header = json.dumps(list(self._categories), ensure_ascii=False).encode("utf-8")
+            parts = [_FILE_MAGIC, _LENGTH.pack(len(header)), header]
+            for user_id, buf in self._users.items():
+                key = user_id.encode("utf-8")
+                parts.append(_RECORD_HEAD.pack(len(key), len(buf)))
+                parts.append(key)
+                parts.append(buf)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"".join(parts))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _read(path):
+        """回傳 (類別名稱串列, [(使用者 ID, 狀態), ...])"""
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(_FILE_MAGIC)] != _FILE_MAGIC:
+            raise ValueError(f"不是風險狀態存檔：{path}")
+        offset = len(_FILE_MAGIC)
+        (size,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        categories = json.loads(data[offset:offset + size].decode("utf-8"))
+        offset += size
+
+        records = []
+        while offset < len(data):
+            key_size, buf_size = _RECORD_HEAD.unpack_from(data, offset)
+            offset += _RECORD_HEAD.size
+            user_id = sys.intern(data[offset:offset + key_size].decode("utf-8"))
+            offset += key_size
+            records.append((user_id, data[offset:offset + buf_size]))
+            offset += buf_size
+        return categories, records
+
+    def load(self, path):
+        """載入存檔並取代目前的狀態；回傳載入的使用者數"""
+        categories, records = self._read(path)
+        users = OrderedDict(records)
+        nbytes = sum(USER_OVERHEAD + len(buf) for buf in users.values())
+        with self._lock:
+            self._categories = {name: index for index, name in enumerate(categories)}
+            self._users = users
+            self.nbytes = nbytes
+        return len(users)
+
+    def merge(self, path):
+        """把存檔併入目前的狀態（例如多個工作行程各自的存檔）：同一位使用者保留最後更新時間較新的紀錄；
+        回傳採用存檔內容的使用者數"""
+        categories, records = self._read(path)
+        merged = 0
+        with self._lock:
+            indexes = [self._category_index(name) for name in categories]
+            for user_id, buf in records:
+                first, last, messages, stage, scores = _unpack(buf)
+                current = self._users.get(user_id)
+                if current is not None and _HEADER.unpack_from(current, 0)[1] >= last:
+                    continue
+                # 存檔的類別編號換成這個 store 的編號
+                remapped = [0.0] * max((i + 1 for i in indexes[:len(scores)] if i is not None), default=0)
+                for index, score in zip(indexes, scores):
+                    if index is not None:
+                        remapped[index] = score
+                new_buf = _pack(first, last, messages, stage, remapped)
+                self._users[user_id] = new_buf
+                self.nbytes += len(new_buf) - (len(current) if current is not None else -USER_OVERHEAD)
+                merged += 1
+            # 維持依最後更新時間排序，閒置移除與容量淘汰才會從最舊的開始
+            self._users = OrderedDict(sorted(self._users.items(), key=lambda item: _HEADER.unpack_from(item[1], 0)[1]))
+            while len(self._users) > self.max_users:
+                self._remove_oldest()
+                self.evicted_users += 1
+        return merged
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "estimated_bytes": self.nbytes,
+            "max_users": self.max_users,
+            "categories": list(self._categories),
+            "evicted_users": self.evicted_users,
+            "expired_users": self.expired_users,
+        }
@@ -0,0 +1,50 @@
+import unittest
+from admission import AdmissionController, ACCEPT, DEGRADE
+from tests.helpers import FakeClock
+
+class TestAdmissionController(unittest.TestCase):
+    def test_user_rate_limit(self):
+        """測試單一使用者超過頻率上限時圖片降級、文字照常處理，不影響其他使用者"""
+        clock = FakeClock()
+        admission = AdmissionController(user_rate=1, user_burst=3, clock=clock)
+        decisions = [admission.admit("U1")[0] for _ in range(5)]
+        self.assertEqual(decisions, [ACCEPT] * 5)
+        self.assertEqual(admission.admit("U1", heavy=True), (DEGRADE, "user_rate"))
+        self.assertEqual(admission.admit("U2", heavy=True), (ACCEPT, None))
+        clock.now += 1
+        self.assertEqual(admission.admit("U1", heavy=True), (ACCEPT, None))
+        self.assertEqual(admission.stats()["degraded"], 1)
+
+    def test_heavy_work_degraded_when_overloaded(self):
+        """測試處理中的事件過多時圖片降級，文字照常處理"""
+        admission = AdmissionController(max_in_flight=3, max_user_in_flight=0, user_rate=0)
+        admission.enter("U1", 3)
+        self.assertEqual(admission.admit("U2", heavy=True), (DEGRADE, "in_flight"))
+        self.assertEqual(admission.admit("U2", heavy=False), (ACCEPT, None))
+        admission.leave("U1", 1)
+        self.assertEqual(admission.admit("U2", heavy=True), (ACCEPT, None))
+
+    def test_per_user_concurrency(self):
+        """測試同一位使用者處理中的事件過多時，只降級這位使用者的圖片"""
+        admission = AdmissionController(max_in_flight=100, max_user_in_flight=2, user_rate=0)
+        admission.enter("U1", 2)
+        self.assertEqual(admission.admit("U1", heavy=True), (DEGRADE, "user_concurrency"))
+        self.assertEqual(admission.admit("U2", heavy=True), (ACCEPT, None))
+        admission.leave("U1", 2)
+        self.assertEqual(admission.stats()["busy_users"], 0)
+        self.assertEqual(admission.admit("U1", heavy=True), (ACCEPT, None))
+
+    def test_deferred_per_user(self):
+        """測試延後的事件依使用者計數，處理完後不再延後這位使用者的事件"""
+        admission = AdmissionController(user_rate=0)
+        admission.defer("U1", 2)
+        self.assertTrue(admission.has_deferred("U1"))
+        self.assertFalse(admission.has_deferred("U2"))
+        admission.undefer("U1", 1)
+        self.assertTrue(admission.has_deferred("U1"))
+        admission.undefer("U1", 1)
+        self.assertFalse(admission.has_deferred("U1"))
+        self.assertEqual(admission.stats()["deferred"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
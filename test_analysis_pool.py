@@ -0,0 +1,124 @@
+import unittest
+import io
+import os
+import time
+from analyzers import Analyzer, BatchImageAnalyzer, DefaultAnalyzer, np, Image
+from analysis_pool import AnalysisPool, InlineAnalysis, AnalysisError, AnalysisTimeout
+
+# 工作行程以「模組:類別」載入分析器，因此測試用的分析器放在模組層級
+class EchoAnalyzer(Analyzer):
+    name = "echo"
+
+    def load(self):
+        self.loaded_at = time.time()
+        self.pid = os.getpid()
+
+    def analyze_text(self, text):
+        if text == "crash":
+            os._exit(1)
+        if text == "sleep":
+            time.sleep(5)
+        if text == "error":
+            raise ValueError("壞掉了")
+        return {"text": text, "pid": self.pid, "loaded_at": self.loaded_at}
+
+    def analyze_image(self, data):
+        if bytes(data[:4]) == b"BAD!":
+            raise ValueError("不是圖片")
+        return {"size": data.nbytes, "head": bytes(data[:4]), "sum": sum(data[-16:])}
+
+class MeanColorAnalyzer(BatchImageAnalyzer):
+    input_size = (8, 4)
+
+    def load(self):
+        super().load()
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        self.batch_sizes.append(len(batch))
+        return [{"shape": item.shape, "red": int(item[..., 0].mean())} for item in batch]
+
+class TestAnalysisPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = AnalysisPool("test_analysis_pool:EchoAnalyzer", processes=1, timeout=1.0)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_model_loaded_once_per_worker(self):
+        """測試工作行程只載入一次模型，多個工作使用同一個行程"""
+        first = self.pool.analyze_text("a")
+        second = self.pool.analyze_text("b")
+        self.assertNotEqual(first["pid"], os.getpid())
+        self.assertEqual(first["pid"], second["pid"])
+        self.assertEqual(first["loaded_at"], second["loaded_at"])
+        self.assertEqual(self.pool.version, EchoAnalyzer.version)
+
+    def test_image_through_shared_memory(self):
+        """測試圖片內容經由共享記憶體傳遞，大小超過區塊時自動換更大的區塊"""
+        small = b"\xff\xd8\xff\xe0" + bytes(100)
+        self.assertEqual(self.pool.analyze_image(memoryview(small)), {"size": 104, "head": small[:4], "sum": 0})
+        big = b"\x89PNG" + bytes(2 * 1024 * 1024) + b"\x01" * 16
+        result = self.pool.analyze_image(big)
+        self.assertEqual(result, {"size": len(big), "head": b"\x89PNG", "sum": 16})
+
+    def test_image_batch(self):
+        """測試整批圖片放進同一塊共享記憶體，單張失敗只影響該張"""
+        images = [b"JPEG" + bytes(20), memoryview(b"BAD!"), b"PNG!" + b"\x02" * 20]
+        results = self.pool.analyze_image_batch(images)
+        self.assertEqual(results[0], {"size": 24, "head": b"JPEG", "sum": 0})
+        self.assertIsInstance(results[1], AnalysisError)
+        self.assertEqual(results[2]["sum"], 32)
+
+    def test_crashed_worker_restarts(self):
+        """測試工作行程當掉時該工作失敗，之後的工作由重新啟動的行程處理"""
+        pid = self.pool.analyze_text("a")["pid"]
+        with self.assertRaises(AnalysisError):
+            self.pool.analyze_text("crash")
+        self.assertNotEqual(self.pool.analyze_text("b")["pid"], pid)
+        self.assertEqual(self.pool.stats()["restarts"], 1)
+
+    def test_timeout_kills_worker(self):
+        """測試工作超過時間上限時拋出 AnalysisTimeout 並重新啟動行程"""
+        with self.assertRaises(AnalysisTimeout):
+            self.pool.analyze_text("sleep")
+        self.assertEqual(self.pool.analyze_text("ok")["text"], "ok")
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+
+    def test_analyzer_error(self):
+        """測試分析器的例外以 AnalysisError 回傳，工作行程繼續使用"""
+        pid = self.pool.analyze_text("a")["pid"]
+        with self.assertRaisesRegex(AnalysisError, "壞掉了"):
+            self.pool.analyze_text("error")
+        self.assertEqual(self.pool.analyze_text("b")["pid"], pid)
+
+class TestInlineAnalysis(unittest.TestCase):
+    def test_default_analyzer(self):
+        """測試預設分析器在目前的執行緒比對關鍵字與分析圖片"""
+        analysis = InlineAnalysis(DefaultAnalyzer())
+        self.assertEqual(analysis.analyze_text("錢怎麼轉")["label"], "scam")
+        self.assertEqual(analysis.analyze_text("你好")["label"], "safe")
+        self.assertEqual(analysis.analyze_image(memoryview(bytes(1000)))["details"]["image_size"], 1000)
+
+@unittest.skipUnless(np is not None and Image is not None, "需要 numpy 與 Pillow")
+class TestBatchImageAnalyzer(unittest.TestCase):
+    def test_decode_resize_into_one_array(self):
+        """測試圖片解碼並縮放成同一個陣列後一次推論，無法解碼的圖片不放進批次"""
+        def encode(color, size, fmt):
+            buffer = io.BytesIO()
+            Image.new("RGB", size, color).save(buffer, fmt)
+            return buffer.getvalue()
+
+        analyzer = MeanColorAnalyzer()
+        analyzer.load()
+        images = [encode((200, 0, 0), (64, 48), "JPEG"), b"not an image", memoryview(encode((10, 0, 0), (5, 5), "PNG"))]
+        results = analyzer.analyze_image_batch(images)
+        self.assertEqual(analyzer.batch_sizes, [2])
+        self.assertEqual(results[0]["shape"], (4, 8, 3))
+        self.assertAlmostEqual(results[0]["red"], 200, delta=5)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2]["red"], 10)
+
+if __name__ == '__main__':
+    unittest.main()
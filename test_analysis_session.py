@@ -0,0 +1,75 @@
+import unittest
+from analysis_session import AnalysisSessionStore, AnalysisSessionClient, SessionResync
+from tests.helpers import FakeClock
+
+class TestAnalysisSessionStore(unittest.TestCase):
+    def test_rolling_context(self):
+        """測試 API 端累積上下文，並依則數與大小保留最近的訊息"""
+        store = AnalysisSessionStore(max_messages=3, max_bytes=1000)
+        self.assertEqual(store.apply("s1", 0, ["a", "b"]), (2, ["a", "b"]))
+        self.assertEqual(store.apply("s1", 2, ["c", "d"]), (4, ["b", "c", "d"]))
+        small = AnalysisSessionStore(max_messages=10, max_bytes=6)
+        small.apply("s1", 0, ["aaa", "bbb"])
+        self.assertEqual(small.apply("s1", 2, ["ccc"]), (3, ["bbb", "ccc"]))
+
+    def test_resent_messages_not_duplicated(self):
+        """測試回應遺失而重送時，已收到的訊息不會重複加入"""
+        store = AnalysisSessionStore()
+        store.apply("s1", 0, ["a", "b"])
+        self.assertEqual(store.apply("s1", 1, ["b", "c"]), (3, ["a", "b", "c"]))
+        self.assertEqual(store.stats()["duplicates"], 1)
+
+    def test_divergence_requires_resync(self):
+        """測試序號對不上或 session 過期時要求重新同步"""
+        clock = FakeClock()
+        store = AnalysisSessionStore(ttl=60, clock=clock)
+        store.apply("s1", 0, ["a"])
+        with self.assertRaises(SessionResync) as ctx:
+            store.apply("s1", 3, ["d"])
+        self.assertEqual(ctx.exception.expected_seq, 1)
+        clock.now += 120
+        with self.assertRaises(SessionResync) as ctx:
+            store.apply("s1", 1, ["b"])
+        self.assertEqual(ctx.exception.expected_seq, 0)
+        self.assertEqual(store.apply("s1", 0, ["a", "b"], reset=True), (2, ["a", "b"]))
+        self.assertEqual(store.stats()["resyncs"], 2)
+
+class TestAnalysisSessionClient(unittest.TestCase):
+    def test_sends_only_unacknowledged_messages(self):
+        """測試第一次以完整上下文建立 session，之後只送出尚未確認的訊息"""
+        client = AnalysisSessionClient()
+        store = AnalysisSessionStore()
+        payload = {"user_id": "U1", "current_message": "a", "chat_history": ["舊訊息", "a"]}
+
+        def send(body):
+            session = body["session"]
+            seq, context = store.apply(session["id"], session["seq"], session["messages"], session.get("reset", False))
+            client.ack("U1", body, {"id": session["id"], "seq": seq})
+            return context
+
+        client.record("U1", "a")
+        body = client.build("U1", payload, payload["chat_history"])
+        self.assertNotIn("chat_history", body)
+        self.assertTrue(body["session"]["reset"])
+        send(body)
+
+        client.record("U1", "b")
+        client.record("U1", "c")
+        body = client.build("U1", dict(payload, current_message="c"), ["舊訊息", "a", "b", "c"])
+        self.assertEqual(body["session"]["seq"], 2)
+        self.assertEqual(body["session"]["messages"], ["b", "c"])
+        self.assertEqual(send(body), ["舊訊息", "a", "b", "c"])
+
+        # API 端重新啟動後要求重新同步
+        store = AnalysisSessionStore()
+        client.record("U1", "d")
+        body = client.build("U1", dict(payload, current_message="d"), ["b", "c", "d"])
+        with self.assertRaises(SessionResync):
+            send(body)
+        body = client.resync("U1", payload, ["b", "c", "d"])
+        self.assertEqual(send(body), ["b", "c", "d"])
+        client.record("U1", "e")
+        self.assertEqual(client.build("U1", payload, [])["session"]["messages"], ["e"])
+
+if __name__ == "__main__":
+    unittest.main()
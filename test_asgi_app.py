@@ -0,0 +1,106 @@
+import unittest
+import json
+from unittest import mock
+from http_client import aiohttp
+from app import create_app
+
+if aiohttp is not None:
+    import asgi_app
+
+async def call(method, path, body=b"", headers=()):
+    """直接呼叫 ASGI 進入點，回傳 (狀態碼, 標頭, 內容)"""
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode("latin-1"),
+             "headers": [(b"content-type", b"application/json")] + list(headers)}
+    received = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        received.append(message)
+
+    await asgi_app.app(scope, receive, send)
+    headers = dict(received[0]["headers"])
+    return received[0]["status"], headers, received[1]["body"]
+
+@unittest.skipUnless(aiohttp, "需要安裝 aiohttp")
+class TestAsgiApp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flask = create_app({"TESTING": True}).test_client()
+
+    async def test_index_and_callback_get(self):
+        """測試首頁與 /callback GET 回應與 Flask 版本相同"""
+        status, headers, body = await call("GET", "/")
+        self.assertEqual(body, self.flask.get("/").data)
+        self.assertEqual(headers[b"access-control-allow-origin"], b"*")
+        status, _, body = await call("GET", "/callback")
+        self.assertEqual((status, body), (200, b"OK"))
+
+    async def test_analyze_matches_flask(self):
+        """測試 /api/analyze 的回應格式與 Flask 版本相同"""
+        payload = json.dumps({"message_type": "text", "current_message": "錢怎麼轉"})
+        status, _, body = await call("POST", "/api/analyze", payload.encode("utf-8"))
+        expected = self.flask.post("/api/analyze", data=payload, content_type="application/json")
+        self.assertEqual(status, 200)
+        result, expected_result = json.loads(body), expected.get_json()
+        for data in (result, expected_result):
+            data["data"].pop("timestamp")
+            data["data"]["analysis"]["details"].pop("analysis_time")
+        self.assertEqual(result, expected_result)
+
+        status, _, _ = await call("POST", "/api/analyze", b"{}")
+        self.assertEqual(status, 400)
+
+    async def test_callback_processes_events_as_tasks(self):
+        """測試 webhook 事件以 asyncio task 處理，同一個 replyToken 只回覆一次"""
+        events = [
+            {"type": "message", "replyToken": "t1", "source": {"userId": "U1"},
+             "message": {"type": "text", "text": text}}
+            for text in ("你好", "錢怎麼轉")
+        ]
+        with mock.patch("asgi_app.reply_to_user", new=mock.AsyncMock(return_value=True)) as reply:
+            status, _, body = await call("POST", "/callback", json.dumps({"events": events}).encode("utf-8"))
+            self.assertEqual(body, b"OK")
+            await asgi_app.event_scheduler.join()
+
+        reply.assert_awaited_once()
+        token, messages = reply.await_args[0]
+        self.assertEqual(token, "t1")
+        self.assertEqual(len(messages), 2)
+        self.assertIn("[警示]", messages[1])
+
+    async def test_profiled_callback_includes_background_stages(self):
+        """測試被分析的 /callback 等背景事件處理完才完成，並記錄背景的階段耗時"""
+        events = [{"type": "message", "replyToken": "t-profile", "source": {"userId": "U-profile"},
+                   "message": {"type": "text", "text": "錢怎麼轉"}}]
+        token = [(b"x-profile-token", b"test-secret")]
+        with mock.patch.object(asgi_app.request_profiler, "secret", "test-secret"), \
+                mock.patch("app.PROFILE_SECRET", "test-secret"), \
+                mock.patch("asgi_app.reply_to_user", new=mock.AsyncMock(return_value=True)):
+            await call("POST", "/callback", json.dumps({"events": events}).encode("utf-8"), token)
+            await asgi_app.event_scheduler.join()
+            _, _, body = await call("GET", "/admin/profiles", headers=token)
+            profile = next(p for p in json.loads(body)["profiles"] if p["endpoint"] == "callback")
+            self.assertIn("verify_signature", profile["stages"])
+            self.assertIn("analyze_text", profile["stages"])
+            status, _, _ = await call("GET", f"/admin/profiles/collapsed?id={profile['id']}", headers=token)
+            self.assertEqual(status, 200)
+
+    async def test_redelivered_event_suppressed(self):
+        """測試 LINE 重送的事件（相同 webhookEventId）不再處理與回覆"""
+        event = {"type": "message", "replyToken": "t2", "source": {"userId": "U2"},
+                 "webhookEventId": "01REDELIVERY", "deliveryContext": {"isRedelivery": False},
+                 "message": {"type": "text", "text": "你好"}}
+        redelivered = dict(event, replyToken="t3", deliveryContext={"isRedelivery": True})
+        with mock.patch("asgi_app.reply_to_user", new=mock.AsyncMock(return_value=True)) as reply:
+            for payload in (event, redelivered):
+                await call("POST", "/callback", json.dumps({"events": [payload]}).encode("utf-8"))
+            await asgi_app.event_scheduler.join()
+
+        reply.assert_awaited_once()
+        self.assertEqual(reply.await_args[0][0], "t2")
+        self.assertGreaterEqual(asgi_app.event_deduper.stats()["duplicates"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from chat_history import ChatHistoryStore
+from tests.helpers import FakeClock
+
+class TestChatHistoryStore(unittest.TestCase):
+    def test_ring_buffer_keeps_latest_messages(self):
+        """測試每位使用者只保留最近的訊息"""
+        store = ChatHistoryStore(max_messages=3)
+        for i in range(5):
+            store.append("u1", f"訊息{i}")
+        self.assertEqual(store.recent("u1"), ["訊息2", "訊息3", "訊息4"])
+        self.assertEqual(store.recent("u1", limit=2), ["訊息3", "訊息4"])
+        self.assertEqual(store.recent("nobody"), [])
+
+    def test_recent_by_time_window(self):
+        """測試依時間範圍取得訊息"""
+        clock = FakeClock(1_000_000.0)
+        store = ChatHistoryStore(clock=clock)
+        store.append("u1", "很久以前", timestamp=clock.now - 600)
+        store.append("u1", "剛剛", timestamp=clock.now - 10)
+        self.assertEqual(store.recent("u1", seconds=60), ["剛剛"])
+
+    def test_recent_by_size(self):
+        """測試依大小限制取得的訊息，至少保留最新的一則"""
+        store = ChatHistoryStore()
+        for text in ["a" * 10, "b" * 10, "c" * 10]:
+            store.append("u1", text)
+        self.assertEqual(store.recent("u1", max_bytes=25), ["b" * 10, "c" * 10])
+        self.assertEqual(store.recent("u1", max_bytes=5), ["c" * 10])
+
+    def test_idle_users_expire(self):
+        """測試閒置使用者會被移除"""
+        clock = FakeClock(1_000_000.0)
+        store = ChatHistoryStore(idle_ttl=60, clock=clock)
+        store.append("old", "你好")
+        clock.now += 120
+        store.append("new", "你好")
+        self.assertNotIn("old", store)
+        self.assertIn("new", store)
+        self.assertEqual(store.stats()["expired_users"], 1)
+
+    def test_memory_budget_evicts_least_recent_user(self):
+        """測試超過記憶體上限時淘汰最久未活動的使用者"""
+        store = ChatHistoryStore(max_bytes=1000, idle_ttl=0)
+        for i in range(10):
+            store.append(f"user{i}", "我相信你" * 10)
+        self.assertLessEqual(store.stats()["estimated_bytes"], 1000)
+        self.assertIn("user9", store)
+        self.assertNotIn("user0", store)
+        self.assertGreater(store.stats()["evicted_users"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
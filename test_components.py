@@ -0,0 +1,61 @@
+import unittest
+import threading
+import time
+from components import Component, ComponentRegistry
+
+class Service:
+    def __init__(self):
+        self.name = "service"
+
+    def get(self, key):
+        return f"value:{key}"
+
+class TestComponent(unittest.TestCase):
+    def test_created_on_first_use(self):
+        """測試第一次讀取屬性時才建立，之後都轉給同一個物件"""
+        registry = ComponentRegistry()
+        calls = []
+        component = Component("svc", lambda: calls.append(1) or Service(), registry=registry)
+        self.assertFalse(component.initialized)
+        self.assertEqual(calls, [])
+        # 與元件本身同名的方法（get、name）也轉給實際物件
+        self.assertEqual(component.get("a"), "value:a")
+        self.assertEqual(component.name, "service")
+        self.assertIs(component.resolve(), component.resolve())
+        self.assertEqual(calls, [1])
+
+    def test_concurrent_first_use_creates_once(self):
+        """測試多個執行緒同時第一次使用只建立一次"""
+        registry = ComponentRegistry()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return Service()
+
+        component = Component("svc", factory, registry=registry)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(component.resolve())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+    def test_preload_fork_safe_only(self):
+        """測試 preload 只建立 fork_safe 的元件，stats 回報建立狀態"""
+        registry = ComponentRegistry()
+        Component("cache", Service, fork_safe=True, registry=registry)
+        Component("pool", Service, registry=registry)
+        self.assertEqual(registry.preload(), ["cache"])
+        self.assertEqual(registry.preload(), [])
+        stats = registry.stats()
+        self.assertTrue(stats["cache"]["initialized"])
+        self.assertIsNotNone(stats["cache"]["init_ms"])
+        self.assertEqual(stats["pool"], {"initialized": False, "fork_safe": False, "init_ms": None})
+        self.assertEqual(registry.preload(fork_safe_only=False), ["pool"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+from event_dedupe import EventDeduper, SharedEventDeduper
+from tests.helpers import FakeClock
+
+class TestEventDeduper(unittest.TestCase):
+    def test_in_flight_and_processed(self):
+        """測試處理中與已處理的事件都視為重複，釋放後可以重新處理"""
+        dedupe = EventDeduper(ttl=60)
+        self.assertIsNone(dedupe.claim("e1"))
+        self.assertEqual(dedupe.claim("e1"), "in_flight")
+        dedupe.complete("e1")
+        self.assertEqual(dedupe.claim("e1"), "processed")
+
+        self.assertIsNone(dedupe.claim("e2"))
+        dedupe.release("e2")
+        self.assertIsNone(dedupe.claim("e2"))
+        self.assertEqual(dedupe.stats()["duplicates"], 2)
+
+    def test_expires_after_ttl(self):
+        """測試超過 ttl 的事件不再記錄"""
+        clock = FakeClock()
+        dedupe = EventDeduper(ttl=60, generations=4, clock=clock)
+        dedupe.claim("e1")
+        dedupe.complete("e1")
+        clock.now += 30
+        self.assertEqual(dedupe.claim("e1"), "processed")
+        clock.now += 45
+        self.assertIsNone(dedupe.claim("e1"))
+
+    def test_bounded_entries(self):
+        """測試總數超過上限時丟棄最舊的區段"""
+        clock = FakeClock()
+        dedupe = EventDeduper(ttl=40, max_entries=10, generations=4, clock=clock)
+        for i in range(30):
+            dedupe.claim(f"e{i}")
+            dedupe.complete(f"e{i}")
+            if i % 5 == 4:
+                clock.now += 10
+        dedupe.claim("last")
+        stats = dedupe.stats()
+        self.assertLessEqual(stats["entries"], 10)
+        self.assertGreater(stats["evicted"], 0)
+        self.assertEqual(dedupe.claim("e29"), "processed")
+
+class TestSharedEventDeduper(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "dedupe.sqlite3")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def make(self, **kwargs):
+        dedupe = SharedEventDeduper(self.path, clock=self.clock, **kwargs)
+        self.addCleanup(dedupe.close)
+        return dedupe
+
+    def test_shared_between_instances(self):
+        """測試兩個工作行程（兩個連線）共用去重紀錄"""
+        a, b = self.make(ttl=60), self.make(ttl=60)
+        self.assertIsNone(a.claim("e1"))
+        self.assertEqual(b.claim("e1"), "in_flight")
+        a.complete("e1")
+        self.assertEqual(b.claim("e1"), "processed")
+        self.clock.now += 61
+        self.assertIsNone(b.claim("e1"))
+
+    def test_stale_in_flight_reclaimed(self):
+        """測試處理中的事件逾時後（工作行程中止）可以重新處理"""
+        a, b = self.make(in_flight_timeout=10), self.make(in_flight_timeout=10)
+        a.claim("e1")
+        self.clock.now += 11
+        self.assertIsNone(b.claim("e1"))
+        b.release("e1")
+        self.assertIsNone(a.claim("e1"))
+
+if __name__ == '__main__':
+    unittest.main()
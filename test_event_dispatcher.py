@@ -0,0 +1,57 @@
+import unittest
+import threading
+import time
+from event_dispatcher import EventDispatcher
+
+class TestEventDispatcher(unittest.TestCase):
+    def test_same_key_keeps_order(self):
+        """測試同一使用者的事件依序處理"""
+        handled = []
+        lock = threading.Lock()
+
+        def handler(item):
+            time.sleep(0.001)
+            with lock:
+                handled.append(item)
+
+        dispatcher = EventDispatcher(handler, num_workers=4, max_queue_size=100)
+        for i in range(20):
+            dispatcher.submit("user_a", ("user_a", i))
+            dispatcher.submit("user_b", ("user_b", i))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        for user in ("user_a", "user_b"):
+            order = [i for key, i in handled if key == user]
+            self.assertEqual(order, list(range(20)))
+
+    def test_full_queue_drops_event(self):
+        """測試佇列已滿時不阻塞並記錄丟棄數"""
+        release = threading.Event()
+        dispatcher = EventDispatcher(lambda item: release.wait(), num_workers=1, max_queue_size=1)
+
+        results = [dispatcher.submit("user", i) for i in range(5)]
+        release.set()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        self.assertIn(False, results)
+        stats = dispatcher.stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["submitted"] + stats["dropped"], 5)
+
+    def test_stats(self):
+        """測試統計資料格式"""
+        dispatcher = EventDispatcher(lambda item: None, num_workers=2, max_queue_size=10)
+        dispatcher.submit("user", 1)
+        dispatcher.join()
+        stats = dispatcher.stats()
+        dispatcher.shutdown()
+
+        self.assertEqual(stats["workers"], 2)
+        self.assertEqual(stats["processed"], 1)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertIn("utilisation", stats)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from http_client import HttpClient, CircuitOpenError, request_not_sent
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 依序回傳的狀態碼，用完後一律回傳 200
+    statuses = []
+    # POST 收到請求後等待的秒數（模擬讀取逾時）
+    delay = 0
+    posts = 0
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        FakeHandler.posts += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+class TestHttpClient(unittest.TestCase):
+    def setUp(self):
+        FakeHandler.statuses = []
+        FakeHandler.delay = 0
+        FakeHandler.posts = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        """測試同一主機的請求重用 keep-alive 連線"""
+        client = HttpClient()
+        for _ in range(5):
+            self.assertEqual(client.get(self.url).status_code, 200)
+        pool = client.pool_stats()["pools"][f"127.0.0.1:{self.server.server_port}"]
+        self.assertEqual(pool["misses"], 1)
+        self.assertEqual(pool["hits"], 4)
+
+    def test_retry_on_server_error(self):
+        """測試 5xx 與 429 時會重試"""
+        FakeHandler.statuses = [503, 429]
+        client = HttpClient(max_retries=2, backoff_base=0.001)
+        self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(client.retries, 2)
+
+    def test_circuit_breaker_fails_fast(self):
+        """測試連續失敗後斷路器開啟並直接失敗"""
+        FakeHandler.statuses = [500] * 10
+        client = HttpClient(max_retries=0, failure_threshold=2, reset_timeout=60)
+        self.assertEqual(client.get(self.url).status_code, 500)
+        self.assertEqual(client.get(self.url).status_code, 500)
+        with self.assertRaises(CircuitOpenError):
+            client.get(self.url)
+        self.assertEqual(client.short_circuited, 1)
+
+    def test_half_open_trial_released_on_rate_limit(self):
+        """測試半開狀態的試探請求遇到 429 時釋放名額，之後的請求仍可送出"""
+        FakeHandler.statuses = [500, 500, 429]
+        client = HttpClient(max_retries=0, failure_threshold=2, reset_timeout=0.1)
+        client.get(self.url)
+        client.get(self.url)
+        time.sleep(0.15)
+        self.assertEqual(client.get(self.url).status_code, 429)
+        self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(client.breaker(f"127.0.0.1:{self.server.server_port}").state, "closed")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import io
+import os
+import tempfile
+from image_cache import ImageResultCache, PerceptualIndex, Image
+
+RESULT = {"is_scam": True, "confidence": 0.85, "details": {"scam_type": "investment_scam"}}
+
+def make_jpeg(size=(200, 150), quality=90):
+    """產生一張有漸層的測試圖片"""
+    img = Image.new("L", (200, 150))
+    img.putdata([(x * 3 + y * 5) % 256 if x < 100 else (255 - y) for y in range(150) for x in range(200)])
+    img = img.resize(size)
+    out = io.BytesIO()
+    img.convert("RGB").save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+class TestImageResultCache(unittest.TestCase):
+    def test_exact_hit(self):
+        """測試完全相同的圖片直接使用快取結果"""
+        cache = ImageResultCache()
+        data = b"\xff\xd8\xff" + b"same screenshot"
+        result, key = cache.lookup(data)
+        self.assertIsNone(result)
+        cache.store(key, RESULT)
+
+        result, _ = cache.lookup(data)
+        self.assertEqual(result, RESULT)
+        stats = cache.stats()
+        self.assertEqual(stats["exact_hits"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_perceptual_index_nearest(self):
+        """測試在漢明距離內找到最近的雜湊"""
+        index = PerceptualIndex(max_distance=3)
+        index.add("a", 0b1111_0000)
+        index.add("b", 0xFFFF_0000_FFFF_0000)
+        self.assertEqual(index.nearest(0b1111_0011), ("a", 2))
+        self.assertEqual(index.nearest(0xFFFF_0000_FFFF_0000 ^ 0b111), ("b", 3))
+        self.assertEqual(index.nearest(0xFFFF_0000_FFFF_0000 ^ 0b1111), (None, None))
+        index.remove("a")
+        self.assertEqual(index.nearest(0b1111_0000), (None, None))
+
+    @unittest.skipUnless(Image, "需要安裝 Pillow")
+    def test_perceptual_hit_for_resized_copy(self):
+        """測試重新壓縮或縮放的圖片也能命中"""
+        cache = ImageResultCache(max_distance=6)
+        _, key = cache.lookup(make_jpeg())
+        cache.store(key, RESULT)
+
+        result, _ = cache.lookup(make_jpeg(size=(160, 120), quality=60))
+        self.assertEqual(result, RESULT)
+        self.assertEqual(cache.stats()["perceptual_hits"], 1)
+
+    def test_persistence(self):
+        """測試快取可保存到檔案並在重新啟動後載入"""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        os.remove(path)
+        try:
+            cache = ImageResultCache(persist_path=path)
+            _, key = cache.lookup(b"\x89PNG\r\n\x1a\nfake")
+            cache.store(key, RESULT)
+            cache.save()
+
+            restored = ImageResultCache(persist_path=path)
+            result, _ = restored.lookup(b"\x89PNG\r\n\x1a\nfake")
+            self.assertEqual(result, RESULT)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+if __name__ == "__main__":
+    unittest.main()
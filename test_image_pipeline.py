@@ -0,0 +1,73 @@
+import unittest
+from image_pipeline import (
+    ImageBuffer, ImageTooLargeError, NotAnImageError,
+    copy_image_stream, download_to_buffer, sniff_image_type,
+)
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2000
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2000
+
+class FakeResponse:
+    def __init__(self, content, headers=None, chunk_size=256):
+        self.content = content
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.chunks_read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.content), self.chunk_size):
+            self.chunks_read += 1
+            yield self.content[i:i + self.chunk_size]
+
+    def close(self):
+        self.closed = True
+
+class TestImagePipeline(unittest.TestCase):
+    def test_sniff_image_type(self):
+        """測試依檔頭判斷圖片格式"""
+        self.assertEqual(sniff_image_type(JPEG_BYTES), "jpeg")
+        self.assertEqual(sniff_image_type(PNG_BYTES), "png")
+        self.assertIsNone(sniff_image_type(b"<html>not an image"))
+
+    def test_download_to_memory(self):
+        """測試圖片只放在記憶體並可取得 memoryview"""
+        response = FakeResponse(JPEG_BYTES)
+        with download_to_buffer(response, max_bytes=10000, spool_threshold=10000) as image:
+            self.assertTrue(image.in_memory)
+            self.assertEqual(image.image_type, "jpeg")
+            view = image.view()
+            self.assertIsInstance(view, memoryview)
+            self.assertEqual(view.tobytes(), JPEG_BYTES)
+        self.assertTrue(response.closed)
+
+    def test_spool_to_disk_above_threshold(self):
+        """測試超過門檻時改為暫存檔"""
+        with download_to_buffer(FakeResponse(PNG_BYTES), max_bytes=10000, spool_threshold=500) as image:
+            self.assertFalse(image.in_memory)
+            self.assertEqual(image.view().tobytes(), PNG_BYTES)
+
+    def test_abort_on_content_length(self):
+        """測試 Content-Length 超過上限時不讀取內容"""
+        response = FakeResponse(JPEG_BYTES, headers={"Content-Length": str(len(JPEG_BYTES))})
+        with self.assertRaises(ImageTooLargeError):
+            copy_image_stream(response, ImageBuffer(), max_bytes=100)
+        self.assertEqual(response.chunks_read, 0)
+        self.assertTrue(response.closed)
+
+    def test_abort_on_streamed_size(self):
+        """測試串流內容超過上限時提早中止"""
+        response = FakeResponse(JPEG_BYTES)
+        with self.assertRaises(ImageTooLargeError):
+            download_to_buffer(response, max_bytes=600, spool_threshold=10000)
+        self.assertLess(response.chunks_read, len(JPEG_BYTES) // 256)
+
+    def test_abort_when_not_image(self):
+        """測試檔頭不是圖片時提早中止"""
+        response = FakeResponse(b"<html>" + b"x" * 5000)
+        with self.assertRaises(NotAnImageError):
+            download_to_buffer(response, max_bytes=10000, spool_threshold=10000)
+        self.assertEqual(response.chunks_read, 1)
+
+if __name__ == "__main__":
+    unittest.main()
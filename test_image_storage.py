@@ -0,0 +1,127 @@
+import unittest
+import os
+import shutil
+import tempfile
+from image_storage import ImageStore, ImageStoreFull, TMP_DIR
+from tests.helpers import FakeClock
+
+class TestImageStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.store = ImageStore(self.root, max_bytes=100, orphan_ttl=60, sweep_interval=0,
+                                fsync=False, clock=self.clock)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_sharded_path_and_index(self):
+        """測試圖片存放在分層目錄，可依使用者或訊息 ID 查詢"""
+        record = self.store.put(b"a" * 10, "U1", "m1")
+        relative = os.path.relpath(record.path, self.root)
+        self.assertEqual(relative.split(os.sep), [record.id[:2], record.id[2:4], record.id + ".jpg"])
+        with open(record.path, "rb") as f:
+            self.assertEqual(f.read(), b"a" * 10)
+
+        self.clock.now += 1
+        self.store.put(b"b" * 10, "U1", "m2")
+        self.store.put(b"c" * 10, "U2", "m3")
+        self.assertEqual([r.message_id for r in self.store.find(user_id="U1")], ["m2", "m1"])
+        self.assertEqual(self.store.find(message_id="m1"), [self.store.get(record.path)])
+
+    def test_failed_write_leaves_nothing(self):
+        """測試寫入途中失敗時不留下檔案與索引"""
+        with self.assertRaises(ValueError):
+            with self.store.writer("U1", "m1") as f:
+                f.write(b"partial")
+                raise ValueError("下載中斷")
+        self.assertIsNone(f.path)
+        self.assertEqual(os.listdir(os.path.join(self.root, TMP_DIR)), [])
+        self.assertEqual(self.store.stats()["images"], 0)
+
+    def test_quota_evicts_oldest(self):
+        """測試超過容量上限時從最舊的圖片開始刪除"""
+        records = []
+        for i in range(4):
+            self.clock.now += 1
+            records.append(self.store.put(b"x" * 40, "U1", f"m{i}"))
+        stats = self.store.stats()
+        self.assertEqual((stats["images"], stats["bytes"], stats["evicted"]), (2, 80, 2))
+        self.assertFalse(os.path.exists(records[0].path))
+        self.assertTrue(os.path.exists(records[3].path))
+
+    def test_keep_and_discard(self):
+        """測試處理完畢的圖片會刪除，標記保留的證據不刪除"""
+        temporary = self.store.put(b"a", "U1", "m1")
+        evidence = self.store.put(b"b", "U1", "m2")
+        self.assertTrue(self.store.keep(evidence.path))
+        self.assertTrue(self.store.discard(temporary.path))
+        self.assertFalse(self.store.discard(evidence.path))
+        self.assertFalse(os.path.exists(temporary.path))
+        self.assertTrue(self.store.get(evidence.path).kept)
+
+    def test_sweep_orphans_and_untracked(self):
+        """測試背景清理刪除逾時未處理的圖片與沒有索引的圖片，保留的證據、新檔案與不是這個 store 寫入的檔案不受影響"""
+        orphan = self.store.put(b"a", "U1", "m1")
+        evidence = self.store.put(b"b", "U1", "m2", keep=True)
+        image_id = "ab" * 16
+        stale = os.path.join(self.root, "ab", "ab", image_id + ".jpg")
+        stale_part = os.path.join(self.root, TMP_DIR, "tmp123.part")
+        fresh = os.path.join(self.root, TMP_DIR, "writing.part")
+        unrelated = [
+            os.path.join(self.root, "legacy.jpg"),
+            os.path.join(self.root, "notes", image_id + ".jpg"),
+            os.path.join(self.root, "ab", "cd", image_id + ".jpg"),
+            os.path.join(self.root, "ab", "ab", "readme.txt"),
+            os.path.join(self.root, TMP_DIR, "keep.txt"),
+        ]
+        for path in [stale, stale_part, fresh] + unrelated:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"z")
+            os.utime(path, (0, 0))
+        os.utime(fresh, (self.clock.now + 100, self.clock.now + 100))
+
+        self.clock.now += 61
+        self.assertEqual(self.store.sweep(full=True), (1, 2))
+        self.assertFalse(os.path.exists(orphan.path))
+        self.assertFalse(os.path.exists(stale))
+        self.assertFalse(os.path.exists(stale_part))
+        self.assertTrue(os.path.exists(evidence.path))
+        self.assertTrue(os.path.exists(fresh))
+        for path in unrelated:
+            self.assertTrue(os.path.exists(path), path)
+        self.assertEqual(self.store.stats()["bytes"], 1)
+
+    def test_quota_never_evicts_kept_images(self):
+        """測試容量上限只刪除未保留的圖片，保留的證據超過上限時寫入失敗"""
+        evidence = self.store.put(b"e" * 40, "U1", "m1", keep=True)
+        self.clock.now += 1
+        temporary = self.store.put(b"t" * 40, "U1", "m2")
+        self.clock.now += 1
+        self.store.put(b"n" * 40, "U1", "m3")
+        self.assertTrue(os.path.exists(evidence.path))
+        self.assertFalse(os.path.exists(temporary.path))
+
+        self.clock.now += 1
+        self.store.put(b"k" * 40, "U1", "m4", keep=True)
+        with self.assertRaises(ImageStoreFull):
+            self.store.put(b"x" * 40, "U1", "m5", keep=True)
+        stats = self.store.stats()
+        self.assertEqual((stats["images"], stats["kept"], stats["bytes"]), (2, 2, 80))
+        self.assertEqual(os.listdir(os.path.join(self.root, TMP_DIR)), [])
+
+    def test_index_shared_between_instances(self):
+        """測試多個行程（實例）共用同一個目錄與索引"""
+        record = self.store.put(b"a" * 10, "U1", "m1")
+        other = ImageStore(self.root, sweep_interval=0, fsync=False)
+        try:
+            self.assertEqual(other.find(user_id="U1")[0].path, record.path)
+            self.assertTrue(other.discard(record.path))
+        finally:
+            other.close()
+        self.assertIsNone(self.store.get(record.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import tempfile
+from keyword_engine import Keyword, KeywordAutomaton, KeywordEngine
+from text_cache import normalize_text
+
+class TestKeywordEngine(unittest.TestCase):
+    def setUp(self):
+        fd, self.keyword_path = tempfile.mkstemp(suffix=".tsv")
+        os.close(fd)
+        self.write_keywords("我相信你\ttrust\t1.0\n錢怎麼轉\tmoney_transfer\t2.0\n")
+
+    def tearDown(self):
+        if os.path.exists(self.keyword_path):
+            os.remove(self.keyword_path)
+
+    def write_keywords(self, content):
+        with open(self.keyword_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_scan_reports_all_matches(self):
+        """測試一次掃描回報所有命中的關鍵字（含重疊）"""
+        automaton = KeywordAutomaton([
+            Keyword("he", "a", 1.0),
+            Keyword("she", "b", 2.0),
+            Keyword("hers", "c", 3.0),
+        ])
+        matches = automaton.scan("ushers")
+        found = sorted((m.phrase, m.category, m.weight, m.start) for m in matches)
+        self.assertEqual(found, [("he", "a", 1.0, 2), ("hers", "c", 3.0, 2), ("she", "b", 2.0, 1)])
+
+    def test_engine_loads_categories_and_weights(self):
+        """測試從檔案載入類別與權重"""
+        engine = KeywordEngine(self.keyword_path, reload_interval=0)
+        matches = engine.scan("我相信你，錢怎麼轉給你？")
+        self.assertEqual(
+            [(m.phrase, m.category, m.weight) for m in matches],
+            [("我相信你", "trust", 1.0), ("錢怎麼轉", "money_transfer", 2.0)],
+        )
+        self.assertEqual(engine.scan("今天天氣很好"), [])
+
+    def test_keywords_normalized(self):
+        """測試關鍵字載入時正規化，可比對正規化後的訊息"""
+        self.write_keywords("ＵＳＤＴ 出金\tinvestment\t1.0\n")
+        engine = KeywordEngine(self.keyword_path, reload_interval=0)
+        self.assertEqual([m.phrase for m in engine.scan(normalize_text("幫我 USDT\u200b出金"))], ["usdt出金"])
+        # 未正規化的訊息在內部正規化後比對
+        self.assertEqual([m.phrase for m in engine.scan("幫我 ＵＳＤＴ\u200b出金")], ["usdt出金"])
+
+    def test_hot_reload(self):
+        """測試檔案修改後自動替換關鍵字"""
+        engine = KeywordEngine(self.keyword_path, reload_interval=0)
+        old_version = engine.version
+        self.assertEqual(engine.scan("保證獲利"), [])
+
+        self.write_keywords("保證獲利\tinvestment\t1.5\n")
+        stat = os.stat(self.keyword_path)
+        os.utime(self.keyword_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual([m.phrase for m in engine.scan("保證獲利")], ["保證獲利"])
+        self.assertNotEqual(engine.version, old_version)
+        self.assertEqual(engine.scan("我相信你"), [])
+
+if __name__ == "__main__":
+    unittest.main()
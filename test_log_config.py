@@ -0,0 +1,73 @@
+import unittest
+import io
+import json
+import logging
+import threading
+import log_config
+from log_config import Redactor, JsonFormatter, LazyJson, configure_logging, stop_logging
+
+class TestLogConfig(unittest.TestCase):
+    def tearDown(self):
+        configure_logging()
+
+    def test_redact_tokens_and_signatures(self):
+        """測試遮蔽授權標頭、簽名與已知密鑰"""
+        redact = Redactor(secrets=["super-secret-token"])
+        text = redact("{'Authorization': 'Bearer abc.def', 'X-Line-Signature': 'c2lnbmF0dXJl', 'x': 'super-secret-token'}")
+        self.assertNotIn("abc.def", text)
+        self.assertNotIn("c2lnbmF0dXJl", text)
+        self.assertNotIn("super-secret-token", text)
+        self.assertIn("X-Line-Signature", text)
+
+    def test_json_formatter_includes_extra_fields(self):
+        """測試 JSON 格式包含 extra 欄位"""
+        record = logging.LogRecord("app", logging.INFO, __file__, 1, "處理 %s", ("事件",), None)
+        record.stage = "reply"
+        entry = json.loads(JsonFormatter(Redactor()).format(record))
+        self.assertEqual(entry["msg"], "處理 事件")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["stage"], "reply")
+
+    def test_lazy_json_not_serialised_when_disabled(self):
+        """測試日誌等級未啟用時不會序列化內容"""
+        class Exploding:
+            def __repr__(self):
+                raise AssertionError("不應該被序列化")
+
+        stream = io.StringIO()
+        configure_logging(level="WARNING", async_handler=False, stream=stream)
+        logging.info("內容：%s", LazyJson({"obj": Exploding()}))
+        self.assertEqual(stream.getvalue(), "")
+
+    def test_async_handler_and_sampling(self):
+        """測試透過佇列非同步寫出，並依比例抽樣大型內容"""
+        stream = io.StringIO()
+        configure_logging(fmt="json", async_handler=True, payload_sample_rate=0.0, stream=stream)
+        logging.info("一般訊息")
+        log_config.log_payload("請求內容", {"a": 1})
+        stop_logging()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line["msg"] for line in lines], ["一般訊息"])
+
+    def test_async_handler_formats_in_listener_thread(self):
+        """測試非同步寫出時，組合訊息與遮蔽在背景執行緒進行，不在呼叫端"""
+        threads = []
+
+        class Payload:
+            def __str__(self):
+                threads.append(threading.current_thread())
+                return "token=super-secret-token"
+
+        stream = io.StringIO()
+        handler = configure_logging(fmt="json", async_handler=True, secrets=["super-secret-token"], stream=stream)
+        handler.handle(logging.LogRecord("app", logging.INFO, __file__, 1, "內容：%s", (Payload(),), None))
+        stop_logging()
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry["msg"], "內容：token=***")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import json
+import os
+import tempfile
+from metrics import Registry, MultiProcessStore, render_prometheus, timed_stage, instrument, STAGE_ERRORS
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_exposition(self):
+        """測試直方圖輸出累計區間、總和與次數"""
+        registry = Registry()
+        hist = registry.histogram("demo_seconds", "示範", ["stage"], buckets=(0.1, 1.0))
+        hist.observe(0.05, stage="a")
+        hist.observe(0.5, stage="a")
+        hist.observe(3, stage="a")
+        text = render_prometheus(registry.collect())
+
+        self.assertIn("# TYPE demo_seconds histogram", text)
+        self.assertIn('demo_seconds_bucket{stage="a",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{stage="a",le="1"} 2', text)
+        self.assertIn('demo_seconds_bucket{stage="a",le="+Inf"} 3', text)
+        self.assertIn('demo_seconds_sum{stage="a"} 3.55', text)
+        self.assertIn('demo_seconds_count{stage="a"} 3', text)
+
+    def test_label_escaping(self):
+        """測試標籤值中的引號與換行會被跳脫"""
+        registry = Registry()
+        registry.counter("demo_total", "示範", ["name"]).inc(name='a"b\nc')
+        self.assertIn('demo_total{name="a\\"b\\nc"} 1', render_prometheus(registry.collect()))
+
+    def test_stage_errors_counted(self):
+        """測試階段發生例外或回傳失敗時計入錯誤次數"""
+        before = STAGE_ERRORS.get(stage="unit_test", message_type="text")
+        with self.assertRaises(ValueError):
+            with timed_stage("unit_test", "text"):
+                raise ValueError("boom")
+
+        @instrument("unit_test", "text", outcome=lambda result: "success" if result else "error")
+        def lookup(found):
+            return found
+
+        lookup(True)
+        lookup(False)
+        self.assertEqual(STAGE_ERRORS.get(stage="unit_test", message_type="text"), before + 2)
+
+    def test_multiprocess_merge(self):
+        """測試合併多個工作行程的快照，已結束行程的 gauge 不計入"""
+        with tempfile.TemporaryDirectory() as directory:
+            registry = Registry()
+            registry.counter("demo_total", "示範").inc(2)
+            registry.gauge("demo_in_flight", "示範").set(1)
+            registry.histogram("demo_seconds", "示範", buckets=(1.0,)).observe(0.5)
+            store = MultiProcessStore(registry, directory)
+
+            # 模擬另一個已結束的工作行程留下的快照
+            other = {"pid": 2 ** 22 + 12345, "metrics": registry.collect()}
+            with open(os.path.join(directory, "metrics_other.json"), "w", encoding="utf-8") as f:
+                json.dump(other, f)
+
+            text = render_prometheus(store.collect())
+            self.assertIn("demo_total 4", text)
+            self.assertIn("demo_in_flight 1", text)
+            self.assertIn('demo_seconds_bucket{le="1"} 2', text)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import threading
+from micro_batch import MicroBatcher
+from metrics import BATCH_SIZE, BATCH_QUEUE_WAIT
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_requests_within_window_share_one_batch(self):
+        """測試窗口內的請求合併成同一批次"""
+        batches = []
+        release = threading.Event()
+
+        def process(items):
+            release.wait(1)
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process, window=0.2, max_batch=10)
+        futures = [batcher.submit(i) for i in range(5)]
+        release.set()
+
+        self.assertEqual([f.result(timeout=2) for f in futures], [0, 2, 4, 6, 8])
+        self.assertEqual(batches, [[0, 1, 2, 3, 4]])
+
+    def test_per_item_errors(self):
+        """測試單筆失敗只影響該筆請求"""
+        def process(items):
+            return [ValueError("壞掉了") if item == "bad" else item for item in items]
+
+        batcher = MicroBatcher(process, window=0.05)
+        good, bad = batcher.submit("good"), batcher.submit("bad")
+        self.assertEqual(good.result(timeout=2), "good")
+        with self.assertRaises(ValueError):
+            bad.result(timeout=2)
+
+    def test_max_batch_size(self):
+        """測試批次大小上限"""
+        sizes = []
+
+        def process(items):
+            sizes.append(len(items))
+            return items
+
+        batcher = MicroBatcher(process, window=0.5, max_batch=3)
+        futures = [batcher.submit(i) for i in range(7)]
+        for future in futures:
+            future.result(timeout=3)
+        self.assertTrue(all(size <= 3 for size in sizes))
+        self.assertEqual(sum(sizes), 7)
+
+    def test_concurrent_batches(self):
+        """測試最多同時處理 max_concurrency 批，處理中的批次不會擋住下一批"""
+        started = threading.Barrier(2, timeout=2)
+
+        def process(items):
+            # 兩批都開始處理後才會一起通過，逐批處理時會逾時
+            started.wait()
+            return items
+
+        batcher = MicroBatcher(process, window=0.01, max_batch=1, max_concurrency=2)
+        futures = [batcher.submit(i) for i in range(2)]
+        self.assertEqual([f.result(timeout=3) for f in futures], [0, 1])
+        self.assertEqual(batcher.stats()["in_flight"], 0)
+
+    def test_batch_histograms(self):
+        """測試記錄每批的大小與每個項目的等待時間"""
+        batcher = MicroBatcher(lambda items: items, window=0.05, max_batch=3, name="unit-test-batch")
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            future.result(timeout=2)
+        self.assertGreaterEqual(BATCH_SIZE.count(batcher="unit-test-batch"), 1)
+        self.assertEqual(BATCH_SIZE.snapshot()['["unit-test-batch"]'][-1], 3)  # 各批大小的總和
+        self.assertEqual(BATCH_QUEUE_WAIT.count(batcher="unit-test-batch"), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import threading
+import time
+from cache_utils import TTLCache
+from profile_cache import ProfileCache, LazyProfile, AnalysisData
+from tests.helpers import FakeClock
+
+class TestProfileCache(unittest.TestCase):
+    def test_ttl_and_lru_eviction(self):
+        """測試快取過期與 LRU 淘汰"""
+        clock = FakeClock(0.0)
+        cache = TTLCache(max_entries=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # a 變成最近使用
+        cache.set("c", 3)                    # 淘汰 b
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+        clock.now = 11
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_negative_caching(self):
+        """測試 404 結果會被快取"""
+        calls = []
+
+        def fetcher(user_id):
+            calls.append(user_id)
+            return 404, {}
+
+        cache = ProfileCache(fetcher, negative_ttl=60)
+        self.assertEqual(cache.get("ghost"), {})
+        self.assertEqual(cache.get("ghost"), {})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["not_found"], 1)
+
+    def test_concurrent_misses_are_coalesced(self):
+        """測試同一使用者同時間的查詢只送出一次"""
+        calls = []
+
+        def fetcher(user_id):
+            calls.append(user_id)
+            time.sleep(0.05)
+            return 200, {"displayName": "小明"}
+
+        cache = ProfileCache(fetcher)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("u1"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"displayName": "小明"}] * 8)
+
+    def test_lazy_profile(self):
+        """測試只有讀取使用者資料欄位時才查詢"""
+        calls = []
+
+        def loader(user_id):
+            calls.append(user_id)
+            return {"displayName": "小明", "language": "zh-TW"}
+
+        data = AnalysisData(LazyProfile("u1", loader), "u1", "你好", ["你好"])
+        self.assertEqual(data["current_message"], "你好")
+        self.assertEqual(calls, [])
+
+        self.assertEqual(data["display_name"], "小明")
+        self.assertEqual(dict(data)["language"], "zh-TW")
+        self.assertEqual(calls, ["u1"])
+
+if __name__ == "__main__":
+    unittest.main()
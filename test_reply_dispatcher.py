@@ -0,0 +1,162 @@
+import unittest
+import asyncio
+import time
+from reply_dispatcher import TokenBucket, ReplyDispatcher, AsyncReplyDispatcher
+
+class FakeLine:
+    """依序回傳設定好的回應；None 代表連線失敗（確定沒有送出），"timeout" 代表送出後讀取逾時"""
+    def __init__(self, reply=(), push=()):
+        self.reply_responses = list(reply)
+        self.push_responses = list(push)
+        self.calls = []
+
+    def _respond(self, responses):
+        response = responses.pop(0) if responses else (200, {}, "")
+        if response is None:
+            raise ConnectionRefusedError("連線失敗")
+        if response == "timeout":
+            raise TimeoutError("讀取逾時")
+        return response
+
+    def send_reply(self, reply_token, messages):
+        self.calls.append(("reply", reply_token, messages))
+        return self._respond(self.reply_responses)
+
+    def send_push(self, to, messages, retry_key):
+        self.calls.append(("push", to, retry_key))
+        return self._respond(self.push_responses)
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve_and_penalize(self):
+        """測試令牌用完後依速率排隊，被限流時暫停發出令牌"""
+        now = [0.0]
+        bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.assertAlmostEqual(bucket.reserve(), 0.2)
+        now[0] = 1.0
+        self.assertEqual(bucket.reserve(), 0.0)
+        bucket.penalize(3)
+        self.assertAlmostEqual(bucket.reserve(), 3.1)
+
+class TestReplyDispatcher(unittest.TestCase):
+    def make(self, line, **kwargs):
+        kwargs.setdefault("backoff_base", 0.01)
+        dispatcher = ReplyDispatcher(line.send_reply, line.send_push, num_workers=2, **kwargs)
+        self.addCleanup(dispatcher.close, 1.0)
+        return dispatcher
+
+    def wait_idle(self, dispatcher):
+        deadline = time.monotonic() + 5
+        while dispatcher.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return dispatcher.stats()
+
+    def test_retry_then_deliver(self):
+        """測試 429 與 5xx 以退避重試，遵守 Retry-After 後送達"""
+        line = FakeLine(reply=[(429, {"Retry-After": "0"}, ""), (503, {}, ""), None])
+        dispatcher = self.make(line)
+        self.assertTrue(dispatcher.submit("t1", "U1", ["嗨"]))
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual((stats["delivered"], stats["retries"]), (1, 3))
+        self.assertEqual([call[0] for call in line.calls], ["reply"] * 4)
+
+    def test_retries_exhausted(self):
+        """測試重試次數用完時放棄並計入丟棄數"""
+        line = FakeLine(reply=[(500, {}, "")] * 5)
+        dispatcher = self.make(line, max_attempts=2)
+        dispatcher.submit("t1", "U1", ["嗨"])
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual((stats["delivered"], stats["dropped"]), (0, 1))
+        self.assertEqual(len(line.calls), 2)
+
+    def test_expired_token_uses_push(self):
+        """測試事件已超過 replyToken 有效時間時直接改用 push"""
+        line = FakeLine()
+        dispatcher = self.make(line, reply_token_ttl=50)
+        dispatcher.submit("t1", "C1", ["嗨"], received_at=time.time() - 60)
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual(line.calls[0][:2], ("push", "C1"))
+        self.assertEqual((stats["delivered"], stats["push_fallbacks"]), (1, 1))
+
+    def test_invalid_token_falls_back_to_push(self):
+        """測試 LINE 回報 replyToken 無效時改用 push，push 重試沿用同一個 retry key"""
+        line = FakeLine(reply=[(400, {}, '{"message":"Invalid reply token"}')], push=[(500, {}, ""), (409, {}, "")])
+        dispatcher = self.make(line)
+        dispatcher.submit("t1", "U1", ["嗨"])
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual([call[0] for call in line.calls], ["reply", "push", "push"])
+        self.assertEqual(line.calls[1][2], line.calls[2][2])
+        self.assertEqual(stats["delivered"], 1)
+
+    def test_reply_timeout_not_retried(self):
+        """測試 reply 送出後逾時（可能已送達）不重試也不改用 push，push 逾時沿用 retry key 重試"""
+        line = FakeLine(reply=["timeout"])
+        dispatcher = self.make(line)
+        dispatcher.submit("t1", "U1", ["嗨"])
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual([call[0] for call in line.calls], ["reply"])
+        self.assertEqual((stats["dropped"], stats["retries"], stats["push_fallbacks"]), (1, 0, 0))
+
+        line = FakeLine(push=["timeout"])
+        dispatcher = self.make(line)
+        dispatcher.submit(None, "U1", ["嗨"])
+        stats = self.wait_idle(dispatcher)
+        self.assertEqual([call[0] for call in line.calls], ["push", "push"])
+        self.assertEqual(line.calls[0][2], line.calls[1][2])
+        self.assertEqual(stats["delivered"], 1)
+
+    def test_rejected_and_queue_full(self):
+        """測試無法重試的錯誤直接放棄，佇列已滿時拒絕排入"""
+        line = FakeLine(reply=[(400, {}, '{"message":"The request body has 1 error(s)"}')])
+        dispatcher = self.make(line, push_fallback=True)
+        dispatcher.submit("t1", "U1", ["嗨"])
+        self.assertEqual(self.wait_idle(dispatcher)["dropped"], 1)
+        self.assertEqual(len(line.calls), 1)
+
+        full = self.make(FakeLine(), max_queue_size=0)
+        self.assertFalse(full.submit("t2", "U1", ["嗨"]))
+
+class TestAsyncReplyDispatcher(unittest.TestCase):
+    def test_async_retry_and_push(self):
+        """測試非同步版本的重試與改用 push"""
+        line = FakeLine(reply=[(502, {}, ""), (400, {}, "Invalid reply token")], push=["timeout"])
+
+        async def send_reply(reply_token, messages):
+            return line.send_reply(reply_token, messages)
+
+        async def send_push(to, messages, retry_key):
+            return line.send_push(to, messages, retry_key)
+
+        async def run():
+            dispatcher = AsyncReplyDispatcher(send_reply, send_push, backoff_base=0.01)
+            dispatcher.submit("t1", "U1", ["嗨"])
+            await dispatcher.join(timeout=5)
+            return dispatcher.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual([call[0] for call in line.calls], ["reply", "reply", "push", "push"])
+        self.assertEqual((stats["delivered"], stats["retries"], stats["push_fallbacks"]), (1, 2, 1))
+
+    def test_async_reply_timeout_not_retried(self):
+        """測試非同步版本 reply 送出後逾時不重試也不改用 push"""
+        line = FakeLine(reply=["timeout"])
+
+        async def send_reply(reply_token, messages):
+            return line.send_reply(reply_token, messages)
+
+        async def send_push(to, messages, retry_key):
+            return line.send_push(to, messages, retry_key)
+
+        async def run():
+            dispatcher = AsyncReplyDispatcher(send_reply, send_push, backoff_base=0.01)
+            dispatcher.submit("t1", "U1", ["嗨"])
+            await dispatcher.join(timeout=5)
+            return dispatcher.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual([call[0] for call in line.calls], ["reply"])
+        self.assertEqual((stats["dropped"], stats["push_fallbacks"]), (1, 0))
+
+if __name__ == '__main__':
+    unittest.main()
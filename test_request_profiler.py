@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+import metrics
+from request_profiler import RequestProfiler
+
+def busy_work(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+class TestRequestProfiler(unittest.TestCase):
+    def test_sampling_decision(self):
+        """測試未啟用時不分析，帶有正確的 token 時一定分析"""
+        self.assertIsNone(RequestProfiler().begin("callback", "secret"))
+        profiler = RequestProfiler(sample_rate=0, secret="secret")
+        self.assertIsNone(profiler.begin("callback"))
+        self.assertIsNone(profiler.begin("callback", "wrong"))
+        self.assertTrue(profiler.begin("callback", "secret").forced)
+        # 非 ASCII 的 token 不會造成例外
+        self.assertIsNone(profiler.begin("callback", "密碼"))
+        self.assertTrue(RequestProfiler(secret="密碼").begin("callback", "密碼").forced)
+        self.assertIsNotNone(RequestProfiler(sample_rate=1.0).begin("callback"))
+
+    def test_stages_and_stacks_recorded(self):
+        """測試記錄各階段耗時與呼叫堆疊，背景工作結束後才算完成"""
+        profiler = RequestProfiler(sample_rate=1.0, interval=0.001)
+        profile = profiler.begin("callback")
+        with profiler.attach(profile):
+            metrics.observe_stage("verify_signature", 0.002)
+        profiler.hold(profile)
+        profiler.release(profile)
+        self.assertEqual(profiler.profiles(), [])
+
+        def worker():
+            with profiler.attach(profile):
+                with metrics.timed_stage("analyze_text", "text"):
+                    busy_work(0.05)
+            profiler.release(profile)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        # 沒有被分析的請求不記錄
+        metrics.observe_stage("verify_signature", 0.002)
+
+        self.assertEqual(profiler.profiles(), [profile])
+        summary = profile.summary()
+        self.assertEqual(summary["stages"]["verify_signature"]["count"], 1)
+        self.assertGreaterEqual(summary["stages"]["analyze_text"]["total_ms"], 50)
+        self.assertGreater(summary["samples"], 0)
+        lines = profiler.collapsed(profile.id).splitlines()
+        self.assertTrue(any("busy_work (test_request_profiler.py:" in line for line in lines))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+
+    def test_keeps_slowest_profiles(self):
+        """測試只保留耗時最長的幾筆"""
+        profiler = RequestProfiler(sample_rate=1.0, max_profiles=2)
+        for seconds in (0.03, 0.0, 0.02, 0.01):
+            profile = profiler.begin("api")
+            busy_work(seconds)
+            profiler.release(profile)
+        durations = [p.duration for p in profiler.profiles()]
+        self.assertEqual(len(durations), 2)
+        self.assertGreaterEqual(durations[0], durations[1])
+        self.assertGreaterEqual(durations[1], 0.02)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+from risk_state import RiskStateStore
+from tests.helpers import FakeClock
+
+class TestRiskStateStore(unittest.TestCase):
+    def test_conversation_escalates(self):
+        """測試單獨一句建立信任的話不警示，接著出現轉帳要求後風險升高"""
+        clock = FakeClock(1_000_000.0)
+        store = RiskStateStore(clock=clock)
+        trust = store.update("u1", [("trust", 1.0)])
+        self.assertEqual(trust.stage, 1)
+        self.assertLess(trust.score, 0.7)
+
+        clock.now += 600
+        store.update("u1", [])
+        clock.now += 600
+        transfer = store.update("u1", [("money_transfer", 1.0)])
+        self.assertEqual(transfer.stage, 3)
+        self.assertGreater(transfer.score, 0.9)
+        self.assertEqual(transfer.messages, 3)
+        self.assertEqual(transfer.contact_seconds, 1200)
+        self.assertEqual(set(transfer.categories), {"trust", "money_transfer"})
+
+    def test_scores_decay(self):
+        """測試分數依半衰期衰減，冷卻後階段歸零"""
+        clock = FakeClock(1_000_000.0)
+        store = RiskStateStore(half_life=100, clock=clock)
+        store.update("u1", [("investment", 1.0)])
+        clock.now += 100
+        self.assertAlmostEqual(store.get("u1").categories["investment"], 0.5, places=3)
+        clock.now += 1000
+        self.assertEqual(store.get("u1").stage, 0)
+        self.assertIsNone(store.get("nobody"))
+
+    def test_known_contact_weighs_less(self):
+        """測試認識很久的聯絡人，相同內容的風險較低"""
+        clock = FakeClock(1_000_000.0)
+        store = RiskStateStore(half_life=0, new_contact_window=3600, clock=clock)
+        store.update("old", [])
+        clock.now += 7200
+        old = store.update("old", [("trust", 1.0)])
+        new = store.update("new", [("trust", 1.0)])
+        self.assertLess(old.score, new.score)
+
+    def test_max_users_evicts_least_recent(self):
+        """測試超過使用者上限時淘汰最久未更新的使用者"""
+        store = RiskStateStore(max_users=2)
+        for user_id in ("a", "b", "c"):
+            store.update(user_id, [("trust", 1.0)])
+        self.assertNotIn("a", store)
+        self.assertEqual(store.stats()["evicted_users"], 1)
+
+    def test_save_and_load(self):
+        """測試存檔後重新載入，狀態相同"""
+        clock = FakeClock(1_000_000.0)
+        store = RiskStateStore(clock=clock)
+        store.update("u1", [("trust", 1.0), ("自訂類別", 0.5)])
+        store.update("u2", [])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "risk.bin")
+            store.save(path)
+            restored = RiskStateStore(clock=clock)
+            self.assertEqual(restored.load(path), 2)
+        self.assertEqual(restored.get("u1"), store.get("u1"))
+        self.assertEqual(restored.stats()["estimated_bytes"], store.stats()["estimated_bytes"])
+
+    def test_merge_keeps_latest(self):
+        """測試合併多個工作行程的存檔：類別編號不同也能對應，同一位使用者保留最後更新的紀錄"""
+        clock = FakeClock(1_000_000.0)
+        first, second = RiskStateStore(clock=clock), RiskStateStore(clock=clock)
+        first.update("u1", [("trust", 1.0)])
+        first.update("u2", [("trust", 1.0)])
+        clock.now += 60
+        second.update("u3", [("investment", 1.0)])
+        second.update("u1", [("money_transfer", 2.0)])
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, "risk.bin.1"), os.path.join(tmp, "risk.bin.2")]
+            first.save(paths[0])
+            second.save(paths[1])
+            merged = RiskStateStore(clock=clock)
+            self.assertEqual(merged.merge(paths[1]), 2)
+            self.assertEqual(merged.merge(paths[0]), 1)
+            merged.save(paths[0])
+            restored = RiskStateStore(clock=clock)
+            restored.load(paths[0])
+        self.assertEqual(merged.get("u1"), second.get("u1"))
+        self.assertEqual(merged.get("u2"), first.get("u2"))
+        self.assertEqual(merged.get("u3"), second.get("u3"))
+        # 依最後更新時間排序，最舊的在前
+        self.assertEqual(list(merged._users), ["u2", "u3", "u1"])
+        self.assertEqual(merged.stats()["estimated_bytes"], restored.stats()["estimated_bytes"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,22 @@ import unittest
 import os
 import json
 import requests
-from app import app, handle_image_message, analyze_image, generate_image_warning, cleanup_image
+import subprocess
+import sys
+from unittest import mock
+from app import create_app, handle_image_message, analyze_image, generate_image_warning, cleanup_image
+from app import route_events, process_event_group, text_reply, analyze_text, text_result_cache
+from app import admission, dispatch_events, process_deferred_group, IMAGE_BUSY_REPLY, request_profiler
+from app import event_dispatcher, deferred_dispatcher
+from app import should_warn, generate_warning, api_cache_key, _create_risk_store
+from risk_state import RiskAssessment, RiskStateStore
 import tempfile
 from datetime import datetime
 
 class TestScamBot(unittest.TestCase):
     def setUp(self):
         # 設定測試環境
-        self.app = app.test_client()
+        self.app = create_app({"TESTING": True}).test_client()
         self.test_image_dir = "test_images"
         os.makedirs(self.test_image_dir, exist_ok=True)
         
@@ -111,16 +119,272 @@ class TestScamBot(unittest.TestCase):
             ]
         }
         
-        # 發送測試請求
-        response = self.app.post(
-            "/callback",
-            data=json.dumps(test_data),
-            content_type="application/json"
-        )
+        # 發送測試請求（背景處理完才結束，不真的送出回覆）
+        with mock.patch("app.reply_to_user") as reply:
+            response = self.app.post(
+                "/callback",
+                data=json.dumps(test_data),
+                content_type="application/json"
+            )
+            event_dispatcher.join()
+            deferred_dispatcher.join()
         
         # 驗證回應
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data.decode(), "OK")
+        reply.assert_called_once()
+        self.assertEqual(reply.call_args[0][0], "test_reply_token")
+
+    def test_batch_analyze_json_array(self):
+        """測試批次分析 API（JSON 陣列），單筆錯誤不影響其他項目"""
+        items = [
+            {"id": "a", "message_type": "text", "current_message": "錢怎麼轉"},
+            "not an object",
+            {"id": "c", "message_type": "image", "image_path": "x.jpg"},
+        ]
+        response = self.app.post("/api/analyze/batch", data=json.dumps(items), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        results = {r["index"]: r for r in map(json.loads, response.data.decode().splitlines())}
+
+        self.assertEqual(sorted(results), [0, 1, 2])
+        self.assertEqual(results[0]["status"], "success")
+        self.assertEqual(results[0]["id"], "a")
+        self.assertEqual(results[1]["status"], "error")
+        self.assertEqual(results[2]["data"]["analysis"]["details"]["scam_type"], "investment_scam")
+
+    def test_analyze_session_resync(self):
+        """測試分析 API 以 session 累積上下文，序號對不上時回應 409"""
+        def post(session):
+            data = {"user_id": "U1", "current_message": "我的帳號", "session": session}
+            return self.app.post("/api/analyze", data=json.dumps(data), content_type="application/json")
+
+        response = post({"id": "test-session", "seq": 0, "messages": ["你好", "錢怎麼轉"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["session"], {"id": "test-session", "seq": 2})
+
+        response = post({"id": "test-session", "seq": 5, "messages": ["我的帳號"]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json(), {"status": "resync", "session": {"id": "test-session", "seq": 2}})
+
+        response = post({"id": "test-session", "seq": "x", "messages": []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_profile_with_secret_header(self):
+        """測試帶有 X-Profile-Token 的請求會被分析，並可從管理端點查看"""
+        with mock.patch.object(request_profiler, "secret", "test-secret"), \
+                mock.patch("app.PROFILE_SECRET", "test-secret"):
+            headers = {"X-Profile-Token": "test-secret"}
+            self.app.post("/api/analyze", data=json.dumps({"current_message": "你好"}),
+                          content_type="application/json", headers=headers)
+            self.assertEqual(self.app.get("/admin/profiles").status_code, 403)
+            self.assertEqual(self.app.get("/admin/profiles", headers={"X-Profile-Token": "密碼"}).status_code, 403)
+            response = self.app.post("/api/analyze", data=json.dumps({"current_message": "你好"}),
+                                     content_type="application/json", headers={"X-Profile-Token": "密碼"})
+            self.assertEqual(response.status_code, 200)
+
+            report = self.app.get("/admin/profiles", headers=headers).get_json()
+            profile = next(p for p in report["profiles"] if p["endpoint"] == "mock_llm_api")
+            self.assertTrue(profile["forced"])
+            detail = self.app.get(f"/admin/profiles?id={profile['id']}", headers=headers).get_json()
+            self.assertEqual(detail["id"], profile["id"])
+            response = self.app.get("/admin/profiles/collapsed", headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.mimetype.startswith("text/plain"))
+        self.assertEqual(self.app.get("/admin/profiles").status_code, 404)
+        # 只開啟抽樣、沒有設定 secret 時不提供管理端點
+        with mock.patch.object(request_profiler, "sample_rate", 1.0):
+            self.assertEqual(self.app.get("/admin/profiles").status_code, 404)
+            self.assertEqual(self.app.get("/admin/profiles/collapsed").status_code, 404)
+
+    def test_batch_analyze_ndjson(self):
+        """測試批次分析 API（NDJSON 串流）"""
+        body = '{"id": "a", "current_message": "你好"}\n{bad json\n{"id": "c", "current_message": "嗨"}\n'
+        response = self.app.post("/api/analyze/batch", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        statuses = {r["index"]: r["status"] for r in map(json.loads, response.data.decode().splitlines())}
+        self.assertEqual(statuses, {0: "success", 1: "error", 2: "success"})
+
+    def test_replies_coalesced_by_reply_token(self):
+        """測試同一個 replyToken 的結果合併成一次回覆"""
+        def text_event(token, text):
+            return {
+                "type": "message",
+                "replyToken": token,
+                "source": {"userId": "test_user_id"},
+                "message": {"type": "text", "text": text},
+            }
+
+        events = [text_event("t1", "你好"), text_event("t2", "嗨"), text_event("t1", "錢怎麼轉")]
+        groups = route_events(events)
+        self.assertEqual([(user_id, len(group)) for user_id, group in groups],
+                         [("test_user_id", 2), ("test_user_id", 1)])
+
+        with mock.patch("app.reply_to_user") as reply:
+            process_event_group(groups[0][1])
+        reply.assert_called_once()
+        token, messages = reply.call_args[0]
+        self.assertEqual(token, "t1")
+        self.assertEqual(len(messages), 2)
+        self.assertIn("[警示]", messages[1])
+
+    def test_analyze_text_normalized_and_cached(self):
+        """測試插入空白、全形字或零寬字元的訊息仍能比對，並共用同一筆快取結果"""
+        first = analyze_text("請問 要 匯 到 哪")
+        hits = text_result_cache.stats()["hits"]
+        second = analyze_text("請問要匯到\u200b哪")
+        self.assertEqual(first["label"], "scam")
+        self.assertIs(second, first)
+        self.assertEqual(text_result_cache.stats()["hits"], hits + 1)
+
+    def test_analyzer_receives_original_text(self):
+        """測試分析器收到原始訊息，正規化只用於快取鍵值"""
+        received = []
+        def fake_analyze(text):
+            received.append(text)
+            return {"label": "safe", "confidence": 0.1, "reply": "好"}
+
+        with mock.patch("app.analysis.analyze_text", side_effect=fake_analyze):
+            analyze_text("ＨＥＬＬＯ 原始 訊息")
+            analyze_text("hello原始訊息")
+        self.assertEqual(received, ["ＨＥＬＬＯ 原始 訊息"])
+
+    def test_api_cache_key_includes_user_and_context(self):
+        """測試分析 API 快取的鍵值包含使用者與上下文視窗，不同對話中的相同訊息不共用結果"""
+        def data(user_id, history, message="要匯到哪"):
+            return {"user_id": user_id, "current_message": message, "chat_history": history}
+
+        key = api_cache_key(data("U1", ["你好", "要匯到哪"]))
+        self.assertEqual(key, api_cache_key(data("U1", ["你好", "要匯到哪"], "要 匯到哪")))
+        self.assertNotEqual(key, api_cache_key(data("U2", ["你好", "要匯到哪"])))
+        self.assertNotEqual(key, api_cache_key(data("U1", ["要匯到哪"])))
+
+    def test_text_reply_without_matches(self):
+        """測試分析器回傳的結果沒有 matches 欄位時仍能回覆"""
+        result = {"label": "scam", "confidence": 0.95, "reply": "嗯嗯"}
+        with mock.patch("app.analyze_text", return_value=result):
+            reply = text_reply("test_no_matches_user", "你好")
+        self.assertTrue(reply.startswith("嗯嗯"))
+
+    def test_warn_on_message_verdict_or_conversation_risk(self):
+        """測試單則訊息的判斷或整段對話的風險分數任一個達到門檻就警示"""
+        low_risk, high_risk = RiskAssessment(0.1, 0, {}, 1, 0), RiskAssessment(0.9, 3, {}, 3, 0)
+        scam = {"label": "scam", "confidence": 0.95}
+        safe = {"label": "safe", "confidence": 0.1}
+        self.assertTrue(should_warn(scam, low_risk))
+        self.assertIn("可信度 95.0%", generate_warning(scam, low_risk))
+        self.assertTrue(should_warn(safe, high_risk))
+        self.assertIn("對話風險 90.0%", generate_warning(safe, high_risk))
+        self.assertFalse(should_warn(safe, low_risk))
+
+    def test_risk_state_files_per_process(self):
+        """測試每個行程寫回各自的對話風險存檔，載入時合併，已合併的舊存檔在寫回後刪除"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "risk.bin")
+            for pid, user_id in ((101, "U-risk-a"), (102, "U-risk-b")):
+                store = RiskStateStore()
+                store.update(user_id, [("trust", 1.0)])
+                store.save(f"{path}.{pid}")
+            with mock.patch("app.RISK_STATE_FILE", path), mock.patch("app.atexit.register") as register:
+                store = _create_risk_store()
+                self.assertIn("U-risk-a", store)
+                self.assertIn("U-risk-b", store)
+                save, *args = register.call_args[0]
+                save(*args)
+            self.assertEqual(os.listdir(tmp), [f"risk.bin.{os.getpid()}"])
+
+    def test_overload_defers_or_degrades_images(self):
+        """測試負載過高時圖片與之後的事件延後處理，或圖片只回覆固定訊息，文字警示照常處理"""
+        def events():
+            return [
+                {"type": "message", "replyToken": "t9", "source": {"userId": "U9"},
+                 "message": {"type": "text", "text": "你好"}},
+                {"type": "message", "replyToken": "t9", "source": {"userId": "U9"},
+                 "message": {"type": "image", "id": "img9"}},
+                {"type": "message", "replyToken": "t9", "source": {"userId": "U9"},
+                 "message": {"type": "text", "text": "錢怎麼轉"}},
+            ]
+
+        submitted, deferred = [], []
+        def submit(user_id, group):
+            submitted.append(group)
+            admission.leave(user_id, len(group))
+            return True
+
+        admission.enter("busy", admission.max_in_flight)
+        try:
+            dispatch_events(events(), submit, lambda user_id, group: deferred.append(group) or True)
+            # 還有延後的事件時，這位使用者之後的文字也延後，維持處理順序
+            dispatch_events(events()[:1], submit, lambda user_id, group: deferred.append(group) or True)
+            for group in deferred:
+                admission.undefer("U9", len(group))
+            dispatch_events(events(), submit, lambda user_id, group: False)
+            with mock.patch("app.ADMISSION_DEFER", False):
+                dispatch_events(events(), submit, lambda user_id, group: False)
+        finally:
+            admission.leave("busy", admission.max_in_flight)
+
+        types = lambda group: [e["message"]["type"] for e in group]
+        self.assertEqual(types(submitted[0]), ["text"])
+        self.assertEqual(types(deferred[0]), ["image", "text"])
+        self.assertEqual(types(deferred[1]), ["text"])
+        self.assertFalse(admission.has_deferred("U9"))
+        # 延後佇列已滿或不延後：文字照常處理，圖片改為固定回覆，依原本的順序
+        for group in submitted[2:]:
+            self.assertEqual(types(group), ["text", "image", "text"])
+            with mock.patch("app.reply_to_user") as reply:
+                process_event_group(group)
+            messages = reply.call_args[0][1]
+            self.assertEqual(reply.call_args[0][0], "t9")
+            self.assertEqual(messages[-2], IMAGE_BUSY_REPLY)
+            self.assertIn("[警示]", messages[-1])
+
+    def test_deferred_group_pushes_result(self):
+        """測試延後處理的事件不使用（多半已過期的）replyToken，直接以 push 送出"""
+        events = [{"type": "message", "replyToken": "t8", "source": {"userId": "U8"},
+                   "message": {"type": "image", "id": "img8"}, "_degraded": "in_flight"}]
+        admission.defer("U8", 1)
+        with mock.patch("app.reply_to_user") as reply:
+            process_deferred_group(events)
+        self.assertIsNone(reply.call_args[0][0])
+        self.assertEqual(reply.call_args[0][1], [IMAGE_BUSY_REPLY])
+        self.assertEqual(reply.call_args[1]["to"], "U8")
+        self.assertFalse(admission.has_deferred("U8"))
+
+    def test_metrics_endpoint(self):
+        """測試 /metrics 以 Prometheus 文字格式輸出各階段耗時"""
+        self.app.post("/callback", data=json.dumps({"events": []}), content_type="application/json")
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        body = response.data.decode()
+        self.assertIn("# TYPE scam_bot_stage_duration_seconds histogram", body)
+        self.assertIn('stage="parse_json"', body)
+        self.assertIn("scam_bot_event_queue_depth", body)
+
+    def test_import_without_credentials(self):
+        """測試沒有 LINE 憑證也能 import 並使用分析函式，建立應用程式時才檢查憑證"""
+        env = {k: v for k, v in os.environ.items() if k not in ("CHANNEL_ACCESS_TOKEN", "CHANNEL_SECRET")}
+        code = (
+            "import sys, app\n"
+            "assert 'PIL.Image' not in sys.modules\n"
+            "assert not any(c.initialized for c in (app.keyword_engine, app.image_batcher, app.batch_executor))\n"
+            "assert app.analyze_text('錢怎麼轉')['label'] == 'scam'\n"
+            "assert not app.http_client.initialized\n"
+            "try:\n"
+            "    app.create_app()\n"
+            "except ValueError:\n"
+            "    print('checked')\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "checked")
+
+    def test_stats_reports_components(self):
+        """測試 /stats 回報各元件是否已建立"""
+        components = self.app.get("/stats").get_json()["components"]
+        self.assertIn("http_client", components)
+        self.assertTrue(components["analysis"]["initialized"])
 
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
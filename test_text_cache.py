@@ -0,0 +1,73 @@
+import unittest
+import threading
+import time
+from text_cache import TextResultCache, normalize_text
+
+class TestNormalizeText(unittest.TestCase):
+    def test_normalize(self):
+        """測試全形轉半形、移除空白與零寬字元、大小寫摺疊"""
+        self.assertEqual(normalize_text("ＵＳＤＴ 錢\u200b怎麼 轉\ufeff\n"), "usdt錢怎麼轉")
+        self.assertEqual(normalize_text("Hello\u3000World"), normalize_text("hello world"))
+        self.assertEqual(normalize_text(" \u200d "), "")
+
+class TestTextResultCache(unittest.TestCase):
+    def test_hit_and_version(self):
+        """測試正規化後相同的文字命中快取，版本改變後重新分析"""
+        cache = TextResultCache(max_entries=10, ttl=60)
+        calls = []
+
+        def analyze(text):
+            calls.append(text)
+            return {"text": text}
+
+        for text in ["錢怎麼轉", "錢 怎麼轉", "錢\u200b怎麼轉"]:
+            normalized = normalize_text(text)
+            self.assertEqual(cache.get_or_compute("v1", normalized, lambda: analyze(normalized)), {"text": "錢怎麼轉"})
+        self.assertEqual(len(calls), 1)
+        cache.get_or_compute("v2", "錢怎麼轉", lambda: analyze("錢怎麼轉"))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_errors_not_cached(self):
+        """測試 cacheable 回傳 False 的結果（錯誤）不快取"""
+        cache = TextResultCache(max_entries=10, ttl=60)
+        results = iter([{"label": "unknown"}, {"label": "scam"}, {"label": "safe"}])
+        cacheable = lambda result: result["label"] != "unknown"
+        self.assertEqual(cache.get_or_compute("v", "a", lambda: next(results), cacheable)["label"], "unknown")
+        self.assertEqual(cache.get_or_compute("v", "a", lambda: next(results), cacheable)["label"], "scam")
+        self.assertEqual(cache.get_or_compute("v", "a", lambda: next(results), cacheable)["label"], "scam")
+
+    def test_concurrent_requests_coalesced(self):
+        """測試同時間相同的請求只實際呼叫一次上游"""
+        cache = TextResultCache(max_entries=10, ttl=60)
+        calls = []
+        release = threading.Event()
+
+        def slow_api():
+            calls.append(1)
+            release.wait(5)
+            return {"label": "scam"}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("v", "x", slow_api)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"label": "scam"}] * 5)
+        self.assertEqual(cache.stats()["coalesced"], 4)
+
+    def test_disabled(self):
+        """測試大小設為 0 時不快取"""
+        cache = TextResultCache(max_entries=0)
+        calls = []
+        for _ in range(2):
+            cache.get_or_compute("v", "a", lambda: calls.append(1))
+        self.assertEqual(len(calls), 2)
+
+if __name__ == '__main__':
+    unittest.main()
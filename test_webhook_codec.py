@@ -0,0 +1,38 @@
+import unittest
+import base64
+import hashlib
+import hmac
+import json
+import webhook_codec
+
+class TestWebhookCodec(unittest.TestCase):
+    def test_verify_raw_bytes(self):
+        """測試直接對原始 bytes 驗證簽名，結果與原本 str 的算法相同"""
+        key = b"secret"
+        body = json.dumps({"events": [{"message": {"text": "轉帳給我"}}]}, ensure_ascii=False).encode("utf-8")
+        expected = base64.b64encode(hmac.new(key, body, hashlib.sha256).digest()).decode("utf-8")
+
+        self.assertTrue(webhook_codec.verify(key, body, expected))
+        self.assertTrue(webhook_codec.verify(key, body, expected.encode("ascii")))
+        self.assertFalse(webhook_codec.verify(key, body + b" ", expected))
+        self.assertFalse(webhook_codec.verify(key, body, "不是簽名"))
+
+    def test_loads_bytes(self):
+        """測試 bytes、memoryview 與 str 都能解析，且兩種後端結果一致"""
+        body = json.dumps({"events": [{"type": "message", "message": {"text": "你好"}}]},
+                          ensure_ascii=False).encode("utf-8")
+        expected = json.loads(body.decode("utf-8"))
+        self.assertEqual(webhook_codec.loads(body), expected)
+        self.assertEqual(webhook_codec.loads(memoryview(body)), expected)
+        self.assertEqual(webhook_codec.json_loads(memoryview(body)), expected)
+        self.assertEqual(webhook_codec.json_loads(body.decode("utf-8")), expected)
+
+    def test_event_routing(self):
+        """測試路由欄位在缺少 message / source 時使用預設值"""
+        event = {"type": "message", "replyToken": "r1",
+                 "source": {"userId": "U1"}, "message": {"type": "image", "id": "1"}}
+        self.assertEqual(webhook_codec.event_routing(event), ("message", "image", "r1", "U1"))
+        self.assertEqual(webhook_codec.event_routing({"type": "unfollow"}), ("unfollow", "", None, ""))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,7 @@
+# === 測試用的時鐘：取代 time.time / time.monotonic，由測試直接調整 now ===
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,66 @@
+import hashlib
+import time
+import unicodedata
+
+from cache_utils import TTLCache, SingleFlight
+
+_MISSING = object()
+
+# 零寬字元與軟連字號：常被插進關鍵字中間來躲避比對
+ZERO_WIDTH_CHARS = "\u00ad\u180e\u200b\u200c\u200d\u2060\ufeff"
+_STRIP_ZERO_WIDTH = dict.fromkeys(map(ord, ZERO_WIDTH_CHARS))
+
+
+def normalize_text(text):
+    """全形轉半形（NFKC）、移除所有空白與零寬字元、大小寫摺疊。
+
+    詐騙話術常被複製貼上，只差在空白、全形字或插入零寬字元；
+    正規化後相同的訊息共用同一筆分析結果，關鍵字也以相同方式正規化後比對。
+    """
+    text = unicodedata.normalize("NFKC", text).translate(_STRIP_ZERO_WIDTH)
+    return "".join(text.split()).casefold()
+
+
+# === 文字分析結果快取（正規化文字 + 分析器版本） ===
+class TextResultCache:
+    """以「版本 + 正規化文字」為鍵值快取分析結果（TTL + LRU），
+    同時間相同鍵值的請求只實際分析一次，其餘等待同一個結果。
+
+    version 應包含分析器與關鍵字的版本，任一更新後舊結果自然不再命中。
+    回傳的結果為共用物件，呼叫端不要修改。
+    """
+
+    def __init__(self, max_entries=10000, ttl=600.0, clock=time.monotonic):
+        self.enabled = max_entries > 0
+        self._cache = TTLCache(max_entries=max(1, max_entries), ttl=ttl, clock=clock)
+        self._flight = SingleFlight()
+
+    @staticmethod
+    def key(version, normalized):
+        # 長訊息也只佔固定大小的鍵值
+        return hashlib.blake2b(f"{version}\0{normalized}".encode("utf-8"), digest_size=16).digest()
+
+    def get_or_compute(self, version, normalized, compute, cacheable=None):
+        """命中時直接回傳；否則呼叫 compute()，cacheable(result) 為 False 的結果（例如錯誤）不快取"""
+        if not self.enabled:
+            return compute()
+        key = self.key(version, normalized)
+        result = self._cache.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+
+        def load():
+            result = compute()
+            if cacheable is None or cacheable(result):
+                self._cache.set(key, result)
+            return result
+
+        return self._flight.do(key, load)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["coalesced"] = self._flight.coalesced
+        return stats
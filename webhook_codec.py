@@ -0,0 +1,59 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # 選用：安裝 orjson 後自動使用較快的 JSON 解析
+    orjson = None
+
+
+# === JSON 解析：直接從 bytes 解析，不先轉成 str ===
+# WEBHOOK_JSON_BACKEND=auto（預設，有 orjson 就用）、orjson 或 json
+def _pick_backend(name):
+    if name == "orjson" and orjson is None:
+        raise ValueError("WEBHOOK_JSON_BACKEND=orjson 但尚未安裝 orjson")
+    if name in ("orjson", "json"):
+        return name
+    return "orjson" if orjson is not None else "json"
+
+JSON_BACKEND = _pick_backend(os.getenv("WEBHOOK_JSON_BACKEND", "auto"))
+
+def json_loads(data):
+    """標準函式庫的解析：json.loads(bytes) 會用 surrogatepass 解碼，比嚴格的 UTF-8 解碼慢，
+    LINE 的 webhook 固定是 UTF-8，直接解碼後再解析"""
+    if not isinstance(data, str):
+        data = str(data, "utf-8")
+    return json.loads(data)
+
+def loads(data):
+    """data 可以是 bytes、memoryview 或 str"""
+    if JSON_BACKEND == "orjson":
+        return orjson.loads(data)
+    return json_loads(data)
+
+
+# === LINE 簽名：對原始 bytes 計算 HMAC-SHA256 ===
+def sign(key, body):
+    """key 與 body 皆為 bytes，回傳 base64 編碼的簽名（bytes）"""
+    return base64.b64encode(hmac.new(key, body, hashlib.sha256).digest())
+
+def verify(key, body, signature):
+    if isinstance(signature, str):
+        signature = signature.encode("ascii", errors="replace")
+    return hmac.compare_digest(sign(key, body), signature)
+
+
+# === 事件的路由欄位：請求執行緒只讀取這幾個欄位，訊息內容留給背景工作處理 ===
+def event_routing(event):
+    """回傳 (事件類型, 訊息類型, replyToken, userId)"""
+    message = event.get("message")
+    source = event.get("source")
+    return (
+        event.get("type", ""),
+        message.get("type", "") if message else "",
+        event.get("replyToken"),
+        source.get("userId", "") if source else "",
+    )